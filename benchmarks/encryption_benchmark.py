@@ -0,0 +1,239 @@
+"""Benchmarks of encrypt_string and decrypt_string.
+
+Every operation is timed across plaintext sizes and KDF specs, both called
+one after another in this thread and through `run_crypto`, the way the bot
+runs them in the crypto executor. The report is written as JSON, and can be
+compared with an earlier report to catch regressions:
+
+    python benchmarks/encryption_benchmark.py --output report.json
+    python benchmarks/encryption_benchmark.py --baseline report.json
+
+The bot's environment (.env) must be set, as the constants are imported.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import sys
+import time
+from functools import partial
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import cryptography  # noqa: E402
+from cryptography.hazmat.backends.openssl import backend  # noqa: E402
+
+import encryption  # noqa: E402
+from constants import ENCRYPTION_MAX_PENDING, ENCRYPTION_WORKERS  # noqa: E402
+
+KEY = "benchmark key"
+DEFAULT_SIZES = [16, 256, 1024, 4000]  # 4000 is the most a modal text input takes
+DEFAULT_KDFS = [encryption.KDF, "pbkdf2$i=100000", "scrypt$n=16384,r=8,p=1"]
+
+
+def percentile(latencies: list[float], q: float) -> float:
+    """Return the nearest-rank percentile `q` (0 to 100) of sorted latencies"""
+    rank = max(1, math.ceil(q / 100 * len(latencies)))
+    return latencies[rank - 1]
+
+
+def summarize(
+    latencies: list[float], elapsed: float, size: int, rejected: int = 0
+) -> dict:
+    """
+    Summarize the latencies of a run.
+
+    Args:
+        latencies: The seconds of every completed call.
+        elapsed: The wall-clock seconds of the whole run.
+        size: The plaintext size in bytes.
+        rejected: The calls `run_crypto` turned away as busy.
+
+    Returns:
+        dict: The throughput and latency percentiles in milliseconds.
+    """
+    latencies = sorted(latencies)
+    return {
+        "calls": len(latencies),
+        "rejected": rejected,
+        "ops_per_sec": len(latencies) / elapsed,
+        "bytes_per_sec": len(latencies) * size / elapsed,
+        "latency_ms": {
+            "min": latencies[0] * 1000,
+            "p50": percentile(latencies, 50) * 1000,
+            "p90": percentile(latencies, 90) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": latencies[-1] * 1000,
+            "mean": sum(latencies) / len(latencies) * 1000,
+        },
+    }
+
+
+def operations(kdf: str, size: int, rounds: int) -> dict[str, list]:
+    """
+    Return the calls to time of each operation.
+
+    Decryption is timed on a fresh ciphertext for every call, so the key is
+    derived each time, and on one ciphertext over and over, so the key
+    comes from the key cache after the first call.
+    """
+    plaintext = "x" * size
+    ciphertexts = [
+        encryption.encrypt_string(plaintext, KEY, kdf) for _ in range(rounds)
+    ]
+    encrypt = partial(encryption.encrypt_string, kdf=kdf)
+    return {
+        "encrypt": [(encrypt, plaintext)] * rounds,
+        "decrypt": [(encryption.decrypt_string, text) for text in ciphertexts],
+        "decrypt_cached": [(encryption.decrypt_string, ciphertexts[0])] * rounds,
+    }
+
+
+def run_single(calls: list) -> tuple[list[float], float, int]:
+    latencies = []
+    start = time.perf_counter()
+    for func, text in calls:
+        call_start = time.perf_counter()
+        func(text, KEY)
+        latencies.append(time.perf_counter() - call_start)
+    return latencies, time.perf_counter() - start, 0
+
+
+async def run_pooled(calls: list, concurrency: int) -> tuple[list[float], float, int]:
+    """Run the calls through `run_crypto` from `concurrency` clients at once"""
+    latencies = []
+    rejected = 0
+    pending = iter(calls)
+
+    async def client():
+        nonlocal rejected
+        for func, text in pending:
+            call_start = time.perf_counter()
+            if await encryption.run_crypto(func, text, KEY) is None:
+                rejected += 1
+            else:
+                latencies.append(time.perf_counter() - call_start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, rejected
+
+
+def run_benchmarks(
+    kdfs: list[str], sizes: list[int], rounds: int, concurrency: int
+) -> list[dict]:
+    results = []
+    for kdf in kdfs:
+        for size in sizes:
+            for name, calls in operations(kdf, size, rounds).items():
+                for mode in ("single", "pooled"):
+                    encryption.key_cache.clear()
+                    if mode == "single":
+                        latencies, elapsed, rejected = run_single(calls)
+                    else:
+                        latencies, elapsed, rejected = asyncio.run(
+                            run_pooled(calls, concurrency)
+                        )
+                    result = {"kdf": kdf, "size": size, "operation": name, "mode": mode}
+                    result.update(summarize(latencies, elapsed, size, rejected))
+                    results.append(result)
+                    print(
+                        f"{kdf:<28} {size:>6} B {name:<15} {mode:<7}"
+                        f" {result['ops_per_sec']:9.1f} ops/s"
+                        f"  p50 {result['latency_ms']['p50']:8.2f} ms"
+                        f"  p99 {result['latency_ms']['p99']:8.2f} ms",
+                        file=sys.stderr,
+                    )
+    return results
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Return the results whose median latency regressed against a baseline.
+
+    Args:
+        report: The report of this run.
+        baseline: An earlier report.
+        tolerance: The fraction by which a median latency may grow.
+
+    Returns:
+        list[str]: A line for each regression, empty if there is none.
+    """
+
+    def key(result: dict) -> tuple:
+        return result["kdf"], result["size"], result["operation"], result["mode"]
+
+    before = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        old_p50, new_p50 = old["latency_ms"]["p50"], result["latency_ms"]["p50"]
+        if new_p50 > old_p50 * (1 + tolerance):
+            name = " ".join(map(str, key(result)))
+            regressions.append(f"{name}: p50 {old_p50:.2f} ms -> {new_p50:.2f} ms")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kdf", action="append", help="KDF spec, may be repeated")
+    parser.add_argument("--size", action="append", type=int, help="plaintext bytes")
+    parser.add_argument("--rounds", type=int, default=20, help="calls per benchmark")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=ENCRYPTION_MAX_PENDING,
+        help="clients calling run_crypto at once in the pooled mode",
+    )
+    parser.add_argument("--output", help="report file, stdout by default")
+    parser.add_argument("--baseline", help="earlier report to compare with")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed growth of a median"
+    )
+    args = parser.parse_args()
+
+    kdfs = list(dict.fromkeys(args.kdf or DEFAULT_KDFS))
+    sizes = args.size or DEFAULT_SIZES
+    report = {
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "cryptography": cryptography.__version__,
+            "openssl": backend.openssl_version_text(),
+        },
+        "settings": {
+            "rounds": args.rounds,
+            "concurrency": args.concurrency,
+            "workers": ENCRYPTION_WORKERS,
+            "max_pending": ENCRYPTION_MAX_PENDING,
+        },
+        "kdf_ms": {kdf: encryption.time_kdf(kdf) * 1000 for kdf in kdfs},
+        "results": run_benchmarks(kdfs, sizes, args.rounds, args.concurrency),
+    }
+    encryption.shutdown_crypto_executor()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"Regression: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
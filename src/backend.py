@@ -4,6 +4,10 @@ from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI
 
+from encryption import shutdown_crypto_executor
+from firebase_manager import shutdown_executor
+from http_client import close_http_client
+from log_pipeline import audit_log
 from payment.payment_logic import terminate_worker
 
 
@@ -15,7 +19,11 @@ async def lifespan(app: FastAPI):
 
     # Shutdown code here
     logging.info("FastAPI is shutting down!")
+    await audit_log.close()
     terminate_worker()
+    shutdown_executor()
+    shutdown_crypto_executor()
+    await close_http_client()
 
 
 app = FastAPI(lifespan=lifespan)
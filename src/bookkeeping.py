@@ -1,9 +1,10 @@
 import firebase_manager
 from constants import ROUND_OFF_DP
+from expression import evaluate_amount
 from utils import B, amt_parser, is_valid_amount
 
 
-def add_bookkeeping_record(message) -> str:
+async def add_bookkeeping_record(message) -> str:
     """Add a bookkeeping record and return a response message.
 
     Args:
@@ -25,12 +26,20 @@ def add_bookkeeping_record(message) -> str:
     if not is_valid_amount(amount):
         return B("Invalid amount. Must be a number")
 
-    amount = round(eval(amt_parser(msg[4])), ROUND_OFF_DP)
+    try:
+        amount = evaluate_amount(amt_parser(msg[4]), ROUND_OFF_DP)
+    except (ZeroDivisionError, ValueError, SyntaxError):
+        return B("Invalid amount. Must be a number")
     if amount <= 0:
         return B("Amount must be greater than 0")
 
-    firebase_manager.add_bookkeeping_record(
-        username, record_type, category, name, amount
+    await firebase_manager.run_in_executor(
+        firebase_manager.add_bookkeeping_record,
+        username,
+        record_type,
+        category,
+        name,
+        amount,
     )
     return B("Bookkeeping record added successfully")
 
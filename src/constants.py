@@ -1,4 +1,5 @@
 import os
+import socket
 
 import pytz
 from dotenv import load_dotenv
@@ -10,6 +11,15 @@ INIT_STATE = os.getenv("INIT_STATE", "false").lower() == "true"
 BOT_KEY = os.getenv("BOT_KEY")
 PAYMENT_CHANNEL_ID = int(os.getenv("PAYMENT_CHANNEL_ID"))
 LOG_CHANNEL_ID = int(os.getenv("LOG_CHANNEL_ID"))
+# guilds with a ledger of their own, as "guild id:payment channel id:log channel id,..."
+LEDGER_GUILDS = {
+    int(guild): (int(payment_channel), int(log_channel))
+    for guild, payment_channel, log_channel in (
+        entry.split(":") for entry in os.getenv("LEDGER_GUILDS", "").split(",") if entry
+    )
+}
+LEDGER_CACHE_SIZE = int(os.getenv("LEDGER_CACHE_SIZE", "8"))  # guild ledgers kept loaded
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None  # None lets discord decide
 BOT_STATUS = "->> !info"
 UNIFIED_CURRENCY = "HKD"
 VALID_CHARS_SET = set("0123456789+-*/.(（）)")
@@ -200,25 +210,63 @@ USER_MAPPING = {  # for mentioning
 
 # digits
 ROUND_OFF_DP = 3
+MAX_AMOUNT = 10**9  # dollars of one amount, far inside the int64 units of a balance
+EXPRESSION_MAX_LENGTH = 200  # characters of an amount expression
+EXPRESSION_MAX_NODES = 100
+EXPRESSION_MAX_EXPONENT = 100
+EXPRESSION_MAX_BITS = 1024  # size of the result of a power
+EXPRESSION_CACHE_SIZE = 1024
 EXCHANGE_RATE_ROUND_OFF_DP = 6
 LOG_SHOW_NUMBER = 10
+RECENT_LOG_BUFFER_SIZE = 200  # latest logs of each type kept in memory
+BALANCE_HISTORY_LIMIT = 10000  # payment logs indexed at start-up for !list at
 MENU_TIMEOUT = 3600.0
 UNDO_TIMEOUT = 3600.0
 ENCRYPTED_DELETE_TIMEOUT = 15
 
+# encryption: key derivation runs in a thread pool, off the event loop
+ENCRYPTION_WORKERS = int(os.getenv("ENCRYPTION_WORKERS", "2"))
+ENCRYPTION_MAX_PENDING = int(os.getenv("ENCRYPTION_MAX_PENDING", "8"))  # running or queued
+KEY_CACHE_SIZE = int(os.getenv("KEY_CACHE_SIZE", "32"))  # derived keys kept for !dec
+KEY_CACHE_TTL = float(os.getenv("KEY_CACHE_TTL", "300"))  # seconds
+# key derivation of new ciphertexts; every ciphertext records its own
+KDF_ALGORITHM = os.getenv("KDF_ALGORITHM", "pbkdf2")  # pbkdf2, scrypt or argon2id
+PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS", "100000"))
+SCRYPT_N = int(os.getenv("SCRYPT_N", "16384"))  # a power of 2, memory is 128 * n * r bytes
+SCRYPT_R = int(os.getenv("SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("SCRYPT_P", "1"))
+ARGON2_TIME = int(os.getenv("ARGON2_TIME", "2"))  # passes over the memory
+ARGON2_MEMORY = int(os.getenv("ARGON2_MEMORY", "19456"))  # KiB
+ARGON2_LANES = int(os.getenv("ARGON2_LANES", "1"))
+# the most costly settings accepted from a ciphertext, so a crafted one cannot stall the bot
+PBKDF2_MAX_ITERATIONS = 2000000
+ARGON2_MAX_TIME = 10
+ARGON2_MAX_LANES = 16
+KDF_MAX_MEMORY = 256 * 1024 * 1024  # bytes of scrypt (times p) or Argon2 memory
+FILE_CHUNK_SIZE = 64 * 1024  # bytes of an attachment encrypted per chunk
+FILE_MAX_SIZE = int(os.getenv("FILE_MAX_SIZE", str(25 * 1024 * 1024)))  # Discord upload limit
+
+# http
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))  # seconds
+
 # koyeb
 KOYEB_PUBLIC_LINK = os.getenv("KOYEB_PUBLIC_LINK")
 TIMEZONE = pytz.timezone(
     "Asia/Hong_Kong"
 )  # ensure consistency between firestore and discord
 
+# storage
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore").lower()  # firestore/sqlite
+SQLITE_PATH = os.getenv("SQLITE_PATH", "payment_bot.db")
+STORAGE_EXECUTOR_WORKERS = int(os.getenv("STORAGE_EXECUTOR_WORKERS", "4"))
+
 # firebase
 FIREBASE_KEY_PATH = "discord-payment-bot-firebase-adminsdk.json"
 FIREBASE_KEY = {
     "type": "service_account",
     "project_id": os.getenv("PROJECT_ID"),
     "private_key_id": os.getenv("PRIVATE_KEY_ID"),
-    "private_key": os.getenv("PRIVATE_KEY").replace("\\n", "\n"),
+    "private_key": os.getenv("PRIVATE_KEY", "").replace("\\n", "\n"),
     "client_email": os.getenv("CLIENT_EMAIL"),
     "client_id": os.getenv("CLIENT_ID"),
     "auth_uri": "https://accounts.google.com/o/oauth2/auth",
@@ -227,9 +275,30 @@ FIREBASE_KEY = {
     "client_x509_cert_url": os.getenv("CLIENT_X509_CERT_URL"),
     "universe_domain": "googleapis.com",
 }
+FIREBASE_LISTENER = os.getenv("FIREBASE_LISTENER", "true").lower() == "true"
+AUDIT_LOG_QUEUE_SIZE = int(os.getenv("AUDIT_LOG_QUEUE_SIZE", "1000"))
+AUDIT_LOG_BATCH_SIZE = int(os.getenv("AUDIT_LOG_BATCH_SIZE", "50"))
+AUDIT_LOG_FLUSH_INTERVAL = float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL", "2"))
+AUDIT_LOG_PUT_TIMEOUT = float(os.getenv("AUDIT_LOG_PUT_TIMEOUT", "0.5"))
+FIREBASE_BATCH_MAX_SIZE = int(os.getenv("FIREBASE_BATCH_MAX_SIZE", "100"))  # < 500 with the commit marker
+FIREBASE_BATCH_MAX_LINGER = float(os.getenv("FIREBASE_BATCH_MAX_LINGER", "0.5"))
+FIREBASE_RETRY_INTERVAL = float(os.getenv("FIREBASE_RETRY_INTERVAL", "5"))  # seconds
+
+# event-sourced ledger: every transaction is stored as an event
+EVENT_SOURCING = os.getenv("EVENT_SOURCING", "false").lower() == "true"
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "100"))  # events
+# one instance at a time writes the events, under a lease renewed while it runs
+EVENT_LEASE_TTL = float(os.getenv("EVENT_LEASE_TTL", "60"))  # seconds
+
+# journal of queued firebase writes, replayed on start-up
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "firebase_queue.journal")
+JOURNAL_FSYNC_INTERVAL = float(os.getenv("JOURNAL_FSYNC_INTERVAL", "0.2"))  # seconds
+JOURNAL_COMPACT_SIZE = int(os.getenv("JOURNAL_COMPACT_SIZE", str(1024 * 1024)))  # bytes
+JOURNAL_ID = os.getenv("JOURNAL_ID", socket.gethostname())  # unique per bot instance
 
 # open exchange rate (for exchange rates)
 OPEN_EXCHANGE_RATE_API_KEY = os.getenv("OPEN_EXCHANGE_RATE_API_KEY")
+EXCHANGE_RATE_TTL = float(os.getenv("EXCHANGE_RATE_TTL", "3600"))  # seconds
 
 # emoji
 EMOJI_MAPPING = {
@@ -291,7 +360,8 @@ BOT_DESCRIPTION = """
 - `!status`: Check whether the bot is currently active.
 - `!switch`: Toggle the bot on or off.
 - `!list`, `!l`: Show the current payment summary for all users.
-- `!history [command_type] [number]`: Show recent logs. `command_type` can be `payment`/`manage`/`read`/`others`/`all`. `number` defaults to 10.
+  - `!list at YYYY-MM-DD`: Show the summary at the end of a past day.
+- `!history [command_type] [number]`: Show recent logs. `command_type` can be `payment`/`manage`/`read`/`others`/`all`. `number` defaults to 10 per page; use the buttons to page through older logs.
 - `!currencies`: List all supported currency codes.
 ### Payment management
 - `!create <name>`: Create a new user in the payment system. Use this in the payment channel.
@@ -306,6 +376,7 @@ BOT_DESCRIPTION = """
   - `sc`: Add a 10% service charge.
   - `[reason]`: Optional free-form note.
   - Example: `!pm pplA,pplB owe pplC 10 -CNY sc example reason`
+- `!settle`: Show the fewest paybacks that settle everyone; `!settle apply` records them.
 ### Utilities
 - `!encrypt`: Open the encryption modal to encrypt a message with a key.
 - `!decrypt`: Open the decryption modal to decrypt a message with a key.
@@ -1,19 +1,253 @@
+import asyncio
 import base64
+import hmac
+import logging
 import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 
 import discord
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from discord.ext import commands
 
-from constants import ENCRYPTED_DELETE_TIMEOUT
+from constants import (
+    ARGON2_LANES,
+    ARGON2_MAX_LANES,
+    ARGON2_MAX_TIME,
+    ARGON2_MEMORY,
+    ARGON2_TIME,
+    ENCRYPTED_DELETE_TIMEOUT,
+    ENCRYPTION_MAX_PENDING,
+    ENCRYPTION_WORKERS,
+    FILE_CHUNK_SIZE,
+    FILE_MAX_SIZE,
+    KDF_ALGORITHM,
+    KDF_MAX_MEMORY,
+    KEY_CACHE_SIZE,
+    KEY_CACHE_TTL,
+    PBKDF2_ITERATIONS,
+    PBKDF2_MAX_ITERATIONS,
+    SCRYPT_N,
+    SCRYPT_P,
+    SCRYPT_R,
+)
+from http_client import get_http_client
+
+# PBKDF2 and Fernet run in OpenSSL, which releases the GIL, so threads suffice
+crypto_executor = ThreadPoolExecutor(
+    max_workers=ENCRYPTION_WORKERS, thread_name_prefix="crypto"
+)
+crypto_slots = asyncio.Semaphore(ENCRYPTION_MAX_PENDING)
+BUSY_TEXT = "⚠️ Too many encryption requests, please try again later"
+
+
+def zero(buffer: bytearray) -> None:
+    buffer[:] = bytes(len(buffer))
+
+
+class KeyCache:
+    """A small cache of the keys derived to decrypt, in memory only.
+
+    Members decrypt the same ciphertext again and again, so the key derived
+    from its KDF, salt and the key string is kept for `ttl` seconds. Entries
+    are looked up by an HMAC of these under a random secret
+    of the process, and overwritten with zeros when they expire or are
+    evicted as the least recently used of more than `size`.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.secret = os.urandom(32)
+        self.entries: OrderedDict[bytes, tuple[float, bytearray]] = OrderedDict()
+        self.lock = threading.Lock()  # used from the crypto executor threads
+
+    def _entry_id(self, kdf: str, salt: bytes, key_bytes: bytes) -> bytes:
+        # a KDF spec never holds a NUL and the salt has a fixed size
+        message = kdf.encode() + b"\0" + salt + key_bytes
+        return hmac.digest(self.secret, message, "sha256")
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for entry_id, (expires, _) in list(self.entries.items()):
+            if expires <= now:
+                zero(self.entries.pop(entry_id)[1])
+
+    def get(self, kdf: str, salt: bytes, key_bytes: bytes) -> bytes | None:
+        """Return the key derived from a salt and key string, if cached"""
+        entry_id = self._entry_id(kdf, salt, key_bytes)
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(entry_id)
+            if entry is None:
+                return None
+            self.entries.move_to_end(entry_id)
+            return bytes(entry[1])
+
+    def put(self, kdf: str, salt: bytes, key_bytes: bytes, derived: bytes) -> None:
+        """Cache the key derived from a salt and key string"""
+        entry_id = self._entry_id(kdf, salt, key_bytes)
+        with self.lock:
+            self._expire()
+            if entry_id in self.entries:
+                zero(self.entries.pop(entry_id)[1])
+            self.entries[entry_id] = (time.monotonic() + self.ttl, bytearray(derived))
+            while len(self.entries) > self.size:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                zero(evicted)
+
+    def clear(self) -> None:
+        with self.lock:
+            for _, derived in self.entries.values():
+                zero(derived)
+            self.entries.clear()
+
+
+key_cache = KeyCache(KEY_CACHE_SIZE, KEY_CACHE_TTL)
+
+
+# KDF specs are the algorithm and its cost, like "scrypt$n=16384,r=8,p=1"
+KDF_PARAMS = {"pbkdf2": ("i",), "scrypt": ("n", "r", "p"), "argon2id": ("t", "m", "p")}
+LEGACY_KDF = "pbkdf2$i=100000"  # of the ciphertexts without an envelope
+ENVELOPE_VERSION = "2"  # the legacy unversioned blob being version 1
+
+
+def parse_kdf(spec: str) -> tuple[str, dict[str, int]]:
+    """
+    Parse and check a KDF spec.
 
+    Args:
+        spec: The KDF spec, from the configuration or a ciphertext.
 
-def encrypt_string(plaintext: str, key: str) -> str:
+    Returns:
+        tuple[str, dict[str, int]]: The algorithm and its parameters.
+
+    Raises:
+        ValueError: If the spec is invalid or costs more than the limits
+            in constants.
     """
-    Encrypts a string using a key string.
-    Returns base64-encoded encrypted string with embedded salt.
+    name, _, text = spec.partition("$")
+    try:
+        params = {k: int(v) for k, v in (param.split("=") for param in text.split(","))}
+    except ValueError:
+        raise ValueError(f"Invalid KDF spec {spec!r}") from None
+    if tuple(params) != KDF_PARAMS.get(name) or min(params.values()) < 1:
+        raise ValueError(f"Invalid KDF spec {spec!r}")
+
+    if name == "pbkdf2":
+        too_costly = params["i"] > PBKDF2_MAX_ITERATIONS
+    elif name == "scrypt":
+        n, r, p = params["n"], params["r"], params["p"]
+        if n < 2 or n & (n - 1):
+            raise ValueError(f"Invalid KDF spec {spec!r}")
+        too_costly = 128 * n * r * p > KDF_MAX_MEMORY
+    else:
+        t, m, p = params["t"], params["m"], params["p"]
+        if m < 8 * p:
+            raise ValueError(f"Invalid KDF spec {spec!r}")
+        too_costly = (
+            t > ARGON2_MAX_TIME or p > ARGON2_MAX_LANES or m * 1024 > KDF_MAX_MEMORY
+        )
+    if too_costly:
+        raise ValueError(f"KDF spec {spec!r} costs more than allowed")
+    return name, params
+
+
+def kdf_spec(algorithm: str) -> str:
+    """Return the spec of an algorithm at the cost configured in constants"""
+    params = {
+        "pbkdf2": f"i={PBKDF2_ITERATIONS}",
+        "scrypt": f"n={SCRYPT_N},r={SCRYPT_R},p={SCRYPT_P}",
+        "argon2id": f"t={ARGON2_TIME},m={ARGON2_MEMORY},p={ARGON2_LANES}",
+    }
+    if algorithm not in params:
+        raise ValueError(f"Unknown KDF algorithm {algorithm!r}")
+    spec = f"{algorithm}${params[algorithm]}"
+    parse_kdf(spec)
+    return spec
+
+
+KDF = kdf_spec(KDF_ALGORITHM)  # of new ciphertexts
+
+
+def derive_key(key_bytes: bytes, salt: bytes, kdf: str) -> bytes:
+    """Derive a 32-byte key from a key string with the KDF of a spec"""
+    name, params = parse_kdf(kdf)
+    if name == "pbkdf2":
+        deriver = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=params["i"],
+        )
+    elif name == "scrypt":
+        deriver = Scrypt(
+            salt=salt, length=32, n=params["n"], r=params["r"], p=params["p"]
+        )
+    else:
+        deriver = Argon2id(
+            salt=salt,
+            length=32,
+            iterations=params["t"],
+            lanes=params["p"],
+            memory_cost=params["m"],
+        )
+    return deriver.derive(key_bytes)
+
+
+def time_kdf(kdf: str, rounds: int = 5) -> float:
+    """Return the median seconds of deriving a key with a KDF spec on this host"""
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        derive_key(b"benchmark", os.urandom(16), kdf)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def seal_envelope(kdf: str, payload: bytes) -> str:
+    """Return the text of a payload with the envelope version and its KDF"""
+    encoded = base64.urlsafe_b64encode(payload).decode("utf-8")
+    return f"${ENVELOPE_VERSION}${kdf}${encoded}"
+
+
+def open_envelope(text: str) -> tuple[str, bytes]:
+    """
+    Read the KDF and payload of an encrypted text.
+
+    Args:
+        text: A text of `seal_envelope`, or a legacy base64 blob, which
+            never starts with "$" as it is not in the base64 alphabet.
+
+    Returns:
+        tuple[str, bytes]: The KDF spec and the payload.
+    """
+    if not text.startswith("$"):
+        return LEGACY_KDF, base64.urlsafe_b64decode(text.encode("utf-8"))
+    parts = text.split("$")
+    if len(parts) != 5 or parts[1] != ENVELOPE_VERSION:
+        raise ValueError("Unsupported envelope")
+    _, _, name, params, encoded = parts
+    return f"{name}${params}", base64.urlsafe_b64decode(encoded.encode("utf-8"))
+
+
+def encrypt_string(plaintext: str, key: str, kdf: str = KDF) -> str:
+    """
+    Encrypts a string using a key string, with the configured KDF by default.
+    Returns the envelope of the KDF and the base64-encoded salt and
+    encrypted data.
     """
     # Convert strings to bytes
     plaintext_bytes = plaintext.encode("utf-8")
@@ -22,58 +256,261 @@ def encrypt_string(plaintext: str, key: str) -> str:
     # Generate a random salt for each encryption
     salt = os.urandom(16)
 
-    # Generate a proper length key using PBKDF2
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-    )
-    fernet_key = base64.urlsafe_b64encode(kdf.derive(key_bytes))
+    # Generate a proper length key with the KDF
+    fernet_key = base64.urlsafe_b64encode(derive_key(key_bytes, salt, kdf))
 
     # Create the cipher and encrypt
     cipher = Fernet(fernet_key)
     encrypted_bytes = cipher.encrypt(plaintext_bytes)
 
     # Combine salt and encrypted data (salt first, then encrypted data)
-    result = base64.urlsafe_b64encode(salt + encrypted_bytes)
-
-    # Return as a string
-    return result.decode("utf-8")
+    return seal_envelope(kdf, salt + encrypted_bytes)
 
 
 def decrypt_string(encrypted_text: str, key: str) -> str:
     """
     Decrypts a previously encrypted string using the same key.
-    Extracts the embedded salt from the encrypted data.
+    Extracts the KDF and the embedded salt from the encrypted data.
     """
     try:
-        # Convert to bytes and decode from base64
-        combined_bytes = base64.urlsafe_b64decode(encrypted_text.encode("utf-8"))
+        # Read the envelope, if any, and decode from base64
+        kdf, combined_bytes = open_envelope(encrypted_text)
         key_bytes = key.encode("utf-8")
 
         # Extract the salt (first 16 bytes) and the encrypted data
         salt = combined_bytes[:16]
         encrypted_bytes = combined_bytes[16:]
 
-        # Regenerate the key using the extracted salt
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        fernet_key = base64.urlsafe_b64encode(kdf.derive(key_bytes))
+        # Regenerate the key using the extracted salt, unless recently derived
+        derived = key_cache.get(kdf, salt, key_bytes)
+        cached = derived is not None
+        if not cached:
+            derived = derive_key(key_bytes, salt, kdf)
 
         # Decrypt
-        cipher = Fernet(fernet_key)
+        cipher = Fernet(base64.urlsafe_b64encode(derived))
         decrypted_bytes = cipher.decrypt(encrypted_bytes)
+        if not cached:  # only keys that decrypted something
+            key_cache.put(kdf, salt, key_bytes, derived)
 
         return decrypted_bytes.decode("utf-8")
     except Exception as e:
         return f"Decryption failed: {str(e)}"
 
 
+FILE_MAGIC_V1 = b"DPBF\x01"  # of files keyed with LEGACY_KDF
+FILE_MAGIC = b"DPBF\x02"  # format and version of encrypted files
+TAG_SIZE = 16
+
+
+def file_header(kdf: str, salt: bytes, prefix: bytes, chunk_size: int) -> bytes:
+    """Return the header of a file: magic, KDF spec, salt, nonce prefix, chunk size"""
+    spec = kdf.encode()
+    size = chunk_size.to_bytes(4, "big")
+    return FILE_MAGIC + bytes([len(spec)]) + spec + salt + prefix + size
+
+
+class FileCipher(ABC):
+    """Encrypts or decrypts a file chunk by chunk with AES-GCM.
+
+    An encrypted file is a header of the KDF and salt of the key, a random
+    nonce prefix and the chunk size, followed by the chunks, each sealed
+    with its own tag. The nonce of a chunk is the prefix, its index and a
+    flag set only on the last chunk, and the header is the associated data
+    of every chunk, so chunks cannot be reordered, dropped, truncated at the
+    end or moved between files without failing to decrypt. Only one chunk
+    is buffered at a time, whatever the size of the file.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.counter = 0
+        self.aead: AESGCM | None = None
+        self.prefix = b""
+        self.header = b""
+
+    def _start(
+        self,
+        key_bytes: bytes,
+        kdf: str,
+        salt: bytes,
+        prefix: bytes,
+        chunk_size: int,
+        header: bytes,
+    ) -> None:
+        if not 0 < chunk_size <= 16 * FILE_CHUNK_SIZE:
+            raise ValueError("Invalid chunk size")
+        self.aead = AESGCM(derive_key(key_bytes, salt, kdf))
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.header = header
+
+    def _nonce(self, final: bool) -> bytes:
+        if self.counter >= 2**32:
+            raise ValueError("File too large")
+        nonce = self.prefix + self.counter.to_bytes(4, "big") + bytes([final])
+        self.counter += 1
+        return nonce
+
+    @abstractmethod
+    def _process(self, chunk: bytes, final: bool) -> bytes:
+        """Encrypt or decrypt the next chunk"""
+
+    def _drain(self, block_size: int) -> bytes:
+        # the last block is kept back, as only finalize knows it is the last
+        out = []
+        while len(self.buffer) > block_size:
+            out.append(self._process(bytes(self.buffer[:block_size]), False))
+            del self.buffer[:block_size]
+        return b"".join(out)
+
+    def finalize(self) -> bytes:
+        chunk = bytes(self.buffer)
+        self.buffer.clear()
+        return self._process(chunk, True)
+
+
+class FileEncryptor(FileCipher):
+    def __init__(self, key: str, chunk_size: int = FILE_CHUNK_SIZE):
+        super().__init__()
+        salt, prefix = os.urandom(16), os.urandom(7)
+        header = file_header(KDF, salt, prefix, chunk_size)
+        self._start(key.encode("utf-8"), KDF, salt, prefix, chunk_size, header)
+
+    def _process(self, chunk: bytes, final: bool) -> bytes:
+        return self.aead.encrypt(self._nonce(final), chunk, self.header)
+
+    def update(self, data: bytes) -> bytes:
+        """Return the encrypted chunks completed by the data"""
+        self.buffer += data
+        return self._drain(self.chunk_size)
+
+
+class FileDecryptor(FileCipher):
+    def __init__(self, key: str):
+        super().__init__()
+        self.key_bytes = key.encode("utf-8")
+
+    def _process(self, chunk: bytes, final: bool) -> bytes:
+        if self.aead is None:
+            raise ValueError("Not an encrypted file")
+        return self.aead.decrypt(self._nonce(final), chunk, self.header)
+
+    def _read_header(self) -> bool:
+        # version 1 files have no KDF spec, version 2 files one of a length byte
+        magic = bytes(self.buffer[: len(FILE_MAGIC)])
+        if len(self.buffer) <= len(FILE_MAGIC):
+            return False
+        if magic == FILE_MAGIC_V1:
+            kdf, offset = LEGACY_KDF, len(FILE_MAGIC_V1)
+        elif magic == FILE_MAGIC:
+            offset = len(FILE_MAGIC) + 1 + self.buffer[len(FILE_MAGIC)]
+            kdf = self.buffer[len(FILE_MAGIC) + 1 : offset].decode("ascii")
+        else:
+            raise ValueError("Not an encrypted file")
+        size = offset + 16 + 7 + 4
+        if len(self.buffer) < size:
+            return False
+        header = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        salt, prefix = header[offset : offset + 16], header[offset + 16 : offset + 23]
+        chunk_size = int.from_bytes(header[-4:], "big")
+        self._start(self.key_bytes, kdf, salt, prefix, chunk_size, header)
+        return True
+
+    def update(self, data: bytes) -> bytes:
+        """Return the decrypted chunks completed by the data"""
+        self.buffer += data
+        if self.aead is None and not self._read_header():
+            return b""
+        return self._drain(self.chunk_size + TAG_SIZE)
+
+
+def file_name_of(filename: str, decrypt: bool) -> str:
+    if not decrypt:
+        return f"{filename}.enc"
+    if filename.endswith(".enc") and len(filename) > len(".enc"):
+        return filename[: -len(".enc")]
+    return f"decrypted_{filename}"
+
+
+async def crypt_attachment(
+    attachment: discord.Attachment, key: str, decrypt: bool
+) -> discord.File | str:
+    """
+    Stream an attachment through a `FileEncryptor` or `FileDecryptor`.
+
+    The attachment is downloaded chunk by chunk and each chunk is processed
+    in the crypto executor and written to a temporary file, so neither the
+    event loop nor the memory depend on the size of the file.
+
+    Args:
+        attachment: The attachment to encrypt or decrypt.
+        key: The key string.
+        decrypt: Whether to decrypt rather than encrypt.
+
+    Returns:
+        discord.File | str: The resulting file, or a message of why there is none.
+    """
+    if attachment.size > FILE_MAX_SIZE:
+        return f"⚠️ Files over {FILE_MAX_SIZE // (1024 * 1024)} MB are not supported"
+    if crypto_slots.locked():
+        return BUSY_TEXT
+    async with crypto_slots:
+        loop = asyncio.get_running_loop()
+        output = tempfile.TemporaryFile()
+
+        def write(step: Callable[..., bytes], *args) -> None:
+            output.write(step(*args))
+
+        try:
+            # derives the key of an encryptor at once, of a decryptor on its header
+            cipher = await loop.run_in_executor(
+                crypto_executor, FileDecryptor if decrypt else FileEncryptor, key
+            )
+            if not decrypt:
+                output.write(cipher.header)
+            async with get_http_client().stream("GET", attachment.url) as response:
+                response.raise_for_status()
+                async for data in response.aiter_bytes(FILE_CHUNK_SIZE):
+                    await loop.run_in_executor(
+                        crypto_executor, write, cipher.update, data
+                    )
+            await loop.run_in_executor(crypto_executor, write, cipher.finalize)
+        except Exception as e:
+            output.close()
+            logging.error(f"Failed to crypt attachment {attachment.filename}: {e!r}")
+            return "⚠️ Decryption failed" if decrypt else "⚠️ Encryption failed"
+
+    output.seek(0)
+    return discord.File(output, filename=file_name_of(attachment.filename, decrypt))
+
+
+async def run_crypto(func: Callable[[str, str], str], text: str, key: str) -> str | None:
+    """
+    Run `encrypt_string` or `decrypt_string` in the crypto executor.
+
+    Args:
+        func: The function to run.
+        text: The text to encrypt or decrypt.
+        key: The key string.
+
+    Returns:
+        str | None: The result, or None if ENCRYPTION_MAX_PENDING calls are
+        already running or queued, so a burst cannot hold up the bot.
+    """
+    if crypto_slots.locked():
+        return None
+    async with crypto_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(crypto_executor, func, text, key)
+
+
+def shutdown_crypto_executor() -> None:
+    crypto_executor.shutdown(wait=True)
+    key_cache.clear()
+
+
 class EncryptionModal(discord.ui.Modal):
     plaintext_input = discord.ui.TextInput(
         label="Text to encrypt",
@@ -93,7 +530,9 @@ class EncryptionModal(discord.ui.Modal):
         plaintext = self.plaintext_input.value
         key = self.key_input.value
 
-        encrypted_text = encrypt_string(plaintext, key)
+        encrypted_text = await run_crypto(encrypt_string, plaintext, key)
+        if encrypted_text is None:
+            encrypted_text = BUSY_TEXT
 
         await interaction.response.send_message(
             encrypted_text, ephemeral=True, delete_after=ENCRYPTED_DELETE_TIMEOUT
@@ -119,9 +558,11 @@ class DecryptionModal(discord.ui.Modal):
         encrypted_text = self.encrypted_input.value
         key = self.key_input.value
 
-        decrypted_text = decrypt_string(encrypted_text, key)
+        decrypted_text = await run_crypto(decrypt_string, encrypted_text, key)
 
-        if decrypted_text.startswith("Decryption failed"):
+        if decrypted_text is None:
+            decrypted_text = BUSY_TEXT
+        elif decrypted_text.startswith("Decryption failed"):
             decrypted_text = "⚠️ Decryption failed"
 
         await interaction.response.send_message(
@@ -129,9 +570,31 @@ class DecryptionModal(discord.ui.Modal):
         )
 
 
+class AttachmentModal(discord.ui.Modal):
+    key_input = discord.ui.TextInput(
+        label="Secret key", placeholder="Enter your secret key", required=True
+    )
+
+    def __init__(self, attachment: discord.Attachment, decrypt: bool):
+        super().__init__(title="Decrypt File" if decrypt else "Encrypt File")
+        self.attachment = attachment
+        self.decrypt = decrypt
+
+    async def on_submit(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        result = await crypt_attachment(
+            self.attachment, self.key_input.value, self.decrypt
+        )
+        if isinstance(result, str):
+            await interaction.followup.send(result, ephemeral=True)
+        else:
+            await interaction.followup.send(file=result, ephemeral=True)
+
+
 class EncryptButton(discord.ui.Button):
-    def __init__(self):
+    def __init__(self, attachment: discord.Attachment | None = None):
         super().__init__(label="Encrypt", style=discord.ButtonStyle.primary, emoji="🔒")
+        self.attachment = attachment
 
     async def callback(self, interaction: discord.Interaction):
         # Disable the button after it's clicked
@@ -139,15 +602,19 @@ class EncryptButton(discord.ui.Button):
         await interaction.message.edit(view=self.view)
 
         # Show the encryption modal
-        modal = EncryptionModal()
+        if self.attachment is not None:
+            modal = AttachmentModal(self.attachment, decrypt=False)
+        else:
+            modal = EncryptionModal()
         await interaction.response.send_modal(modal)
 
 
 class DecryptButton(discord.ui.Button):
-    def __init__(self):
+    def __init__(self, attachment: discord.Attachment | None = None):
         super().__init__(
             label="Decrypt", style=discord.ButtonStyle.secondary, emoji="🔓"
         )
+        self.attachment = attachment
 
     async def callback(self, interaction: discord.Interaction):
         # Disable the button after it's clicked
@@ -155,47 +622,76 @@ class DecryptButton(discord.ui.Button):
         await interaction.message.edit(view=self.view)
 
         # Show the decryption modal
-        modal = DecryptionModal()
+        if self.attachment is not None:
+            modal = AttachmentModal(self.attachment, decrypt=True)
+        else:
+            modal = DecryptionModal()
         await interaction.response.send_modal(modal)
 
 
 class EncryptView(discord.ui.View):
-    def __init__(self):
+    def __init__(self, attachment: discord.Attachment | None = None):
         super().__init__()
-        self.add_item(EncryptButton())
+        self.add_item(EncryptButton(attachment))
 
 
 class DecryptView(discord.ui.View):
-    def __init__(self):
+    def __init__(self, attachment: discord.Attachment | None = None):
         super().__init__()
-        self.add_item(DecryptButton())
+        self.add_item(DecryptButton(attachment))
 
 
 async def encrypt_command(message: commands.Context):
-    """Command handler for encrypting text"""
+    """Command handler for encrypting text, or the attached file if any"""
+    attachment = next(iter(message.message.attachments), None)
     embed = discord.Embed(
         title="Encryption",
-        description="Click the button below to encrypt a message",
+        description=(
+            f"Click the button below to encrypt {attachment.filename}"
+            if attachment is not None
+            else "Click the button below to encrypt a message"
+        ),
         color=discord.Color.blue(),
     )
 
-    view = EncryptView()
+    view = EncryptView(attachment)
     await message.send(embed=embed, view=view)
 
 
 async def decrypt_command(message: commands.Context):
-    """Command handler for decrypting text"""
+    """Command handler for decrypting text, or the attached file if any"""
+    attachment = next(iter(message.message.attachments), None)
     embed = discord.Embed(
         title="Decryption",
-        description="Click the button below to decrypt a message",
+        description=(
+            f"Click the button below to decrypt {attachment.filename}"
+            if attachment is not None
+            else "Click the button below to decrypt a message"
+        ),
         color=discord.Color.blue(),
     )
 
-    view = DecryptView()
+    view = DecryptView(attachment)
     await message.send(embed=embed, view=view)
 
 
-if __name__ == "__main__":
+if __name__ == "__main__" and sys.argv[1:] == ["kdf"]:
+    # derivation time of the configured KDF and of common settings
+    specs = [
+        KDF,
+        "pbkdf2$i=100000",
+        "pbkdf2$i=600000",
+        "scrypt$n=16384,r=8,p=1",
+        "scrypt$n=65536,r=8,p=1",
+        "argon2id$t=2,m=19456,p=1",
+        "argon2id$t=3,m=65536,p=4",
+    ]
+    for spec in dict.fromkeys(specs):
+        try:
+            print(f"{spec:<28} {time_kdf(spec) * 1000:8.1f} ms")
+        except Exception as e:
+            print(f"{spec:<28} unavailable: {e}")
+elif __name__ == "__main__":
     password = "MyPassword"
     key = "MyKey"
 
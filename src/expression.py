@@ -0,0 +1,148 @@
+import ast
+import math
+import operator
+from fractions import Fraction
+from functools import lru_cache
+
+from constants import (
+    EXPRESSION_CACHE_SIZE,
+    EXPRESSION_MAX_BITS,
+    EXPRESSION_MAX_EXPONENT,
+    EXPRESSION_MAX_LENGTH,
+    EXPRESSION_MAX_NODES,
+    MAX_AMOUNT,
+)
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: operator.pow,
+}
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+class ExpressionError(ValueError):
+    """The expression is not an amount or exceeds the evaluation limits"""
+
+
+def parse(expr: str) -> ast.expr:
+    """
+    Parse an arithmetic expression into a checked AST.
+
+    Args:
+        expr: The expression, e.g. `(120+36)*1.1/3`.
+
+    Returns:
+        ast.expr: The root node of the expression.
+
+    Raises:
+        SyntaxError: The expression is not valid Python syntax.
+        ExpressionError: The expression uses anything but numbers and
+            arithmetic operators, or is too long or too large.
+    """
+    if len(expr) > EXPRESSION_MAX_LENGTH:
+        raise ExpressionError(f"Expression longer than {EXPRESSION_MAX_LENGTH}")
+
+    root = ast.parse(expr.strip(), mode="eval").body
+    nodes = 0
+    for node in ast.walk(root):
+        nodes += 1
+        if isinstance(node, ast.BinOp):
+            if type(node.op) not in BINARY_OPERATORS:
+                raise ExpressionError("Unsupported operator")
+        elif isinstance(node, ast.UnaryOp):
+            if type(node.op) not in UNARY_OPERATORS:
+                raise ExpressionError("Unsupported operator")
+        elif isinstance(node, ast.Constant):
+            if type(node.value) not in (int, float):
+                raise ExpressionError("Only numbers are allowed")
+        elif not isinstance(node, ast.operator | ast.unaryop):
+            raise ExpressionError(f"Unsupported syntax: {type(node).__name__}")
+    if nodes > EXPRESSION_MAX_NODES:
+        raise ExpressionError(f"Expression has more than {EXPRESSION_MAX_NODES} nodes")
+    return root
+
+
+def power(base: Fraction | float, exponent: Fraction | float) -> Fraction | float:
+    """Raise to a power, refusing exponents that would blow up the result"""
+    if abs(exponent) > EXPRESSION_MAX_EXPONENT:
+        raise ExpressionError(f"Exponent larger than {EXPRESSION_MAX_EXPONENT}")
+    if isinstance(base, Fraction):
+        bits = max(base.numerator.bit_length(), base.denominator.bit_length())
+        if bits * abs(exponent) > EXPRESSION_MAX_BITS:
+            raise ExpressionError("Result is too large")
+    try:
+        result = base**exponent
+    except OverflowError as e:
+        raise ExpressionError("Result is too large") from e
+    if isinstance(result, complex):
+        raise ExpressionError("Result is not a real number")
+    return result
+
+
+def bounded(value: Fraction | float) -> Fraction | float:
+    """Return a value, refusing ones beyond EXPRESSION_MAX_BITS or not finite"""
+    if isinstance(value, Fraction):
+        bits = max(value.numerator.bit_length(), value.denominator.bit_length())
+        if bits > EXPRESSION_MAX_BITS:
+            raise ExpressionError("Result is too large")
+    elif not math.isfinite(value):
+        raise ExpressionError("Result is too large")
+    return value
+
+
+def evaluate_node(node: ast.expr) -> Fraction | float:
+    if isinstance(node, ast.Constant):
+        # repr gives back the decimal that was typed, e.g. 0.1 -> 1/10
+        return bounded(Fraction(repr(node.value)))
+    if isinstance(node, ast.UnaryOp):
+        return UNARY_OPERATORS[type(node.op)](evaluate_node(node.operand))
+    left, right = evaluate_node(node.left), evaluate_node(node.right)
+    if isinstance(node.op, ast.Pow):
+        return bounded(power(left, right))
+    try:
+        return bounded(BINARY_OPERATORS[type(node.op)](left, right))
+    except OverflowError as e:  # a Fraction too large for a float operand
+        raise ExpressionError("Result is too large") from e
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def evaluate(expr: str) -> Fraction | float:
+    """
+    Evaluate an arithmetic expression exactly.
+
+    Args:
+        expr: The expression, e.g. `(120+36)*1.1/3`.
+
+    Returns:
+        Fraction | float: The exact value, or a float if a fractional power
+        was taken.
+
+    Raises:
+        SyntaxError: The expression is not valid Python syntax.
+        ZeroDivisionError: The expression divides by zero.
+        ExpressionError: The expression is not an amount or exceeds limits.
+    """
+    return evaluate_node(parse(expr))
+
+
+def evaluate_amount(expr: str, ndigits: int) -> float:
+    """
+    Evaluate an arithmetic expression and round it to `ndigits` places.
+
+    Raises:
+        SyntaxError: The expression is not valid Python syntax.
+        ZeroDivisionError: The expression divides by zero.
+        ExpressionError: The expression is not an amount, exceeds limits,
+            or is larger than MAX_AMOUNT.
+    """
+    value = evaluate(expr)
+    if abs(value) > MAX_AMOUNT:
+        raise ExpressionError(f"Amount larger than {MAX_AMOUNT}")
+    return float(round(value, ndigits))
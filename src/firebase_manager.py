@@ -1,109 +1,279 @@
-import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Literal
+from functools import partial
+from typing import Callable
 
-import firebase_admin
-from firebase_admin import credentials, firestore
-from google.cloud.firestore_v1.base_query import FieldFilter
+from constants import RECENT_LOG_BUFFER_SIZE, STORAGE_EXECUTOR_WORKERS, TIMEZONE
+from recent_logs import RecentLogs
+from storage import LogCursor, LogRef, RecordType, Storage, create_storage
 
-from constants import FIREBASE_KEY, FIREBASE_KEY_PATH, TIMEZONE
+storage = create_storage()
+# the latest logs of each type, so most !history requests need no reads
+recent_logs = RecentLogs(RECENT_LOG_BUFFER_SIZE)
+recent_logs.warm(
+    storage.get_logs(RECENT_LOG_BUFFER_SIZE, None), RECENT_LOG_BUFFER_SIZE
+)
+# the storage and recent logs of each ledger namespace in use, besides the default
+namespaces: dict[str, tuple[Storage, RecentLogs]] = {}
+namespaces_lock = threading.Lock()
+# storage calls of commands run here, so the event loop never waits on them
+executor = ThreadPoolExecutor(
+    max_workers=STORAGE_EXECUTOR_WORKERS, thread_name_prefix="storage"
+)
 
-with open(FIREBASE_KEY_PATH, "w") as f:
-    json.dump(FIREBASE_KEY, f, indent=2)
 
-cred = credentials.Certificate(FIREBASE_KEY_PATH)
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+async def run_in_executor(func: Callable, *args, **kwargs):
+    """Run a blocking storage call in the storage executor and await it"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
 
-users_ref = db.collection("users")
-logs_ref = db.collection("logs")
-bot_ref = db.collection("bot")
-bookkeeping_ref = db.collection("bookkeeping")
 
-RecordType = Literal["expense", "income"]
+def shutdown_executor() -> None:
+    """Wait for the pending storage calls of the executor and stop it"""
+    executor.shutdown(wait=True)
 
 
-def fetch_payment_list() -> dict:
+def open_namespace(namespace: str | None) -> tuple[Storage, RecentLogs]:
     """
-    Fetch all user balances from the Firestore users collection.
+    Return the storage and recent logs of a ledger namespace, opening it on first use.
+
+    Args:
+        namespace: The name of the namespace, or None for the default one.
+
+    Returns:
+        tuple[Storage, RecentLogs]: The storage of the namespace and the
+        buffer of its latest logs.
+    """
+    if namespace is None:
+        return storage, recent_logs
+    with namespaces_lock:
+        if namespace not in namespaces:
+            namespace_storage = storage.namespace(namespace)
+            namespace_logs = RecentLogs(RECENT_LOG_BUFFER_SIZE)
+            namespace_logs.warm(
+                namespace_storage.get_logs(RECENT_LOG_BUFFER_SIZE, None),
+                RECENT_LOG_BUFFER_SIZE,
+            )
+            namespaces[namespace] = namespace_storage, namespace_logs
+        return namespaces[namespace]
+
+
+def close_namespace(namespace: str) -> None:
+    """Close the storage of a ledger namespace and drop its recent logs"""
+    with namespaces_lock:
+        opened = namespaces.pop(namespace, None)
+    if opened is not None:
+        opened[0].close()
+
+
+def fetch_payment_list(namespace: str | None = None) -> dict:
+    """
+    Fetch all user balances from the storage.
+
+    Args:
+        namespace: The ledger namespace, None for the default one.
 
     Returns:
         dict: A mapping of user IDs to balances.
     """
-    users = users_ref.stream()
-    return {user.id: user.to_dict().get("balance", 0) for user in users}
+    store, _ = open_namespace(namespace)
+    return store.fetch_payment_list()
 
 
 def update_user_balance(
-    name: str, amount: float, timestamp=datetime.now(TIMEZONE)
-) -> None:
+    name: str, delta: float, timestamp=None, namespace: str | None = None
+) -> float:
     """
-    Update a user's balance in Firestore.
+    Add to a user's balance on the server, so concurrent writers never
+    overwrite each other.
 
     Args:
         name: The name of the user to update.
-        amount: The amount to update the balance by; can be negative.
-        timestamp: The timestamp of the update.
+        delta: The change of the balance.
+        timestamp: The timestamp of the update; defaults to now.
+        namespace: The ledger namespace, None for the default one.
 
     Returns:
-        None.
+        float: The new balance of the user on the server.
     """
-    users_ref.document(name).set(
-        {
-            "balance": amount,
-            "lastUpdated": timestamp.astimezone(TIMEZONE),
-        },
-        merge=True,
-    )
+    store, _ = open_namespace(namespace)
+    return store.update_user_balance(name, delta, timestamp or datetime.now(TIMEZONE))
+
+
+def commit_batch(tasks: list[dict], namespace: str | None = None) -> dict[str, float]:
+    """
+    Write a batch of worker tasks to the storage in a single commit.
+
+    Args:
+        tasks: The tasks to write. User tasks have a type of create, delete or
+            payment, the user name, and the balance delta and timestamp where
+            applicable. Event and snapshot tasks of the event-sourced ledger
+            have an event_seq; a journal task records the last sequence
+            number of a journal.
+        namespace: The ledger namespace, None for the default one.
+
+    Returns:
+        dict[str, float]: The balances on the server after the payment tasks.
+    """
+    store, _ = open_namespace(namespace)
+    return store.commit_batch(tasks)
+
+
+def get_journal_seq(journal_id: str, namespace: str | None = None) -> int:
+    """Return the last sequence number committed from a journal, 0 if none"""
+    store, _ = open_namespace(namespace)
+    return store.get_journal_seq(journal_id)
+
+
+def claim_event_log(journal_id: str, ttl: float, namespace: str | None = None) -> str:
+    """Claim or renew the lease on writing events, see `Storage.claim_event_log`"""
+    store, _ = open_namespace(namespace)
+    return store.claim_event_log(journal_id, datetime.now(TIMEZONE), ttl)
+
 
+def release_event_log(journal_id: str, namespace: str | None = None) -> None:
+    store, _ = open_namespace(namespace)
+    store.release_event_log(journal_id)
 
-def get_payment_logs(n):
+
+def get_events(
+    after_seq: int = 0, namespace: str | None = None, until=None
+) -> list[dict]:
+    """
+    Fetch the events of the event-sourced ledger.
+
+    Args:
+        after_seq: Only fetch the events after this sequence number.
+        namespace: The ledger namespace, None for the default one.
+        until: Only fetch the events up to this time, if given.
+
+    Returns:
+        list[dict]: The events in sequence order.
+    """
+    store, _ = open_namespace(namespace)
+    return store.get_events(after_seq, until)
+
+
+def get_latest_snapshot(at=None, namespace: str | None = None) -> dict | None:
+    """
+    Fetch the latest snapshot of the event-sourced ledger.
+
+    Args:
+        at: Only consider snapshots taken at or before this time.
+        namespace: The ledger namespace, None for the default one.
+
+    Returns:
+        dict | None: The seq, timestamp and balances of the snapshot, if any.
+    """
+    store, _ = open_namespace(namespace)
+    return store.get_latest_snapshot(at)
+
+
+def watch_users(
+    on_change: Callable[[str, str, float], None], namespace: str | None = None
+):
+    """
+    Listen to real-time changes of the users.
+
+    Args:
+        on_change: Called from the listener thread with the change type
+            (ADDED, MODIFIED or REMOVED), the user name and the balance for
+            every changed user. The first snapshot reports every user as ADDED.
+        namespace: The ledger namespace, None for the default one.
+
+    Returns:
+        The listener; call `unsubscribe()` on it to stop listening. None if
+        the storage backend does not support listening.
+    """
+    store, _ = open_namespace(namespace)
+    return store.watch_users(on_change)
+
+
+def get_payment_logs(n, namespace: str | None = None) -> list[dict]:
     """
     Fetch the latest payment logs.
 
     Args:
         n: Number of latest payment logs to fetch.
+        namespace: The ledger namespace, None for the default one.
 
     Returns:
-        Iterable: The latest payment log documents.
+        list[dict]: The latest payment logs.
     """
-    latest_payment_logs = (
-        logs_ref.where(filter=FieldFilter("type", "==", "payment"))
-        .order_by("timestamp", direction=firestore.Query.DESCENDING)
-        .limit(n)
-        .stream()
-    )
-    return latest_payment_logs
+    store, buffer = open_namespace(namespace)
+    logs = buffer.get(n, "payment")
+    if logs is not None:
+        return logs
+    return store.get_payment_logs(n)
 
 
-def get_logs(n, command_type="payment") -> list[dict]:
+def get_logs(n, command_type="payment", namespace: str | None = None) -> list[dict]:
     """
     Fetch logs with an optional type filter.
 
     Args:
         n: Number of latest logs to fetch.
         command_type: The log type to filter by.
+        namespace: The ledger namespace, None for the default one.
 
     Returns:
         list[dict]: The latest logs of the requested type.
     """
-    logs = logs_ref
-    if command_type:
-        logs = logs.where(filter=FieldFilter("type", "==", command_type))
-    logs = (
-        logs.order_by("timestamp", direction=firestore.Query.DESCENDING)
-        .limit(n)
-        .stream()
-    )
-    return [log.to_dict() for log in logs]
+    store, buffer = open_namespace(namespace)
+    logs = buffer.get(n, command_type)
+    if logs is not None:
+        return logs
+    return store.get_logs(n, command_type)
+
+
+def get_logs_page(
+    n,
+    command_type="payment",
+    cursor: LogCursor | None = None,
+    namespace: str | None = None,
+) -> tuple[list[dict], LogCursor | None]:
+    """
+    Fetch a page of logs with an optional type filter.
+
+    Args:
+        n: Number of logs per page.
+        command_type: The log type to filter by.
+        cursor: The cursor returned with the previous page, None for the latest logs.
+        namespace: The ledger namespace, None for the default one.
+
+    Returns:
+        tuple[list[dict], LogCursor | None]: The logs, newest first, and the
+        cursor of the next page, or None if there are no older logs.
+    """
+    store, buffer = open_namespace(namespace)
+    if cursor is None:
+        page = buffer.get_page(n + 1, command_type)
+        if page is not None:
+            logs, log_refs = page
+            if len(logs) <= n:
+                return logs, None
+            # the next page reads on from the last buffered log in one query
+            return logs[:n], store.log_cursor(logs[n - 1], log_refs[n - 1])
+    return store.get_logs_page(n, command_type, cursor)
+
+
+async def get_logs_page_async(
+    n,
+    command_type="payment",
+    cursor: LogCursor | None = None,
+    namespace: str | None = None,
+) -> tuple[list[dict], LogCursor | None]:
+    return await run_in_executor(get_logs_page, n, command_type, cursor, namespace)
 
 
 def write_bot_log() -> None:
-    bot_ref.add(
-        {
-            "startTime": datetime.now(TIMEZONE),
-        }
-    )
+    storage.write_bot_log(datetime.now(TIMEZONE))
+
+
+async def write_bot_log_async() -> None:
+    await run_in_executor(write_bot_log)
 
 
 def write_log(
@@ -111,70 +281,127 @@ def write_log(
     channel: str,
     entered_by: str,
     cmd: str,
-    timestamp=datetime.now(TIMEZONE),
+    timestamp=None,
+    namespace: str | None = None,
     **kwargs,
-) -> firestore.DocumentReference:
+) -> LogRef:
     """
-    Write a log document to Firestore.
+    Write a log to the storage.
 
     Args:
         log_type: The type of the log.
         channel: The channel where the log was created.
         entered_by: The user who entered the command.
         cmd: The command string.
-        timestamp: The timestamp to store with the log.
+        timestamp: The timestamp to store with the log; defaults to now.
+        namespace: The ledger namespace, None for the default one.
         kwargs: Additional fields specific to the log type.
 
     Returns:
-        firestore.DocumentReference: The created log reference.
+        LogRef: The reference of the created log.
     """
+    store, buffer = open_namespace(namespace)
+    log = build_log(log_type, channel, entered_by, cmd, timestamp, **kwargs)
+    log_ref = store.write_log(
+        log_type, channel, entered_by, cmd, log["timestamp"], **kwargs
+    )
+    buffer.add(log, log_ref)
+    return log_ref
+
+
+async def write_log_async(
+    log_type: str,
+    channel: str,
+    entered_by: str,
+    cmd: str,
+    timestamp=None,
+    namespace: str | None = None,
+    **kwargs,
+) -> LogRef:
+    """Write a log like `write_log` without blocking the event loop"""
+    return await run_in_executor(
+        write_log, log_type, channel, entered_by, cmd, timestamp, namespace, **kwargs
+    )
+
+
+def build_log(
+    log_type: str,
+    channel: str,
+    entered_by: str,
+    cmd: str,
+    timestamp=None,
+    **kwargs,
+) -> dict:
+    """Return the log document that `write_log` would write"""
     log_data = {
         "type": log_type,
-        "timestamp": timestamp.astimezone(TIMEZONE),
+        "timestamp": (timestamp or datetime.now(TIMEZONE)).astimezone(TIMEZONE),
         "channel": channel,
         "enteredBy": entered_by,
         "command": cmd,
     }
     log_data.update(kwargs)
-    return logs_ref.add(log_data)[1]
+    return log_data
 
 
-def update_log(doc_ref: firestore.DocumentReference, **kwargs) -> None:
+def write_logs(logs: list[dict], namespace: str | None = None) -> None:
     """
-    Update an existing log document.
+    Write many logs in bulk.
 
     Args:
-        doc_ref: The reference to the log document to update.
-        kwargs: The fields to update in the log document.
+        logs: The log documents created by `build_log`.
+        namespace: The ledger namespace, None for the default one.
 
     Returns:
         None.
     """
-    doc_ref.update(kwargs)
+    store, buffer = open_namespace(namespace)
+    store.write_logs(logs)
+    for log in logs:
+        buffer.add(dict(log))
 
 
-def create_user(name: str, timestamp=datetime.now(TIMEZONE)) -> None:
+def update_log(log_ref: LogRef, namespace: str | None = None, **kwargs) -> None:
     """
-    Create a new user document in Firestore.
+    Update an existing log.
+
+    Args:
+        log_ref: The reference to the log to update.
+        namespace: The ledger namespace of the log, None for the default one.
+        kwargs: The fields to update in the log.
+
+    Returns:
+        None.
+    """
+    store, buffer = open_namespace(namespace)
+    store.update_log(log_ref, **kwargs)
+    buffer.update(log_ref, **kwargs)
+
+
+async def update_log_async(
+    log_ref: LogRef, namespace: str | None = None, **kwargs
+) -> None:
+    """Update a log like `update_log` without blocking the event loop"""
+    await run_in_executor(update_log, log_ref, namespace, **kwargs)
+
+
+def create_user(name: str, timestamp=None) -> None:
+    """
+    Create a new user in the storage.
 
     Args:
         name: The name of the user to create.
-        timestamp: The timestamp of the creation.
+        timestamp: The timestamp of the creation; defaults to now.
 
     Returns:
         None.
     """
-    users_ref.document(name).set(
-        {
-            "balance": 0,
-            "lastUpdated": timestamp.astimezone(TIMEZONE),
-        }
-    )
+    storage.create_user(name, timestamp or datetime.now(TIMEZONE))
 
 
 def delete_user(name: str) -> None:
     """
-    Delete a user document from Firestore.
+    Delete a user from the storage.
 
     Args:
         name: The name of the user to delete.
@@ -182,11 +409,7 @@ def delete_user(name: str) -> None:
     Returns:
         None.
     """
-    user_ref = users_ref.document(name)
-    if user_ref.get().exists:
-        user_ref.delete()
-    else:
-        raise ValueError(f"User {name} does not exist.")
+    storage.delete_user(name)
 
 
 def add_bookkeeping_record(
@@ -195,10 +418,10 @@ def add_bookkeeping_record(
     category: str,
     name: str,
     amount: float,
-    timestamp=datetime.now(TIMEZONE),
-) -> firestore.DocumentReference:
+    timestamp=None,
+) -> LogRef:
     """
-    Add a bookkeeping record to Firestore.
+    Add a bookkeeping record to the storage.
 
     Args:
         username: The username for this record.
@@ -206,20 +429,19 @@ def add_bookkeeping_record(
         category: The category of the record.
         name: The name or description of the record.
         amount: The amount.
-        timestamp: The timestamp of the record.
+        timestamp: The timestamp of the record; defaults to now.
 
     Returns:
-        firestore.DocumentReference: The created bookkeeping record reference.
+        LogRef: The reference of the created bookkeeping record.
     """
-    record_data = {
-        "timestamp": timestamp.astimezone(TIMEZONE),
-        "username": username,
-        "type": record_type,
-        "category": category,
-        "name": name,
-        "amount": amount,
-    }
-    return bookkeeping_ref.add(record_data)[1]
+    return storage.add_bookkeeping_record(
+        username,
+        record_type,
+        category,
+        name,
+        amount,
+        timestamp or datetime.now(TIMEZONE),
+    )
 
 
 def get_bookkeeping_records(
@@ -238,10 +460,4 @@ def get_bookkeeping_records(
     Returns:
         list[dict]: The matching bookkeeping records.
     """
-    query = bookkeeping_ref
-    if record_type:
-        query = query.where("type", "==", record_type)
-    if category:
-        query = query.where("category", "==", category)
-    docs = query.limit(n).stream()
-    return [doc.to_dict() for doc in docs]
+    return storage.get_bookkeeping_records(n, record_type, category)
@@ -0,0 +1,21 @@
+import httpx
+
+from constants import HTTP_TIMEOUT
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the pooled HTTP client shared by the whole process"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=HTTP_TIMEOUT)
+    return _client
+
+
+async def close_http_client() -> None:
+    """Close the pooled HTTP client and its connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
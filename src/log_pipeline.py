@@ -0,0 +1,152 @@
+import asyncio
+import logging
+
+import firebase_manager
+from constants import (
+    AUDIT_LOG_BATCH_SIZE,
+    AUDIT_LOG_FLUSH_INTERVAL,
+    AUDIT_LOG_PUT_TIMEOUT,
+    AUDIT_LOG_QUEUE_SIZE,
+)
+
+
+class AuditLogPipeline:
+    """A background pipeline writing audit logs in bulk.
+
+    Logs are queued by the commands with their ledger namespace and written
+    by a background task in one commit per `batch_size` logs or per
+    `flush_interval` seconds, split by namespace. When the queue is full,
+    submitting waits up to `put_timeout` seconds for space before the log is
+    dropped and counted.
+    """
+
+    def __init__(
+        self,
+        max_size: int = AUDIT_LOG_QUEUE_SIZE,
+        batch_size: int = AUDIT_LOG_BATCH_SIZE,
+        flush_interval: float = AUDIT_LOG_FLUSH_INTERVAL,
+        put_timeout: float = AUDIT_LOG_PUT_TIMEOUT,
+    ):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue: asyncio.Queue | None = None
+        self.task: asyncio.Task | None = None
+        self.closing = False
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self) -> None:
+        """Start the background flushing task on the running event loop"""
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.closing = False
+        self.task = asyncio.create_task(self._run())
+
+    async def submit(
+        self,
+        log_type: str,
+        channel: str,
+        entered_by: str,
+        cmd: str,
+        timestamp=None,
+        namespace: str | None = None,
+        **kwargs,
+    ) -> bool:
+        """
+        Queue a log; takes the same arguments as `firebase_manager.write_log`.
+
+        Returns:
+            bool: Whether the log was accepted; False if it was dropped.
+        """
+        log_data = firebase_manager.build_log(
+            log_type, channel, entered_by, cmd, timestamp, **kwargs
+        )
+        self.submitted += 1
+        if not self.running or self.closing:  # not started yet or closed
+            await firebase_manager.run_in_executor(
+                firebase_manager.write_logs, [log_data], namespace
+            )
+            self.written += 1
+            return True
+
+        entry = (namespace, log_data)
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self.queue.put(entry), self.put_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                logging.warning(f"Audit log queue is full, dropped: {cmd}")
+                return False
+        return True
+
+    async def _collect(self) -> list:
+        """Wait for the next log and collect a batch; a trailing None means stop"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.flush_interval
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, logs: list[dict], namespace: str | None) -> None:
+        try:
+            await firebase_manager.run_in_executor(
+                firebase_manager.write_logs, logs, namespace
+            )
+            self.written += len(logs)
+            self.batches += 1
+        except Exception as e:
+            self.dropped += len(logs)
+            logging.error(f"Failed to write {len(logs)} audit logs: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            namespaces: dict[str | None, list[dict]] = {}
+            for entry in batch:
+                if entry is not None:
+                    namespace, log = entry
+                    namespaces.setdefault(namespace, []).append(log)
+            for namespace, logs in namespaces.items():
+                await self._flush(logs, namespace)
+            if batch[-1] is None:
+                return
+
+    async def close(self) -> None:
+        """Write every queued log and stop the background task"""
+        if not self.running:
+            return
+        self.closing = True
+        await self.queue.put(None)
+        await self.task
+        logging.info(f"Audit log pipeline closed: {self.stats()}")
+
+    def stats(self) -> dict:
+        """Return the counters of the pipeline"""
+        return {
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "queued": self.queue.qsize() if self.queue else 0,
+        }
+
+
+audit_log = AuditLogPipeline()
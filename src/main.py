@@ -1,4 +1,5 @@
 import logging
+import math
 from functools import wraps
 
 import discord
@@ -11,20 +12,27 @@ from constants import (
     BOT_KEY,
     BOT_STATUS,
     INIT_STATE,
-    PAYMENT_CHANNEL_ID,
+    SHARD_COUNT,
     SUPPORTED_CURRENCY,
     TIMEZONE,
     USER_MAPPING,
 )
 from encryption import decrypt_command, encrypt_command
-from firebase_manager import write_bot_log, write_log
+from firebase_manager import recent_logs, write_bot_log_async
+from log_pipeline import audit_log
+from payment.exchange_rate import rate_table
+from payment.namespace import channels_of, namespace_of
 from payment.payment_logic import (
     create_user,
     delete_user,
+    ledgers,
     payment_system,
     refetch_payment_record,
+    settle_payments,
     show_logs,
     show_payment_record,
+    show_payment_record_at,
+    start_listener,
 )
 from ping_worker import ping_bot
 from utils import B, channel_to_text, get_emoji
@@ -53,9 +61,22 @@ async def start_background_tasks(bot):
     bot.loop.create_task(start_fastapi())
 
 
+def latency_text(latency: float) -> str:
+    """Format a gateway latency, which is not a number until the first heartbeat"""
+    return f"{latency * 1000:.0f} ms" if math.isfinite(latency) else "n/a"
+
+
 def start_bot():
-    intents = discord.Intents.all()
-    bot = commands.Bot(command_prefix="!", intents=intents)
+    # only the events the commands use: messages and their content, in guilds
+    # and DMs, and guilds for the channel cache
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    bot = commands.AutoShardedBot(
+        command_prefix="!", intents=intents, shard_count=SHARD_COUNT
+    )
     bot_state = BotState()
 
     async def notify_error(ctx: commands.Context, error: Exception):
@@ -83,7 +104,9 @@ def start_bot():
                 if bot_active and not bot_state.active:
                     await ctx.send("Bot is not started! Call !switch to start the bot")
                     return
-                if in_payment_channel and ctx.channel.id != PAYMENT_CHANNEL_ID:
+                namespace = namespace_of(ctx.guild)
+                payment_channel_id, _ = channels_of(namespace)
+                if in_payment_channel and ctx.channel.id != payment_channel_id:
                     await ctx.send("Please input the record in the **payment** channel")
                     return
                 try:
@@ -96,12 +119,13 @@ def start_bot():
                         f"Command executed: {ctx.message.content} by {ctx.author.name} in {channel_name}"
                     )
                     if command_type:
-                        write_log(
+                        await audit_log.submit(
                             command_type,
                             channel_to_text(ctx.channel),
                             ctx.author.name,
                             ctx.message.content,
                             ctx.message.created_at.astimezone(TIMEZONE),
+                            namespace,
                         )
                 except Exception as e:
                     await notify_error(ctx, e)
@@ -115,9 +139,15 @@ def start_bot():
     async def on_ready():
         logging.info(f"Bot started as {bot.user} (Call !switch to start/stop)")
         await bot.change_presence(activity=discord.Game(name=BOT_STATUS))
-        write_bot_log()
+        await write_bot_log_async()
+        audit_log.start()
+        start_listener(bot.loop)
         await start_background_tasks(bot)
 
+    @bot.event
+    async def on_shard_ready(shard_id: int):
+        logging.info(f"Shard {shard_id} of {bot.shard_count} is ready")
+
     @bot.command(hidden=True)
     @command_wrapper(bot_active=False, command_type="manage")
     async def switch(message: commands.Context):
@@ -127,7 +157,25 @@ def start_bot():
     @bot.command(hidden=True)
     @command_wrapper(command_type="read")
     async def status(message: commands.Context):
-        await message.channel.send("Bot is active!")
+        rates = rate_table.stats()
+        logs = audit_log.stats()
+        recent = recent_logs.stats()
+        ledger_stats = ledgers.stats()
+        shards = ", ".join(
+            f"{shard_id}: {latency_text(latency)}" for shard_id, latency in bot.latencies
+        )
+        await message.channel.send(
+            "Bot is active!\n"
+            f"-# Exchange rates: {rates['hits']} hits, {rates['misses']} misses, "
+            f"{rates['stale']} stale, {rates['fetches']} fetches ({rates['saved']} saved)\n"
+            f"-# Audit logs: {logs['submitted']} submitted, {logs['written']} written, "
+            f"{logs['dropped']} dropped, {logs['queued']} queued\n"
+            f"-# Recent logs: {recent['hits']} hits, {recent['misses']} misses "
+            f"({recent['hit_rate']:.0%} served from memory)\n"
+            f"-# Guild ledgers: {ledger_stats['loaded']} loaded, "
+            f"{ledger_stats['loads']} loads\n"
+            f"-# Shard latencies: {shards}"
+        )
 
     @bot.command(help="Show the bot information", brief="Bot information")
     @command_wrapper(command_type="read")
@@ -142,8 +190,17 @@ def start_bot():
     )
     @command_wrapper(command_type="read")
     async def show(message: commands.Context):
-        await message.channel.send(show_payment_record(message.author.id))
-        refetch_payment_record()  # refetch afterwards -> immediate response & latest data
+        msg = message.message.content.lower().split()
+        async with ledgers.use(namespace_of(message.guild)) as ns:
+            if len(msg) > 1:
+                await message.channel.send(
+                    await show_payment_record_at(ns, msg, message.author.id)
+                )
+                return
+            await message.channel.send(
+                show_payment_record(ns.payment_records, message.author.id)
+            )
+            refetch_payment_record(ns)  # no-op while the firebase listener keeps records updated
 
     @bot.command(
         help="Show the history of command inputs", brief="Latest command inputs"
@@ -151,7 +208,14 @@ def start_bot():
     @command_wrapper(command_type="read")
     async def history(message: commands.Context):
         response = await message.channel.send("loading...")
-        await response.edit(content=show_logs(message.message.content.lower().split()))
+        async with ledgers.use(namespace_of(message.guild)) as ns:
+            text, view = await show_logs(
+                ns, message.message.content.lower().split(), message.author.id
+            )
+        if view is None:
+            await response.edit(content=text)
+            return
+        view.message = await response.edit(content=text, view=view)
 
     @bot.command(
         name="currencies",
@@ -170,20 +234,33 @@ def start_bot():
     @command_wrapper(in_payment_channel=True, command_type="manage")
     async def create(message: commands.Context):
         response = await message.channel.send("loading...")
-        result = await create_user(bot, message)
+        async with ledgers.use(namespace_of(message.guild)) as ns:
+            result = await create_user(ns, bot, message)
         await response.edit(content=result)
 
     @bot.command(help="Delete a user if he has no debts", brief="Delete a user")
     @command_wrapper(in_payment_channel=True, command_type="manage")
     async def delete(message: commands.Context):
         response = await message.channel.send("loading...")
-        result = await delete_user(bot, message)
+        async with ledgers.use(namespace_of(message.guild)) as ns:
+            result = await delete_user(ns, bot, message)
         await response.edit(content=result)
 
     @bot.command(help="Enters a payment record", brief="Enters a payment record")
     @command_wrapper(in_payment_channel=True)
     async def pm(message: commands.Context):
-        await payment_system(bot, message)
+        async with ledgers.use(namespace_of(message.guild)) as ns:
+            await payment_system(ns, bot, message)
+
+    @bot.command(
+        help="Show the fewest paybacks that settle all payment records; "
+        "!settle apply records them",
+        brief="Settle all payment records",
+    )
+    @command_wrapper(in_payment_channel=True)
+    async def settle(message: commands.Context):
+        async with ledgers.use(namespace_of(message.guild)) as ns:
+            await settle_payments(ns, bot, message)
 
     @bot.command(
         aliases=["enc"], help="Encrypt a string with a key", brief="Encrypt a string"
@@ -208,7 +285,7 @@ def start_bot():
     @bot.command(hidden=True)
     @command_wrapper(command_type="others")
     async def log(message: commands.Context):
-        await message.send(add_bookkeeping_record(message))
+        await message.send(await add_bookkeeping_record(message))
 
     bot.run(BOT_KEY)
 
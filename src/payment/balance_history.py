@@ -0,0 +1,106 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from payment.ledger import Ledger, to_units
+
+
+class BalanceHistory:
+    """A time index of the balance changes of every user.
+
+    Each user has a sorted array of change times and the prefix sums of the
+    changes in units, so the change of a balance since any time is found
+    with one binary search. Past balances are the current balances minus
+    the changes since that time, which needs no storage reads once the
+    index is built from the payment logs.
+    """
+
+    def __init__(self, since: float | None = None):
+        self.times: dict[str, list[float]] = {}
+        self.sums: dict[str, list[int]] = {}
+        self.since = since  # the earliest time covered, None if complete
+
+    @classmethod
+    def from_logs(cls, logs: list[dict], limit: int) -> "BalanceHistory":
+        """
+        Build the index from payment logs.
+
+        Args:
+            logs: The latest payment logs, newest first, as returned by
+                `firebase_manager.get_logs`. Cancelled logs are skipped.
+            limit: The number of logs requested; if as many were returned,
+                older history may be missing.
+
+        Returns:
+            BalanceHistory: The index of the logged payments.
+        """
+        since = logs[-1]["timestamp"].timestamp() if len(logs) >= limit else None
+        history = cls(since)
+        for log in reversed(logs):
+            if not log.get("cancelled"):
+                history.record(
+                    log["payers"], log["payees"], log["amount"], log["timestamp"]
+                )
+        return history
+
+    def add(self, name: str, time: float, units: int) -> None:
+        """Add a change of `units` to the balance of a user at `time`"""
+        times = self.times.setdefault(name, [])
+        sums = self.sums.setdefault(name, [])
+        i = bisect_right(times, time)
+        times.insert(i, time)
+        sums.insert(i, (sums[i - 1] if i else 0) + units)
+        for j in range(i + 1, len(sums)):  # only for changes out of order
+            sums[j] += units
+
+    def record(
+        self, ppl_to_pay: str, ppl_get_paid: str, amount: float, timestamp: datetime
+    ) -> None:
+        """
+        Record a payment the way `payment_handling` applies it.
+
+        Args:
+            ppl_to_pay: The comma-separated users who pay.
+            ppl_get_paid: The comma-separated users who get paid.
+            amount: The amount in unified currency.
+            timestamp: The time of the payment.
+
+        Returns:
+            None.
+        """
+        units = to_units(amount)
+        pay_list = ppl_to_pay.split(",")
+        paid_list = ppl_get_paid.split(",")
+        time = timestamp.timestamp()
+        for payer in pay_list:
+            self.add(payer, time, -units * len(paid_list))
+        for payee in paid_list:
+            self.add(payee, time, units * len(pay_list))
+
+    def change_since(self, name: str, time: float) -> int:
+        """Return the total change of the balance of a user from `time` on"""
+        sums = self.sums.get(name)
+        if not sums:
+            return 0
+        i = bisect_left(self.times[name], time)
+        return sums[-1] - (sums[i - 1] if i else 0)
+
+    def covers(self, at: datetime) -> bool:
+        """Return whether every change from `at` on is in the index"""
+        return self.since is None or at.timestamp() >= self.since
+
+    def balances_at(self, ledger: Ledger, at: datetime) -> Ledger:
+        """
+        Return the balances of the current users just before a point in time.
+
+        Args:
+            ledger: The current balances.
+            at: The time to return the balances before.
+
+        Returns:
+            Ledger: The balances before `at`.
+        """
+        time = at.timestamp()
+        past = Ledger()
+        for name, units in ledger.items():
+            past.add(name, units - self.change_since(name, time))
+        return past
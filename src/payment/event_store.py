@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Callable
+
+import firebase_manager
+from constants import EVENT_LEASE_TTL, JOURNAL_ID, TIMEZONE
+from payment.ledger import Ledger
+
+
+def apply_event(ledger: Ledger, event: dict) -> None:
+    """
+    Apply a ledger event to the balances.
+
+    Args:
+        ledger: The balances to update.
+        event: A create or delete event of a user, or a payment event where
+            every payer pays `units` to every payee, as in `payment_handling`.
+
+    Returns:
+        None.
+    """
+    match event["kind"]:
+        case "create":
+            if event["user"] not in ledger:
+                ledger.add(event["user"])
+        case "delete":
+            if event["user"] in ledger:
+                del ledger[event["user"]]
+        case "payment":
+            for payer in event["payers"]:
+                ledger[payer] -= event["units"] * len(event["payees"])
+            for payee in event["payees"]:
+                ledger[payee] += event["units"] * len(event["payers"])
+
+
+def ledger_from_snapshot(snapshot: dict) -> Ledger:
+    ledger = Ledger()
+    for name, units in snapshot["balances"].items():
+        ledger.add(name, units)
+    return ledger
+
+
+class EventStore:
+    """The event-sourced history of the ledger.
+
+    Every applied transaction, including undos, is recorded as an immutable
+    event with a sequence number, and the balances are snapshotted every
+    `snapshot_interval` events. The balances at any time are the latest
+    snapshot before it plus the events after the snapshot. Each ledger
+    namespace has an event store of its own.
+
+    Sequence numbers are counted in memory, so only one instance may write
+    the events of a namespace: it holds a lease in the storage, renewed
+    every third of EVENT_LEASE_TTL while it runs, and other instances wait
+    to load the event store until it is released or expires. Once the lease
+    is lost or runs out, no more events or snapshots are recorded.
+    """
+
+    def __init__(self, snapshot_interval: int, namespace: str | None = None):
+        self.snapshot_interval = snapshot_interval
+        self.namespace = namespace
+        self.seq = 0
+        self.snapshot_seq = 0
+        self.closed = threading.Event()
+        self.renewer: threading.Thread | None = None
+        self.lease_expires = 0.0  # time.monotonic() at which the lease runs out
+        self.lost = False
+
+    def _claim(self) -> str:
+        """Claim or renew the lease, returning the instance that holds it"""
+        start = time.monotonic()
+        holder = firebase_manager.claim_event_log(
+            JOURNAL_ID, EVENT_LEASE_TTL, self.namespace
+        )
+        if holder == JOURNAL_ID and not self.lost:
+            self.lease_expires = start + EVENT_LEASE_TTL
+        return holder
+
+    def _lose(self, reason: str) -> None:
+        self.lost = True
+        logging.critical(
+            f"{reason}, so the events of namespace {self.namespace} "
+            "are no longer recorded"
+        )
+
+    def _renew(self) -> None:
+        while not self.closed.wait(EVENT_LEASE_TTL / 3):
+            if time.monotonic() >= self.lease_expires:
+                self._lose("The event log lease expired")
+                return
+            try:
+                holder = self._claim()
+            except Exception as e:
+                logging.error(f"Failed to renew the event log lease: {e}")
+                continue
+            if holder != JOURNAL_ID:
+                self._lose(f"Lost the event log lease to instance {holder}")
+                return
+
+    def close(self) -> None:
+        """Stop renewing the lease and release it"""
+        if self.renewer is None:
+            return
+        self.closed.set()
+        self.renewer.join()
+        self.renewer = None
+        firebase_manager.release_event_log(JOURNAL_ID, self.namespace)
+
+    def load(self, fallback: Callable[[], Ledger]) -> Ledger:
+        """
+        Rebuild the current balances from the latest snapshot and its tail.
+
+        The lease is claimed first; while another instance holds it, the
+        claim is retried until the lease would have run out, e.g. while the
+        previous instance shuts down in a rolling deploy.
+
+        Args:
+            fallback: Returns the current balances when there is no snapshot
+                yet; they are stored as the first snapshot.
+
+        Returns:
+            Ledger: The current balances.
+
+        Raises:
+            RuntimeError: Another instance still writes the events after
+                EVENT_LEASE_TTL.
+        """
+        self.lost = False
+        deadline = time.monotonic() + EVENT_LEASE_TTL
+        while (holder := self._claim()) != JOURNAL_ID:
+            if time.monotonic() >= deadline:
+                raise RuntimeError(
+                    f"Instance {holder} writes the events, "
+                    "so EVENT_SOURCING must be off on this one"
+                )
+            logging.warning(f"Instance {holder} writes the events, waiting for its lease")
+            time.sleep(EVENT_LEASE_TTL / 10)
+        self.closed.clear()
+        self.renewer = threading.Thread(target=self._renew, daemon=True)
+        self.renewer.start()
+
+        snapshot = firebase_manager.get_latest_snapshot(namespace=self.namespace)
+        if snapshot is None:
+            ledger = fallback()
+            firebase_manager.commit_batch(
+                [self.snapshot_task(ledger, datetime.now(TIMEZONE))], self.namespace
+            )
+            return ledger
+
+        ledger = ledger_from_snapshot(snapshot)
+        self.seq = self.snapshot_seq = snapshot["seq"]
+        for event in firebase_manager.get_events(snapshot["seq"], self.namespace):
+            apply_event(ledger, event)
+            self.seq = event["seq"]
+        return ledger
+
+    def rebuild(self, at: datetime) -> Ledger | None:
+        """
+        Rebuild the balances at a point in time.
+
+        Args:
+            at: The time to rebuild the balances at.
+
+        Returns:
+            Ledger | None: The balances, or None if no history goes back so far.
+        """
+        snapshot = firebase_manager.get_latest_snapshot(at, self.namespace)
+        if snapshot is None:
+            return None
+        ledger = ledger_from_snapshot(snapshot)
+        for event in firebase_manager.get_events(snapshot["seq"], self.namespace, at):
+            apply_event(ledger, event)
+        return ledger
+
+    def snapshot_task(self, ledger: Ledger, timestamp: datetime) -> dict:
+        self.snapshot_seq = self.seq
+        return {
+            "type": "snapshot",
+            "event_seq": self.seq,
+            "timestamp": timestamp,
+            "balances": dict(ledger.items()),
+        }
+
+    def record(self, events: list[dict], ledger: Ledger) -> list[dict]:
+        """
+        Record the events of a transaction that has just been applied to the ledger.
+
+        A snapshot is only taken after the last event, as the ledger holds
+        the balances after all of them.
+
+        Args:
+            events: The events with their kind, timestamp and kind-specific fields.
+            ledger: The balances after the events.
+
+        Returns:
+            list[dict]: The worker tasks writing the events, and a snapshot if
+            one is due; none once the lease is lost.
+        """
+        if not self.lost and time.monotonic() >= self.lease_expires:
+            self._lose("The event log lease expired")
+        if self.lost:
+            return []
+        tasks = []
+        for event in events:
+            self.seq += 1
+            tasks.append({"type": "event", "event_seq": self.seq, **event})
+        if tasks and self.seq - self.snapshot_seq >= self.snapshot_interval:
+            tasks.append(self.snapshot_task(ledger, events[-1]["timestamp"]))
+        return tasks
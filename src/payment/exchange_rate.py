@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+
+from constants import (
+    EXCHANGE_RATE_TTL,
+    OPEN_EXCHANGE_RATE_API_KEY,
+    SUPPORTED_CURRENCY,
+    UNIFIED_CURRENCY,
+)
+from http_client import get_http_client
+
+LATEST_RATES_URL = "https://openexchangerates.org/api/latest.json"
+
+
+class ExchangeRateTable:
+    """An in-process table of exchange rates refreshed every `ttl` seconds.
+
+    The full `latest.json` is fetched once and every supported currency pair
+    is served from memory. Once the table expires, the stale rates keep being
+    served while a background task fetches the new ones.
+    """
+
+    def __init__(self, ttl: float = EXCHANGE_RATE_TTL):
+        self.ttl = ttl
+        self.rates: dict[str, float] = {}
+        self.fetched_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.fetches = 0
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.fetched_at > self.ttl
+
+    async def fetch(self) -> None:
+        """Fetch the latest rates of all currencies from open exchange rates"""
+        response = await get_http_client().get(
+            LATEST_RATES_URL,
+            params={"app_id": OPEN_EXCHANGE_RATE_API_KEY},
+            headers={"accept": "application/json"},
+        )
+        rates = response.json().get("rates", {})
+        self.fetches += 1
+        if not rates:
+            raise ValueError("No exchange rates returned")
+        self.rates = {cur: rates[cur] for cur in SUPPORTED_CURRENCY if cur in rates}
+        self.fetched_at = time.monotonic()
+
+    async def _refresh_in_background(self) -> None:
+        try:
+            await self.fetch()
+        except Exception as e:
+            logging.error(f"Failed to refresh exchange rates: {e}")
+
+    async def get_rate(self, from_cur: str, to_cur: str = UNIFIED_CURRENCY) -> float:
+        """
+        Return the exchange rate between two supported currencies.
+
+        Args:
+            from_cur: The currency to convert from.
+            to_cur: The currency to convert to.
+
+        Returns:
+            float: The amount of `to_cur` one unit of `from_cur` is worth.
+        """
+        if not self.rates:
+            async with self._lock:  # only the first waiter fetches
+                if not self.rates:
+                    self.misses += 1
+                    await self.fetch()
+                else:
+                    self.hits += 1
+        elif self.is_stale():
+            self.stale_hits += 1
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.create_task(
+                    self._refresh_in_background()
+                )
+        else:
+            self.hits += 1
+        return self.rates.get(to_cur, 0) / self.rates.get(from_cur, 1)
+
+    def stats(self) -> dict:
+        """Return the cache counters of the table"""
+        lookups = self.hits + self.misses + self.stale_hits
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale_hits,
+            "fetches": self.fetches,
+            "saved": lookups - self.fetches,
+            "age": round(time.monotonic() - self.fetched_at) if self.rates else None,
+        }
+
+
+rate_table = ExchangeRateTable()
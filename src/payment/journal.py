@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable
+
+
+def encode_task(task: dict) -> dict:
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in task.items()
+    }
+
+
+def decode_task(task: dict) -> dict:
+    if "timestamp" in task:
+        task["timestamp"] = datetime.fromisoformat(task["timestamp"])
+    return task
+
+
+def commit_marker(journal_id: str, tasks: list[dict]) -> dict:
+    """Return the task recording that the given journaled tasks were committed"""
+    return {"type": "journal", "journal": journal_id, "seq": max(t["seq"] for t in tasks)}
+
+
+class Journal:
+    """An append-only journal of the tasks queued for the firebase worker.
+
+    Tasks are appended in units, the tasks of one transaction that must be
+    written together, with a sequence number each before they are queued,
+    and acknowledged once the worker has written them. Appends are flushed to the
+    OS at once, so they survive the process being killed, and fsync'ed at
+    most every `fsync_interval` seconds or before the worker writes a batch.
+
+    Lines are either `{"seq": n, "task": {...}}` or `{"ack": [first, last]}`,
+    where every task has `"unit": [first seq, size]` of its unit.
+    """
+
+    def __init__(self, path: str, fsync_interval: float, compact_size: int):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_size = compact_size
+        self.lock = threading.Lock()
+        self.torn = False
+        self.entries, self.acked = self._read()
+        # past the end of every unit, so new tasks never complete a torn one
+        self.seq = max(
+            (sum(task.get("unit", (seq, 1))) - 1 for seq, task in self.entries.items()),
+            default=0,
+        )
+        self.unacked = {seq for seq in self.entries if not self._is_acked(seq)}
+        self.file = open(path, "a", encoding="utf-8")
+        if self.torn:
+            self.file.write("\n")  # never append to a torn line
+        self.dirty = False
+        self.last_sync = time.monotonic()
+
+    def _read(self) -> tuple[dict[int, dict], list[tuple[int, int]]]:
+        entries, acked = {}, []
+        if not os.path.exists(self.path):
+            return entries, acked
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                self.torn = not line.endswith("\n")
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:  # torn write of a crash
+                    continue
+                if "ack" in record:
+                    acked.append(tuple(record["ack"]))
+                else:
+                    entries[record["seq"]] = decode_task(record["task"])
+        return entries, acked
+
+    def _is_acked(self, seq: int) -> bool:
+        return any(first <= seq <= last for first, last in self.acked)
+
+    def _write(self, records: list[dict]) -> None:
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+        self.file.flush()
+        self.dirty = True
+        if time.monotonic() - self.last_sync >= self.fsync_interval:
+            self._sync()
+
+    def _sync(self) -> None:
+        if self.dirty:
+            os.fsync(self.file.fileno())
+            self.dirty = False
+        self.last_sync = time.monotonic()
+
+    def append(self, tasks: list[dict]) -> None:
+        """Append a unit of tasks in one write, setting their sequence numbers"""
+        with self.lock:
+            unit = [self.seq + 1, len(tasks)]
+            records = []
+            for task in tasks:
+                self.seq += 1
+                task["seq"] = self.seq
+                task["unit"] = unit
+                records.append({"seq": self.seq, "task": encode_task(task)})
+                self.unacked.add(self.seq)
+            self._write(records)
+
+    def sync(self) -> None:
+        """Make every appended task durable"""
+        with self.lock:
+            self._sync()
+
+    def ack(self, first: int, last: int) -> None:
+        """Acknowledge the tasks from `first` to `last` as written"""
+        with self.lock:
+            self._write([{"ack": [first, last]}])
+            self.unacked.difference_update(range(first, last + 1))
+            if not self.unacked and self.file.tell() > self.compact_size:
+                self._truncate()
+
+    def pending(self, committed_seq: int = 0) -> list[dict]:
+        """
+        Return the tasks read at start-up that still have to be written.
+
+        Tasks are returned if they were neither acknowledged nor committed,
+        which is known from the last sequence number the worker committed
+        with its batches; a crash between a commit and its acknowledgement
+        thus never writes a delta twice. Units cut short by a crash are
+        dropped as a whole.
+
+        Args:
+            committed_seq: The last sequence number committed to the storage.
+
+        Returns:
+            list[dict]: The tasks to replay, in journal order.
+        """
+        tasks = []
+        for seq in sorted(self.entries):
+            first, size = self.entries[seq].get("unit", (seq, 1))
+            if any(s not in self.entries for s in range(first, first + size)):
+                continue
+            if seq > committed_seq and not self._is_acked(seq):
+                tasks.append(self.entries[seq])
+        return tasks
+
+    def replay(
+        self,
+        commit: Callable[[list[dict]], object],
+        batch_size: int,
+        committed_seq: int = 0,
+    ) -> None:
+        """
+        Write the tasks left over from the last run, then reset the journal.
+
+        Args:
+            commit: Writes a batch of tasks in order.
+            batch_size: The number of tasks per batch, which is only exceeded
+                to keep the tasks of a unit in one batch.
+            committed_seq: The last sequence number committed to the storage;
+                new tasks are numbered after it.
+
+        Returns:
+            None.
+        """
+        with self.lock:
+            self.seq = max(self.seq, committed_seq)
+        tasks = self.pending(committed_seq)
+        batch = []
+        for task in tasks:
+            if len(batch) >= batch_size and task.get("unit") != batch[-1].get("unit"):
+                commit(batch)
+                batch = []
+            batch.append(task)
+        if batch:
+            commit(batch)
+        if tasks:
+            logging.info(f"Replayed {len(tasks)} tasks from journal {self.path}")
+        self.reset()
+
+    def _truncate(self) -> None:
+        self.file.truncate(0)
+        self.dirty = True
+        self._sync()
+        self.entries, self.acked = {}, []
+
+    def reset(self) -> None:
+        """Drop every task, after they have all been written"""
+        with self.lock:
+            self._truncate()
+            self.unacked.clear()
+
+    def close(self) -> None:
+        with self.lock:
+            self._sync()
+            self.file.close()
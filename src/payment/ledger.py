@@ -0,0 +1,147 @@
+from collections import Counter
+from typing import Iterator
+
+import numpy as np
+
+from constants import ROUND_OFF_DP
+
+SCALE = 10**ROUND_OFF_DP  # units per dollar, e.g. 1000 for 3 d.p.
+UNITS_RANGE = np.iinfo(np.int64)
+
+
+def to_units(amount: float) -> int:
+    """Convert an amount in dollars to integer units"""
+    return round(amount * SCALE)
+
+
+def from_units(units: int) -> float:
+    """Convert integer units to an amount in dollars"""
+    return units / SCALE
+
+
+class Ledger:
+    """The balances of all users as integer units of 1/SCALE dollars.
+
+    Users are integer indices into a NumPy balance array, so a whole batch of
+    payments is applied with one scatter-add and sums and checks are exact
+    integer operations. Indexing the ledger by user name returns and sets
+    balances in units; convert with `to_units`/`from_units` only when
+    reading from or writing to storage and when displaying.
+    """
+
+    def __init__(self, capacity: int = 16):
+        self.index: dict[str, int] = {}
+        self.names: list[str] = []
+        self.units = np.zeros(capacity, dtype=np.int64)  # first len(names) are used
+
+    @classmethod
+    def from_balances(cls, balances: dict[str, float]) -> "Ledger":
+        """Create a ledger from balances in dollars"""
+        ledger = cls(max(len(balances), 16))
+        for name, balance in balances.items():
+            ledger.add(name, to_units(balance))
+        return ledger
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.names))
+
+    def __getitem__(self, name: str) -> int:
+        return int(self.units[self.index[name]])
+
+    def __setitem__(self, name: str, units: int) -> None:
+        if name in self.index:
+            self.units[self.index[name]] = units
+        else:
+            self.add(name, units)
+
+    def __delitem__(self, name: str) -> None:
+        """Remove a user by moving the last user into its slot"""
+        i = self.index.pop(name)
+        last = len(self.names) - 1
+        last_name = self.names.pop()
+        if last_name != name:
+            self.names[i] = last_name
+            self.units[i] = self.units[last]
+            self.index[last_name] = i
+        self.units[last] = 0
+
+    def add(self, name: str, units: int = 0) -> None:
+        if name in self.index:
+            raise KeyError(f"{name} already exists")
+        i = len(self.names)
+        if i == len(self.units):
+            self.units = np.concatenate([self.units, np.zeros_like(self.units)])
+        self.index[name] = i
+        self.names.append(name)
+        self.units[i] = units
+
+    def keys(self) -> list[str]:
+        return list(self.names)
+
+    def items(self) -> Iterator[tuple[str, int]]:
+        return zip(list(self.names), self.units[: len(self.names)].tolist())
+
+    def total(self) -> int:
+        """Return the sum of all balances, which is zero for a consistent ledger"""
+        return int(self.units[: len(self.names)].sum())
+
+    def balance(self, name: str) -> float:
+        """Return the balance of a user in dollars"""
+        return from_units(self[name])
+
+    def to_balances(self) -> dict[str, float]:
+        """Return the balances of all users in dollars"""
+        return {name: from_units(units) for name, units in self.items()}
+
+    def apply(
+        self, payments: list[tuple[list[str], list[str], int]]
+    ) -> tuple[list[str], list[int], list[int]]:
+        """
+        Apply a batch of payments with one scatter-add.
+
+        Every payer pays `units` to every payee of a payment, as in
+        `payment_handling`. Nothing is applied if a user does not exist or
+        a balance would leave the int64 range, where NumPy would wrap it.
+
+        Args:
+            payments: (payers, payees, units) of each payment.
+
+        Returns:
+            tuple[list[str], list[int], list[int]]: The users whose balance
+            was touched, in order of appearance, with their balances before
+            and after the batch.
+
+        Raises:
+            KeyError: A user does not exist.
+            OverflowError: A balance would leave the int64 range.
+        """
+        indices, deltas = [], []
+        for payers, payees, units in payments:
+            for payer in payers:
+                indices.append(self.index[payer])
+                deltas.append(-units * len(payees))
+            for payee in payees:
+                indices.append(self.index[payee])
+                deltas.append(units * len(payers))
+
+        totals = Counter()
+        for i, delta in zip(indices, deltas):
+            totals[i] += delta
+        for i, delta in totals.items():
+            if not UNITS_RANGE.min <= int(self.units[i]) + delta <= UNITS_RANGE.max:
+                raise OverflowError(f"Balance of {self.names[i]} is too large")
+
+        indices = np.array(indices, dtype=np.intp)
+        _, first = np.unique(indices, return_index=True)
+        touched = indices[np.sort(first)]
+        before = self.units[touched]
+        np.add.at(self.units, indices, np.array(deltas, dtype=np.int64))
+        after = self.units[touched]
+        names = [self.names[i] for i in touched.tolist()]
+        return names, before.tolist(), after.tolist()
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+import firebase_manager
+from constants import (
+    BALANCE_HISTORY_LIMIT,
+    EVENT_SOURCING,
+    FIREBASE_BATCH_MAX_SIZE,
+    JOURNAL_COMPACT_SIZE,
+    JOURNAL_FSYNC_INTERVAL,
+    JOURNAL_ID,
+    JOURNAL_PATH,
+    LEDGER_GUILDS,
+    LOG_CHANNEL_ID,
+    PAYMENT_CHANNEL_ID,
+    SNAPSHOT_INTERVAL,
+)
+from payment.balance_history import BalanceHistory
+from payment.event_store import EventStore
+from payment.journal import Journal, commit_marker
+from payment.ledger import Ledger
+from payment.transactions import UserLocks
+
+
+def namespace_of(guild) -> str | None:
+    """Return the ledger namespace of a guild, None for the default ledger"""
+    if guild is not None and guild.id in LEDGER_GUILDS:
+        return str(guild.id)
+    return None
+
+
+def channels_of(namespace: str | None) -> tuple[int, int]:
+    """Return the payment and log channel ids of a ledger namespace"""
+    if namespace is None:
+        return PAYMENT_CHANNEL_ID, LOG_CHANNEL_ID
+    return LEDGER_GUILDS[int(namespace)]
+
+
+def journal_path(namespace: str | None) -> str:
+    if namespace is None:
+        return JOURNAL_PATH
+    root, ext = os.path.splitext(JOURNAL_PATH)
+    return f"{root}.{namespace}{ext}"
+
+
+class LedgerNamespace:
+    """The ledger of one namespace and everything kept in memory for it.
+
+    The default namespace (None) is the ledger of PAYMENT_CHANNEL_ID, stored
+    where the bot has always stored it; every guild of LEDGER_GUILDS has a
+    namespace with storage and a write-ahead journal of its own.
+    """
+
+    def __init__(self, name: str | None):
+        self.name = name
+        self.payment_channel_id, self.log_channel_id = channels_of(name)
+        self.journal = Journal(
+            journal_path(name), JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPACT_SIZE
+        )
+        self.event_store = EventStore(SNAPSHOT_INTERVAL, name) if EVENT_SOURCING else None
+        self.payment_records = Ledger()
+        self.user_list = self.payment_records.keys()
+        self.committed_balances = {}  # units, as last written by the worker
+        self.balance_history = BalanceHistory()
+        self.pending_writes = Counter()  # queued but not yet written tasks of each user
+        self.pending_lock = threading.Lock()
+        self.user_locks = UserLocks()  # held by every transaction over its users
+        self.users_watch = None
+        self.in_use = 0  # commands running on the namespace
+
+    def fetch_records(self) -> Ledger:
+        return Ledger.from_balances(firebase_manager.fetch_payment_list(self.name))
+
+    def load(self) -> None:
+        """Replay the journal of the last run, then load the balances and history"""
+        self.journal.replay(
+            self.commit,
+            FIREBASE_BATCH_MAX_SIZE,
+            firebase_manager.get_journal_seq(JOURNAL_ID, self.name),
+        )
+        if self.event_store is not None:
+            self.payment_records = self.event_store.load(self.fetch_records)
+        else:
+            self.payment_records = self.fetch_records()
+        self.user_list = self.payment_records.keys()
+        self.committed_balances = dict(self.payment_records.items())
+        self.balance_history = BalanceHistory.from_logs(
+            firebase_manager.get_logs(BALANCE_HISTORY_LIMIT, "payment", self.name),
+            BALANCE_HISTORY_LIMIT,
+        )
+
+    def commit(
+        self, updates: list[dict], tasks: list[dict] | None = None
+    ) -> dict[str, float]:
+        """
+        Write a batch of journaled tasks with the commit marker of this instance.
+
+        Args:
+            updates: The tasks to write.
+            tasks: The journaled tasks the updates were coalesced from;
+                defaults to the updates.
+
+        Returns:
+            dict[str, float]: The balances on the server after the payment tasks.
+        """
+        marker = commit_marker(JOURNAL_ID, tasks or updates)
+        return firebase_manager.commit_batch([*updates, marker], self.name)
+
+    def close(self) -> None:
+        self.journal.close()
+        if self.event_store is not None:
+            self.event_store.close()
+
+    def is_idle(self) -> bool:
+        """Return whether no command runs on the namespace and every write is done"""
+        return self.in_use == 0 and not self.journal.unacked
+
+
+class LedgerCache:
+    """The ledger namespaces in memory, least recently used first.
+
+    A namespace is loaded on its first use, and once more than `size` are
+    loaded, the least recently used idle ones are closed, so the memory
+    grows with the active guilds rather than with all of them. The default
+    namespace is always loaded.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        default: LedgerNamespace,
+        on_load: Callable[[LedgerNamespace], None],
+        on_close: Callable[[LedgerNamespace], None],
+    ):
+        self.size = size
+        self.default = default
+        self.on_load = on_load
+        self.on_close = on_close
+        self.loaded: OrderedDict[str, LedgerNamespace] = OrderedDict()
+        self.load_locks: dict[str, asyncio.Lock] = {}
+        self.loads = Counter()
+
+    def __iter__(self):
+        return iter([self.default, *self.loaded.values()])
+
+    def _load(self, name: str) -> LedgerNamespace:
+        namespace = LedgerNamespace(name)
+        namespace.load()
+        return namespace
+
+    @asynccontextmanager
+    async def use(self, name: str | None) -> AsyncIterator[LedgerNamespace]:
+        """
+        Use a ledger namespace for the duration of the block, loading it if needed.
+
+        Args:
+            name: The name of the namespace, or None for the default one.
+
+        Returns:
+            AsyncIterator[LedgerNamespace]: The loaded namespace, which is
+            not evicted while the block runs.
+        """
+        if name is None:
+            namespace = self.default
+        else:
+            async with self.load_locks.setdefault(name, asyncio.Lock()):
+                if name not in self.loaded:
+                    # storage reads, so in the storage executor
+                    self.loaded[name] = await firebase_manager.run_in_executor(
+                        self._load, name
+                    )
+                    self.loads[name] += 1
+                    self.on_load(self.loaded[name])
+            self.loaded.move_to_end(name)
+            namespace = self.loaded[name]
+
+        namespace.in_use += 1
+        try:
+            yield namespace
+        finally:
+            namespace.in_use -= 1
+            self.evict()
+
+    def evict(self) -> None:
+        """Close the least recently used idle namespaces beyond the cache size"""
+        for name in list(self.loaded):
+            if len(self.loaded) <= self.size:
+                return
+            namespace = self.loaded[name]
+            if namespace.is_idle():
+                del self.loaded[name]
+                self.on_close(namespace)
+                logging.info(f"Closed the idle ledger of namespace {name}")
+
+    def stats(self) -> dict:
+        return {
+            "loaded": len(self.loaded),
+            "loads": sum(self.loads.values()),
+        }
@@ -1,29 +1,51 @@
-from datetime import datetime
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+import logging
 import queue
 import threading
-from typing import List, Tuple, Union
+import time
+from typing import Callable, List, Tuple, Union
 
 import discord
-import requests
 
 import firebase_manager
 from constants import (
     EXCHANGE_RATE_ROUND_OFF_DP,
-    LOG_CHANNEL_ID,
+    FIREBASE_BATCH_MAX_LINGER,
+    FIREBASE_BATCH_MAX_SIZE,
+    FIREBASE_RETRY_INTERVAL,
+    FIREBASE_LISTENER,
+    JOURNAL_ID,
+    LEDGER_CACHE_SIZE,
     LOG_SHOW_NUMBER,
-    OPEN_EXCHANGE_RATE_API_KEY,
     ROUND_OFF_DP,
     SUPPORTED_CURRENCY,
     TIMEZONE,
     UNIFIED_CURRENCY,
     USER_MAPPING,
 )
-from payment.payment_ui import InputView, UndoView, amt_parser, is_valid_amount
-from utils import B, I, channel_to_text, get_mapped_name
+from expression import ExpressionError, evaluate_amount
+from log_pipeline import audit_log
+from payment.exchange_rate import rate_table
+from payment.ledger import Ledger, from_units, to_units
+from payment.namespace import LedgerCache, LedgerNamespace
+from payment.payment_ui import (
+    HistoryView,
+    InputView,
+    UndoView,
+    amt_parser,
+    is_valid_amount,
+)
+from payment.settlement import plan_settlement
+from payment.tasks import coalesce_tasks
+from storage import LogCursor
+from utils import B, I, channel_to_text, get_mapped_name, split_text
 
-payment_records = firebase_manager.fetch_payment_list()
-user_list = list(payment_records.keys())
+default_ledger = LedgerNamespace(None)
+default_ledger.load()
 firebase_queue = queue.Queue()
+records_loop = None  # the event loop of the bot, which owns the payment records
 
 
 def parse_optional_args(args: List[str]) -> Union[Tuple[bool, str, str], bool]:
@@ -54,12 +76,13 @@ def parse_optional_args(args: List[str]) -> Union[Tuple[bool, str, str], bool]:
     return service_charge, currency, reason[:-1]
 
 
-def parse_payment_cmd(tokens: list[str]) -> Union[dict, str]:
+def parse_payment_cmd(tokens: list[str], user_list: list[str]) -> Union[dict, str]:
     """
     Parse command tokens into a payment record dict.
 
     Args:
         tokens: Lowered tokens from one payment line (without command prefix).
+        user_list: The users of the ledger namespace.
 
     Returns:
         dict with keys: ppl_to_pay, operation_owe, ppl_get_paid, amount,
@@ -90,9 +113,11 @@ def parse_payment_cmd(tokens: list[str]) -> Union[dict, str]:
     if not is_valid_amount(tokens[3]):
         return "Invalid amount!"
     try:
-        amount: float = round(eval(amt_parser(tokens[3])), ROUND_OFF_DP)
+        amount: float = evaluate_amount(amt_parser(tokens[3]), ROUND_OFF_DP)
     except ZeroDivisionError:
         return "Invalid amount: Don't divide zero la..."
+    except ExpressionError as e:
+        return f"Invalid amount: {e}"
     except (ValueError, SyntaxError):
         return "What have you entered for the amount .-."
     if amount == 0.0:
@@ -148,47 +173,275 @@ def record_to_text(
     return f"{time_text}{cancelled_text}{author}: {payers} {operation} {payees} ${amount}{reason}{currency}"
 
 
-def firebase_worker():
-    while True:
-        task = firebase_queue.get()
-        if task is None:
-            firebase_queue.task_done()
-            return
+def collect_tasks(timeout: float | None = None) -> list:
+    """
+    Wait for the next unit of tasks and drain the queue into a micro-batch.
+
+    Args:
+        timeout: The seconds to wait for the first unit, or None to wait
+            until one arrives.
+
+    Returns:
+        list: The (namespace, tasks) units received within
+        FIREBASE_BATCH_MAX_LINGER seconds of the first one, up to
+        FIREBASE_BATCH_MAX_SIZE tasks unless a unit needs more, or no units on
+        timeout; a trailing None means the worker should stop.
+    """
+    try:
+        units = [firebase_queue.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    size = len(units[0][1]) if units[0] else 0
+    deadline = time.monotonic() + FIREBASE_BATCH_MAX_LINGER
+    while units[-1] is not None and size < FIREBASE_BATCH_MAX_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            units.append(firebase_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+        size += len(units[-1][1]) if units[-1] else 0
+    return units
+
+
+def queue_tasks(ns: LedgerNamespace, tasks: list[dict]) -> None:
+    """
+    Queue the tasks of one transaction for the firebase worker.
+
+    The tasks are journaled and queued as one unit, which the worker always
+    commits in a single batch, so they are written all or nothing.
+
+    Args:
+        ns: The ledger namespace of the transaction.
+        tasks: The user, event and snapshot tasks of the transaction.
+
+    Returns:
+        None.
+    """
+    with ns.pending_lock:
+        for task in tasks:
+            if "user" in task:
+                ns.pending_writes[task["user"]] += 1
+    ns.journal.append(tasks)
+    firebase_queue.put((ns, tasks))
+
+
+def release_tasks(ns: LedgerNamespace, tasks: list[dict]) -> None:
+    """Mark the given tasks as no longer pending"""
+    with ns.pending_lock:
+        for task in tasks:
+            if "user" in task:
+                ns.pending_writes[task["user"]] -= 1
+                if ns.pending_writes[task["user"]] <= 0:
+                    del ns.pending_writes[task["user"]]
 
+
+def event_tasks(ns: LedgerNamespace, *events: dict) -> list[dict]:
+    """Return the tasks recording an applied transaction in the event-sourced ledger"""
+    if ns.event_store is None:
+        return []
+    return ns.event_store.record(list(events), ns.payment_records)
+
+
+def rebuild_balances(ns: LedgerNamespace, at: datetime) -> Ledger | None:
+    """
+    Rebuild the balances at a point in time from the event-sourced ledger.
+
+    Args:
+        ns: The ledger namespace.
+        at: The time to rebuild the balances at.
+
+    Returns:
+        Ledger | None: The balances, or None if event sourcing is disabled or
+        no history goes back so far.
+    """
+    if ns.event_store is None:
+        return None
+    return ns.event_store.rebuild(at)
+
+
+def reconcile_balances(
+    ns: LedgerNamespace, updates: list[dict], balances: dict[str, float]
+) -> dict[str, int]:
+    """
+    Compare the balances written by the worker with the expected ones.
+
+    Payments add their delta on the server, so a balance that differs from
+    the last one written plus the delta was changed by another writer, e.g.
+    another bot instance, in between.
+
+    Args:
+        ns: The ledger namespace of the batch.
+        updates: The coalesced tasks of a committed batch, in order.
+        balances: The balances on the server after the payment tasks, or
+            None if they are not known, in which case the expected ones are
+            taken as written.
+
+    Returns:
+        dict[str, int]: The changes of other writers to each balance in units.
+    """
+    drift = Counter()
+    for task in updates:
+        name = task.get("user")
         match task["type"]:
             case "create":
-                firebase_manager.create_user(task["user"], task["timestamp"])
+                ns.committed_balances[name] = 0
             case "delete":
-                firebase_manager.delete_user(task["user"])
+                ns.committed_balances.pop(name, None)
             case "payment":
-                user = task["user"]
-                balance = task["balance"]
-                timestamp = task["timestamp"]
-                firebase_manager.update_user_balance(user, balance, timestamp)
+                expected = ns.committed_balances.get(name, 0) + to_units(task["delta"])
+                actual = to_units(balances[name]) if balances is not None else expected
+                if actual != expected:
+                    drift[name] += actual - expected
+                ns.committed_balances[name] = actual
+    return drift
+
+
+def apply_drift(ns: LedgerNamespace, drift: dict[str, int]) -> None:
+    """Add the balance changes of other writers to the payment records"""
+    for name, units in drift.items():
+        if name in ns.payment_records:
+            ns.payment_records[name] += units
+    logging.info(f"Applied balance changes of other writers to {', '.join(drift)}")
+
+
+def write_tasks(ns: LedgerNamespace, tasks: list[dict]) -> None:
+    """Commit the queued tasks of a namespace as one batch, then acknowledge them"""
+    updates = coalesce_tasks(tasks)
+    ns.journal.sync()
+    balances = ns.commit(updates, tasks)
+    acknowledge_tasks(ns, tasks, updates, balances)
+
+
+def acknowledge_tasks(
+    ns: LedgerNamespace,
+    tasks: list[dict],
+    updates: list[dict],
+    balances: dict[str, float] | None,
+) -> None:
+    """Acknowledge committed tasks and apply the changes of other writers"""
+    seqs = [task["seq"] for task in tasks]
+    ns.journal.ack(min(seqs), max(seqs))
+    release_tasks(ns, tasks)
+    drift = reconcile_balances(ns, updates, balances)
+    if drift and ns.users_watch is None:  # else the listener applies them
+        if records_loop is not None:
+            records_loop.call_soon_threadsafe(apply_drift, ns, drift)
+        else:
+            apply_drift(ns, drift)
 
-        firebase_queue.task_done()
 
+def skip_committed(ns: LedgerNamespace, units: list[list[dict]]) -> list[list[dict]]:
+    """
+    Acknowledge the units that a failed batch committed after all.
+
+    A batch may fail after its commit, if acknowledging it raises or if the
+    commit times out after the storage applied it. Payments are written as
+    deltas, so committing the batch again would apply them twice; instead,
+    every unit up to the commit marker of this instance is acknowledged.
 
-def show_payment_record(author_id=None) -> str:
+    Args:
+        ns: The ledger namespace of the units.
+        units: The units of tasks not written yet, in journal order.
+
+    Returns:
+        list[list[dict]]: The units that still have to be committed.
+    """
+    committed_seq = firebase_manager.get_journal_seq(JOURNAL_ID, ns.name)
+    committed = 0
+    while committed < len(units) and units[committed][-1]["seq"] <= committed_seq:
+        committed += 1
+    if committed:
+        tasks = [task for unit in units[:committed] for task in unit]
+        acknowledge_tasks(ns, tasks, coalesce_tasks(tasks), None)
+        logging.info(f"Skipped {len(tasks)} tasks a failed batch had committed")
+    return units[committed:]
+
+
+def split_units(units: list[list[dict]]) -> list[list[list[dict]]]:
+    """
+    Group units of tasks into batches of up to FIREBASE_BATCH_MAX_SIZE tasks.
+
+    Args:
+        units: The units of tasks, in queue order.
+
+    Returns:
+        list[list[list[dict]]]: The units of each batch, in order; a unit is
+        never split, so a unit larger than the limit is a batch of its own.
+    """
+    batches, size = [], 0
+    for tasks in units:
+        if batches and size + len(tasks) <= FIREBASE_BATCH_MAX_SIZE:
+            batches[-1].append(tasks)
+            size += len(tasks)
+        else:
+            batches.append([tasks])
+            size = len(tasks)
+    return batches
+
+
+def firebase_worker():
+    # units of each namespace not written yet; after a failure, only the
+    # first batch of them is retried, so a long outage never grows a batch
+    backlog: dict[LedgerNamespace, list[list[dict]]] = {}
+    failed: set[LedgerNamespace] = set()  # a batch may have committed before failing
+    while True:
+        units = collect_tasks(FIREBASE_RETRY_INTERVAL if backlog else None)
+        for unit in units:
+            if unit is not None:
+                ns, tasks = unit
+                backlog.setdefault(ns, []).append(tasks)
+        for ns in list(backlog):
+            pending = backlog.pop(ns)
+            if ns in failed:
+                try:
+                    pending = skip_committed(ns, pending)
+                except Exception as e:
+                    logging.error(f"Failed to read the commit marker, retrying: {e}")
+                    backlog[ns] = pending
+                    continue
+                failed.discard(ns)
+            batches = split_units(pending)
+            for i, batch in enumerate(batches):
+                tasks = [task for unit in batch for task in unit]
+                try:
+                    write_tasks(ns, tasks)
+                except Exception as e:
+                    logging.error(f"Failed to write {len(tasks)} tasks to firebase, retrying: {e}")
+                    backlog[ns] = [unit for later in batches[i:] for unit in later]
+                    failed.add(ns)
+                    break
+        for _ in units:
+            firebase_queue.task_done()
+
+        if units and units[-1] is None:
+            if backlog:
+                unwritten = sum(len(unit) for pending in backlog.values() for unit in pending)
+                logging.error(f"{unwritten} unwritten tasks are left in the journals")
+            return
+
+
+def show_payment_record(records: Ledger, author_id=None) -> str:
     """
     Shows the payment records in a formatted string.
 
     Args:
+        records (Ledger): The balances to show.
         author_id (int, optional): The Discord user id of the command sender. Defaults to None.
 
     Returns:
         str: A formatted string of payment records, or an error message.
     """
     zero = take_money = need_pay = ""
-    sum = 0
     mapped_name = get_mapped_name(author_id)
 
     zero_items = []
     take_money_items = []
     need_pay_items = []
 
-    for name, amount in payment_records.items():
-        sum += amount
+    for name, units in records.items():
+        amount = from_units(units)
         record_text = ""
         if amount == 0:
             record_text = B(name) + " doesn't need to pay\n"
@@ -217,7 +470,7 @@ def show_payment_record(author_id=None) -> str:
         for _, record_text in sorted(need_pay_items, key=lambda item: item[0])
     )
 
-    if round(sum, 5) != 0:
+    if records.total() != 0:
         return "Error in records! Sum of payments is not zero"
 
     zero = zero + "\n" if zero else zero
@@ -227,18 +480,139 @@ def show_payment_record(author_id=None) -> str:
     return (zero + take_money + need_pay) or "Error! No payment records found"
 
 
-def refetch_payment_record() -> str:
-    """re-fetch payment records from firebase"""
-    global payment_records, user_list
-    payment_records = firebase_manager.fetch_payment_list()
-    user_list = list(payment_records.keys())
+async def show_payment_record_at(
+    ns: LedgerNamespace, message: list[str], author_id=None
+) -> str:
+    """
+    Shows the payment records at the end of a past day.
+
+    The records are rebuilt from the event-sourced ledger if it goes back so
+    far, else from the balance history of the loaded payment logs.
+
+    Args:
+        ns: The ledger namespace.
+        message: A split command message, e.g. `!list at 2025-01-31`.
+        author_id (int, optional): The Discord user id of the command sender. Defaults to None.
 
+    Returns:
+        str: A formatted string of the payment records, or an error message.
+    """
+    try:
+        if len(message) != 3 or message[1] != "at":
+            raise ValueError
+        day = datetime.strptime(message[2], "%Y-%m-%d")
+    except ValueError:
+        return B("Please enter a date. Syntax: !list at YYYY-MM-DD")
+
+    end = TIMEZONE.localize(day) + timedelta(days=1)
+    records = await firebase_manager.run_in_executor(rebuild_balances, ns, end)
+    if records is None:
+        if not ns.balance_history.covers(end):
+            return B(f"Payment logs before {message[2]} are not loaded")
+        records = ns.balance_history.balances_at(ns.payment_records, end)
+    return f"### Records at the end of {message[2]}\n" + show_payment_record(
+        records, author_id
+    )
 
-def show_payment_logs(message: list[str]) -> str:
+
+def refetch_payment_record(ns: LedgerNamespace) -> None:
+    """re-fetch payment records from firebase, unless the listener keeps them updated"""
+    if ns.users_watch is not None:
+        return
+    ns.payment_records = ns.fetch_records()
+    ns.user_list = ns.payment_records.keys()
+
+
+def apply_user_change(
+    ns: LedgerNamespace, change_type: str, name: str, balance: float
+) -> None:
+    """
+    Apply a change of the users collection to the in-memory records.
+
+    Changes to users with queued writes are skipped, since the local records
+    are newer than the snapshot and the write will be echoed back later.
+
+    Args:
+        ns: The ledger namespace of the user.
+        change_type: ADDED, MODIFIED or REMOVED.
+        name: The name of the changed user.
+        balance: The balance of the user stored in firebase.
+
+    Returns:
+        None.
+    """
+    with ns.pending_lock:
+        if ns.pending_writes[name] > 0:
+            return
+
+    if change_type == "REMOVED":
+        if name in ns.payment_records:
+            del ns.payment_records[name]
+            ns.user_list.remove(name)
+        return
+
+    if name not in ns.payment_records:
+        ns.user_list.append(name)
+    ns.payment_records[name] = to_units(balance)
+
+
+def watch_ledger(ns: LedgerNamespace) -> None:
+    """Keep the payment records of a namespace updated from firebase change events"""
+    if not FIREBASE_LISTENER or records_loop is None or ns.users_watch is not None:
+        return
+
+    def on_change(change_type: str, name: str, balance: float) -> None:
+        records_loop.call_soon_threadsafe(
+            apply_user_change, ns, change_type, name, balance
+        )
+
+    ns.users_watch = firebase_manager.watch_users(on_change, ns.name)
+    if ns.users_watch is not None:
+        logging.info(f"Listening to changes of the payment records of {ns.name or 'default'}")
+
+
+def unwatch_ledger(ns: LedgerNamespace) -> None:
+    if ns.users_watch is not None:
+        ns.users_watch.unsubscribe()
+        ns.users_watch = None
+
+
+def close_ledger(ns: LedgerNamespace) -> None:
+    """Release an idle ledger namespace evicted from the cache"""
+    unwatch_ledger(ns)
+    ns.close()
+    firebase_manager.close_namespace(ns.name)
+
+
+def start_listener(loop: asyncio.AbstractEventLoop) -> None:
+    """
+    Keep the payment records updated from firebase change events.
+
+    Args:
+        loop: The event loop of the bot; changes are applied on it so that
+            they never interleave with a payment in progress.
+
+    Returns:
+        None.
+    """
+    global records_loop
+    records_loop = loop
+    for ns in ledgers:
+        watch_ledger(ns)
+
+
+def stop_listener() -> None:
+    """Stop listening to firebase change events"""
+    for ns in ledgers:
+        unwatch_ledger(ns)
+
+
+def show_payment_logs(ns: LedgerNamespace, message: list[str]) -> str:
     """
     Show the latest payment logs.
 
     Args:
+        ns: The ledger namespace.
         message: A split command message.
 
     Returns:
@@ -253,10 +627,9 @@ def show_payment_logs(message: list[str]) -> str:
     except ValueError:
         return B("Please enter a number between 1 and 50. Syntax: !log [number]")
 
-    logs = firebase_manager.get_payment_logs(n)
+    logs = firebase_manager.get_payment_logs(n, ns.name)
     log_list = []
     for log in logs:
-        log = log.to_dict()
         log_list.append(
             record_to_text(
                 log["enteredBy"],
@@ -273,15 +646,44 @@ def show_payment_logs(message: list[str]) -> str:
     return log_text or B("No payment logs found")
 
 
-def show_logs(message: list[str]) -> str:
+def logs_to_text(logs: list[dict], command_type: str | None) -> str:
+    """Format logs, newest first, as lines oldest first"""
+    log_list = []
+    for log in logs:
+        if command_type == "payment":
+            log_list.append(
+                record_to_text(
+                    log["enteredBy"],
+                    log["payers"],
+                    log["operation"],
+                    log["payees"],
+                    log["amount"],
+                    log["reason"],
+                    timestamp=log["timestamp"],
+                    cancelled=log["cancelled"],
+                )
+            )
+        else:
+            log_list.append(
+                f"[{log['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}] {B(log['channel'])} {log['enteredBy']}: {log['command']}"
+            )
+    return "\n".join(reversed(log_list)) or B("No logs found")
+
+
+async def show_logs(
+    ns: LedgerNamespace, message: list[str], author_id: int
+) -> tuple[str, HistoryView | None]:
     """
-    Show command history with optional filters.
+    Show command history with optional filters, one page at a time.
 
     Args:
+        ns: The ledger namespace.
         message: A split command message.
+        author_id: The Discord user id of the command sender, who can turn pages.
 
     Returns:
-        str: The formatted log history.
+        tuple[str, HistoryView | None]: The formatted first page of the log
+        history, and the view to page further back if there are older logs.
     """
     # TODO: command/ui for showing all logs
     # no filter checking for now
@@ -305,41 +707,35 @@ def show_logs(message: list[str]) -> str:
 
         # Case 4: !history (default, handled by initial values)
     except ValueError:
-        return B(
-            "Please enter a valid number between 1 and 50. Syntax: !history [command_type] [number]"
+        return (
+            B(
+                "Please enter a valid number between 1 and 50. Syntax: !history [command_type] [number]"
+            ),
+            None,
         )
 
     if command_type == "all":
         command_type = None
+    namespace = ns.name  # pages may be turned after the namespace is evicted
 
-    logs = firebase_manager.get_logs(n, command_type)
-    log_list = []
-    for log in logs:
-        if command_type == "payment":
-            log_list.append(
-                record_to_text(
-                    log["enteredBy"],
-                    log["payers"],
-                    log["operation"],
-                    log["payees"],
-                    log["amount"],
-                    log["reason"],
-                    timestamp=log["timestamp"],
-                    cancelled=log["cancelled"],
-                )
-            )
-        else:
-            log_list.append(
-                f"[{log['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}] {B(log['channel'])} {log['enteredBy']}: {log['command']}"
-            )
-    return "\n".join(reversed(log_list)) or B("No logs found")
+    async def load_page(cursor: LogCursor | None) -> tuple[str, LogCursor | None]:
+        logs, next_cursor = await firebase_manager.get_logs_page_async(
+            n, command_type, cursor, namespace
+        )
+        return logs_to_text(logs, command_type), next_cursor
+
+    text, next_cursor = await load_page(None)
+    if next_cursor is None:
+        return text, None
+    return text, HistoryView(author_id, load_page, next_cursor)
 
 
-async def create_user(bot, message) -> str:
+async def create_user(ns: LedgerNamespace, bot, message) -> str:
     """
     Create a new user.
 
     Args:
+        ns: The ledger namespace.
         bot: The Discord bot instance.
         message: The command message from the user.
 
@@ -351,29 +747,33 @@ async def create_user(bot, message) -> str:
         return B("Please enter a name for the new user")
 
     name = msg[1]
-    if name in user_list:
-        return f"**Failed to create {name}!**\nPerson already exists."
-
-    payment_records[name] = 0.0
-    user_list.append(name)
-    firebase_queue.put(
-        {
-            "type": "create",
-            "user": name,
-            "timestamp": message.message.created_at.astimezone(TIMEZONE),
-        }
-    )
-    await bot.get_channel(LOG_CHANNEL_ID).send(
+    timestamp = message.message.created_at.astimezone(TIMEZONE)
+    async with ns.user_locks.hold([name]):
+        if name in ns.user_list:
+            return f"**Failed to create {name}!**\nPerson already exists."
+        ns.payment_records.add(name)
+        ns.user_list.append(name)
+        queue_tasks(
+            ns,
+            [
+                {"type": "create", "user": name, "timestamp": timestamp},
+                *event_tasks(
+                    ns, {"kind": "create", "user": name, "timestamp": timestamp}
+                ),
+            ],
+        )
+    await bot.get_channel(ns.log_channel_id).send(
         f"{message.author.name}: Created new person: {name}"
     )
-    return f"### Person {name} created!\n{show_payment_record()}"
+    return f"### Person {name} created!\n{show_payment_record(ns.payment_records)}"
 
 
-async def delete_user(bot, message) -> str:
+async def delete_user(ns: LedgerNamespace, bot, message) -> str:
     """
     Delete a user if they have no debts.
 
     Args:
+        ns: The ledger namespace.
         bot: The Discord bot instance.
         message: The command message from the user.
 
@@ -385,27 +785,32 @@ async def delete_user(bot, message) -> str:
         return B("Please enter a name for the user to delete")
 
     name = msg[1]
-    if name not in user_list:
-        return f"**Failed to delete {name}!**\nPerson does not exist."
-
-    if payment_records[name] != 0.0:
-        return f"**Failed to delete {name}!**\nPerson has debts, cannot be deleted."
-
-    del payment_records[name]
-    user_list.remove(name)
-    firebase_queue.put(
-        {
-            "type": "delete",
-            "user": name,
-        }
-    )
-    await bot.get_channel(LOG_CHANNEL_ID).send(
+    timestamp = message.message.created_at.astimezone(TIMEZONE)
+    async with ns.user_locks.hold([name]):
+        if name not in ns.user_list:
+            return f"**Failed to delete {name}!**\nPerson does not exist."
+        if ns.payment_records[name] != 0:
+            return f"**Failed to delete {name}!**\nPerson has debts, cannot be deleted."
+
+        del ns.payment_records[name]
+        ns.user_list.remove(name)
+        queue_tasks(
+            ns,
+            [
+                {"type": "delete", "user": name},
+                *event_tasks(
+                    ns, {"kind": "delete", "user": name, "timestamp": timestamp}
+                ),
+            ],
+        )
+    ns.user_locks.discard(name)
+    await bot.get_channel(ns.log_channel_id).send(
         f"{message.author.name}: Deleted person: {name}"
     )
-    return f"### Person {name} deleted!\n{show_payment_record()}"
+    return f"### Person {name} deleted!\n{show_payment_record(ns.payment_records)}"
 
 
-def exchange_currency(from_cur: str, amount: float) -> tuple[float, float]:
+async def exchange_currency(from_cur: str, amount: float) -> tuple[float, float]:
     """
     Convert an amount to the unified currency.
 
@@ -419,122 +824,179 @@ def exchange_currency(from_cur: str, amount: float) -> tuple[float, float]:
     amount = float(amount)
     if from_cur == UNIFIED_CURRENCY:
         return amount, 1.0
-    to_cur = UNIFIED_CURRENCY
-    currencies = to_cur + "%2C" + from_cur
-    url = f"https://openexchangerates.org/api/latest.json?app_id={OPEN_EXCHANGE_RATE_API_KEY}&symbols={currencies}"
-    headers = {"accept": "application/json"}
-    response = requests.get(url, headers=headers)
-    rates = response.json().get("rates", {})
-    rate = rates.get(to_cur, 0) / rates.get(from_cur, 1)
+    rate = await rate_table.get_rate(from_cur, UNIFIED_CURRENCY)
     return amount * rate, round(rate, EXCHANGE_RATE_ROUND_OFF_DP)
 
 
-def synchronize_payment_records(users: list[str], timestamp) -> None:
+def balance_tasks(names: list[str], before, after, timestamp) -> list[dict]:
     """
-    Queue balance updates for the given users.
+    Return the balance updates of the given users.
+
+    The updates carry the change of each balance, which the storage adds on
+    the server, so concurrent writers never overwrite each other's changes.
 
     Args:
-        users: The user names to sync.
+        names: The user names.
+        before: The balance of each user before the change, in units.
+        after: The balance of each user after the change, in units.
         timestamp: The timestamp to write with the updates.
 
     Returns:
-        None.
+        list[dict]: The tasks writing the changed balances.
     """
-    for user in users:
-        firebase_queue.put(
-            {
-                "type": "payment",
-                "user": user,
-                "balance": payment_records[user],
-                "timestamp": timestamp,
-            }
+    return [
+        {
+            "type": "payment",
+            "user": name,
+            "delta": from_units(current - original),
+            "timestamp": timestamp,
+        }
+        for name, original, current in zip(names, before, after)
+        if original != current
+    ]
+
+
+def balance_change_text(target: str, original: int, current: int) -> str:
+    """Describe the change of a balance in units, e.g. for the update summary"""
+    p = original > 0  # originally positive
+    p0 = original == 0  # originally zero
+    c = current > 0  # currently positive
+    c0 = current == 0  # currently zero
+
+    original = from_units(abs(original))
+    current = from_units(abs(current))
+
+    """
+    p 0: jaga pay XXX __ -> XXX don't pay
+    !p 0: XXX pay jaga __ -> XXX don't pay
+    0 c: jaga pay XXX __ (new record)
+    0 !c: XXX pay jaga __ (new record)
+
+    p c: jaga pay XXX: __ -> __
+    !p c: XXX pay jaga __ -> jaga pay XXX __
+    p !c: jaga pay XXX __ -> XXX pay jaga __
+    !p !c: XXX pay jaga: __ -> __
+    """
+
+    # ???
+    if p and c0:
+        return f"-# {B(target)} should receive ${original} → {B(target)} doesn't need to pay\n"
+    elif not p and c0:
+        return f"-# {B(target)} needs to pay ${original} → {B(target)} doesn't need to pay\n"
+    elif p0 and c:
+        return f"-# {B(target)} should receive ${current} (new record)\n"
+    elif p0 and not c:
+        return f"-# {B(target)} needs to pay ${current} (new record)\n"
+    elif p and c:
+        return f"-# {B(target)} should receive: ${original} → ${current}\n"
+    elif not p and c:
+        return f"-# {B(target)} needs to pay ${original} → {B(target)} should receive ${current}\n"
+    elif p and not c:
+        return f"-# {B(target)} should receive ${original} → {B(target)} needs to pay ${current}\n"
+    else:
+        return f"-# {B(target)} needs to pay: ${original} → ${current}\n"
+
+
+async def apply_payments(
+    ns: LedgerNamespace,
+    payments: list[tuple[str, str, float]],
+    timestamp,
+    recorded_at=None,
+    precondition: Callable[[], bool] | None = None,
+) -> str | None:
+    """
+    Apply a batch of payment transactions and return the update summary.
+
+    The locks of all users of the batch are held while it is applied to the
+    ledger with one scatter-add, and the balances and events are queued as
+    one unit, so the batch is applied and written all or nothing. The
+    summary lists the balance of every touched user before and after.
+
+    Args:
+        ns: The ledger namespace of the transactions.
+        payments: (ppl_to_pay, ppl_get_paid, amount) of each transaction,
+            where the users are comma-separated and the amount is in unified
+            currency.
+        timestamp: The timestamp to associate with the update.
+        recorded_at: The time of the transactions in the balance history;
+            defaults to `timestamp`. Undos are recorded at the time of the
+            undone transactions, which leaves both out of the history.
+        precondition: Checked under the locks right before the batch is
+            applied, for batches planned from the balances.
+
+    Returns:
+        str | None: A summary of the payment changes, or None if the
+        precondition failed and nothing was applied.
+    """
+    batch = [
+        (ppl_to_pay.split(","), ppl_get_paid.split(","), to_units(amount))
+        for ppl_to_pay, ppl_get_paid, amount in payments
+    ]
+    users = [user for pay_list, paid_list, _ in batch for user in pay_list + paid_list]
+    async with ns.user_locks.hold(users):
+        if precondition is not None and not precondition():
+            return None
+        try:
+            names, before, after = ns.payment_records.apply(batch)
+        except KeyError:
+            return B("ERROR: Person not found")
+        except OverflowError:
+            return B("ERROR: Invalid amount, a balance would be too large")
+
+        tasks = balance_tasks(names, before, after, timestamp)
+        # all events at once, as a snapshot may only follow the last of them
+        tasks += event_tasks(
+            ns,
+            *(
+                {
+                    "kind": "payment",
+                    "timestamp": timestamp,
+                    "payers": pay_list,
+                    "payees": paid_list,
+                    "units": units,
+                }
+                for pay_list, paid_list, units in batch
+            ),
         )
+        queue_tasks(ns, tasks)
+        for ppl_to_pay, ppl_get_paid, amount in payments:
+            ns.balance_history.record(
+                ppl_to_pay, ppl_get_paid, amount, recorded_at or timestamp
+            )
+
+    return "".join(
+        balance_change_text(name, original, current)
+        for name, original, current in zip(names, before, after)
+        if original != current
+    )
 
 
-def payment_handling(
-    ppl_to_pay: str, ppl_get_paid: str, amount: float, timestamp
+async def payment_handling(
+    ns: LedgerNamespace,
+    ppl_to_pay: str,
+    ppl_get_paid: str,
+    amount: float,
+    timestamp,
+    recorded_at=None,
 ) -> str:
     """
     Apply a payment transaction and return the update summary.
 
     Args:
+        ns: The ledger namespace of the transaction.
         ppl_to_pay: The left user or users who pay.
         ppl_get_paid: The right user or users who receive payment.
         amount: The amount to be paid in unified currency.
         timestamp: The timestamp to associate with the update.
+        recorded_at: The time of the transaction in the balance history; see
+            `apply_payments`.
 
     Returns:
         str: A summary of the payment changes.
     """
-
-    def owe(person_to_pay: str, person_get_paid: str) -> str:
-        """Performs a single owe operation between two persons"""
-        if person_to_pay == person_get_paid:
-            return ""
-        if person_to_pay is None:
-            target = person_get_paid
-            add = True
-        elif person_get_paid is None:
-            target = person_to_pay
-            add = False
-        else:
-            raise Exception("Core logic error????????????")  # should not happen
-
-        original = payment_records[target]
-        current = round(original + amount if add else original - amount, ROUND_OFF_DP)
-        payment_records[target] = current
-
-        p = original > 0  # originally positive
-        p0 = original == 0  # originally zero
-        c = current > 0  # currently positive
-        c0 = current == 0  # currently zero
-
-        original = abs(original)
-        current = abs(current)
-
-        """
-        p 0: jaga pay XXX __ -> XXX don't pay
-        !p 0: XXX pay jaga __ -> XXX don't pay
-        0 c: jaga pay XXX __ (new record)
-        0 !c: XXX pay jaga __ (new record)
-
-        p c: jaga pay XXX: __ -> __
-        !p c: XXX pay jaga __ -> jaga pay XXX __
-        p !c: jaga pay XXX __ -> XXX pay jaga __
-        !p !c: XXX pay jaga: __ -> __
-        """
-
-        # ???
-        if p and c0:
-            return f"-# {B(target)} should receive ${original} → {B(target)} doesn't need to pay\n"
-        elif not p and c0:
-            return f"-# {B(target)} needs to pay ${original} → {B(target)} doesn't need to pay\n"
-        elif p0 and c:
-            return f"-# {B(target)} should receive ${current} (new record)\n"
-        elif p0 and not c:
-            return f"-# {B(target)} needs to pay ${current} (new record)\n"
-        elif p and c:
-            return f"-# {B(target)} should receive: ${original} → ${current}\n"
-        elif not p and c:
-            return f"-# {B(target)} needs to pay ${original} → {B(target)} should receive ${current}\n"
-        elif p and not c:
-            return f"-# {B(target)} should receive ${original} → {B(target)} needs to pay ${current}\n"
-        else:
-            return f"-# {B(target)} needs to pay: ${original} → ${current}\n"
-
-    try:
-        update = ""
-        pay_list = ppl_to_pay.split(",")
-        paid_list = ppl_get_paid.split(",")
-        for each_to_pay in pay_list:
-            for each_get_paid in paid_list:
-                update += owe(each_to_pay, None) + owe(None, each_get_paid)
-                update += "\n" if len(paid_list) > 1 else ""
-            update += "\n" if len(pay_list) > 1 else ""
-        synchronize_payment_records(pay_list + paid_list, timestamp)
-        return update
-    except KeyError:
-        return B("ERROR: Person not found")
+    return await apply_payments(
+        ns, [(ppl_to_pay, ppl_get_paid, amount)], timestamp, recorded_at
+    )
 
 
 def build_reason_text(reason: str) -> str:
@@ -554,7 +1016,7 @@ def build_currency_text(currency: str, exchange_rate: float) -> str:
         return ""
 
 
-def process_amount(
+async def process_amount(
     amount: str, currency: str, service_charge: bool
 ) -> Tuple[float, float]:
     """
@@ -568,13 +1030,14 @@ def process_amount(
     Returns:
         tuple[float, float]: The converted amount and exchange rate.
     """
-    actual_amount, exchange_rate = exchange_currency(currency, amount)
+    actual_amount, exchange_rate = await exchange_currency(currency, amount)
     actual_amount *= 1.1 if service_charge else 1
     actual_amount = round(actual_amount, ROUND_OFF_DP)
     return actual_amount, exchange_rate
 
 
-def parse_payment(message: discord.Message, parsed: dict, msg_time: datetime) -> tuple:
+async def prepare_payment(message: discord.Message, parsed: dict) -> tuple:
+    """Convert the amount of a parsed payment and build its log, without applying it"""
     ppl_to_pay = parsed["ppl_to_pay"]
     operation_owe = parsed["operation_owe"]
     ppl_get_paid = parsed["ppl_get_paid"]
@@ -584,7 +1047,9 @@ def parse_payment(message: discord.Message, parsed: dict, msg_time: datetime) ->
     reason = parsed["reason"]
 
     # Convert currency and apply surcharge
-    actual_amount, exchange_rate = process_amount(amount, currency, service_charge)
+    actual_amount, exchange_rate = await process_amount(
+        amount, currency, service_charge
+    )
 
     # Generate log content
     reason_text = build_reason_text(reason)
@@ -599,9 +1064,6 @@ def parse_payment(message: discord.Message, parsed: dict, msg_time: datetime) ->
     if not operation_owe:
         ppl_to_pay, ppl_get_paid = ppl_get_paid, ppl_to_pay
 
-    # perform the payment operation
-    update = payment_handling(ppl_to_pay, ppl_get_paid, actual_amount, msg_time)
-
     return (
         ppl_to_pay,
         operation_text,
@@ -609,15 +1071,28 @@ def parse_payment(message: discord.Message, parsed: dict, msg_time: datetime) ->
         actual_amount,
         reason_text,
         log_content,
-        update,
     )
 
 
-async def payment_system(bot, message, prev_input=None) -> None:
+async def parse_payment(
+    ns: LedgerNamespace, message: discord.Message, parsed: dict, msg_time: datetime
+) -> tuple:
+    prepared = await prepare_payment(message, parsed)
+    ppl_to_pay, _, ppl_get_paid, actual_amount, _, _ = prepared
+
+    # perform the payment operation
+    update = await payment_handling(
+        ns, ppl_to_pay, ppl_get_paid, actual_amount, msg_time
+    )
+    return (*prepared, update)
+
+
+async def payment_system(ns: LedgerNamespace, bot, message, prev_input=None) -> None:
     """
     Process a payment command and update the payment records.
 
     Args:
+        ns: The ledger namespace.
         bot: The Discord bot instance.
         message: The command message from the user.
         prev_input: Previous parsed input for edit flow.
@@ -634,7 +1109,7 @@ async def payment_system(bot, message, prev_input=None) -> None:
             dict[str, object] | str: Parsed payment data or an error message.
         """
         if prev_input is None:
-            menu = InputView(message.author.id, user_list)
+            menu = InputView(message.author.id, ns.user_list)
         else:
             ptp = prev_input["ppl_to_pay"]
             op = prev_input["operation_owe"]
@@ -644,7 +1119,7 @@ async def payment_system(bot, message, prev_input=None) -> None:
             cur = prev_input["currency"]
             reason = prev_input["reason"]
             menu = InputView(
-                message.author.id, user_list, ptp, op, pgp, amt, sc, cur, reason
+                message.author.id, ns.user_list, ptp, op, pgp, amt, sc, cur, reason
             )
 
         menu.update_description()
@@ -669,7 +1144,7 @@ async def payment_system(bot, message, prev_input=None) -> None:
             "reason": menu.reason,
         }
 
-    log_channel = bot.get_channel(LOG_CHANNEL_ID)
+    log_channel = bot.get_channel(ns.log_channel_id)
     msg = message.message.content.lower().split()
     cmd_input = len(msg) >= 5
 
@@ -677,11 +1152,11 @@ async def payment_system(bot, message, prev_input=None) -> None:
     raw_lines = message.message.content.split("\n")
     is_multi_line = len(raw_lines) > 1 and cmd_input and prev_input is None
     if is_multi_line:
-        await handle_multi_line_payment(message, raw_lines, log_channel)
+        await handle_multi_line_payment(ns, message, raw_lines, log_channel)
         return
 
     if cmd_input:
-        parsed_input = parse_payment_cmd(msg[1:])
+        parsed_input = parse_payment_cmd(msg[1:], ns.user_list)
     else:
         parsed_input = await parse_ui_input()
 
@@ -694,7 +1169,7 @@ async def payment_system(bot, message, prev_input=None) -> None:
     msg_time = message.message.created_at.astimezone(TIMEZONE)
 
     ppl_to_pay, op_text, ppl_get_paid, amount, reason, log_content, update = (
-        parse_payment(message, parsed_input, msg_time)
+        await parse_payment(ns, message, parsed_input, msg_time)
     )
 
     # response content
@@ -715,12 +1190,13 @@ async def payment_system(bot, message, prev_input=None) -> None:
     )
 
     await log_channel.send(log_content)
-    log_ref = firebase_manager.write_log(
+    log_ref = await firebase_manager.write_log_async(
         "payment",
         channel_to_text(message.channel),
         message.author.name,
         message.message.content,
         msg_time,
+        ns.name,
         payers=ppl_to_pay,
         operation=op_text,
         payees=ppl_get_paid,
@@ -733,11 +1209,13 @@ async def payment_system(bot, message, prev_input=None) -> None:
 
     # handle undo operation
     if undo_view.undo and undo_view.edit:
-        payment_handling(
+        await payment_handling(
+            ns,
             ppl_get_paid,
             ppl_to_pay,
             amount,
             undo_view.cancelled_at.astimezone(TIMEZONE),
+            recorded_at=msg_time,
         )
         await undo_view.message.reply(
             B(
@@ -746,16 +1224,18 @@ async def payment_system(bot, message, prev_input=None) -> None:
         )
         undo_log_content = f"{undo_view.undo_user}: __UNDO__ **[**{log_content}**]**"
         await log_channel.send(undo_log_content)
-        firebase_manager.update_log(log_ref, cancelled=True)
-        firebase_manager.write_log(
+        await firebase_manager.update_log_async(log_ref, ns.name, cancelled=True)
+        await audit_log.submit(
             "manage",
             channel_to_text(message.channel),
             undo_view.undo_user,
             "undo",
             undo_view.cancelled_at.astimezone(TIMEZONE),
+            ns.name,
             cancelledRecord=log_content,
         )
         await payment_system(
+            ns,
             bot,
             message,
             prev_input={
@@ -769,33 +1249,39 @@ async def payment_system(bot, message, prev_input=None) -> None:
             },
         )
     elif undo_view.undo:
-        payment_handling(
+        await payment_handling(
+            ns,
             ppl_get_paid,
             ppl_to_pay,
             amount,
             undo_view.cancelled_at.astimezone(TIMEZONE),
+            recorded_at=msg_time,
         )
         await undo_view.message.reply(B("Undo has been executed!"))
         undo_log_content = f"{undo_view.undo_user}: __UNDO__ **[**{log_content}**]**"
         await log_channel.send(undo_log_content)
-        firebase_manager.update_log(log_ref, cancelled=True)
-        firebase_manager.write_log(
+        await firebase_manager.update_log_async(log_ref, ns.name, cancelled=True)
+        await audit_log.submit(
             "manage",
             channel_to_text(message.channel),
             undo_view.undo_user,
             "undo",
             undo_view.cancelled_at.astimezone(TIMEZONE),
+            ns.name,
             cancelledRecord=log_content,
         )
 
 
-async def handle_multi_line_payment(message, raw_lines: list[str], log_channel) -> None:
+async def handle_multi_line_payment(
+    ns: LedgerNamespace, message, raw_lines: list[str], log_channel
+) -> None:
     """
     Process multi-line payment input (command-line only).
     Each non-empty line after the first is parsed as a separate record.
     All records share a single UndoView that reverses every transaction.
 
     Args:
+        ns: The ledger namespace.
         message: The command message from the user.
         raw_lines: Lines split from the raw message content.
         log_channel: The discord log channel to send logs to.
@@ -816,7 +1302,7 @@ async def handle_multi_line_payment(message, raw_lines: list[str], log_channel)
                 f"-# Line {i + 1}: Invalid format (expected: <payers> owe/payback <payee> <amount>)"
             )
             continue
-        parsed = parse_payment_cmd(tokens)
+        parsed = parse_payment_cmd(tokens, ns.user_list)
         if isinstance(parsed, str):
             errors.append(f"-# Line {i + 1}: {parsed}")
             continue
@@ -831,23 +1317,55 @@ async def handle_multi_line_payment(message, raw_lines: list[str], log_channel)
     if errors:
         await message.reply(B("Some lines could not be parsed:\n" + "\n".join(errors)))
 
+    await process_payment_batch(ns, message, parsed_txns, log_channel)
+
+
+async def process_payment_batch(
+    ns: LedgerNamespace,
+    message,
+    parsed_txns: list[dict],
+    log_channel,
+    precondition: Callable[[], bool] | None = None,
+) -> None:
+    """
+    Apply and log a batch of parsed payment records.
+    All records share a single UndoView that reverses every transaction.
+
+    Args:
+        ns: The ledger namespace.
+        message: The command message from the user.
+        parsed_txns: The records parsed by `parse_payment_cmd`.
+        log_channel: The discord log channel to send logs to.
+        precondition: Checked right before the batch is applied, see
+            `apply_payments`; nothing is recorded if it fails.
+    """
     # Process each parsed transaction
     response_msg = await message.reply(B("Processing payment... Please wait."))
     msg_time = message.message.created_at.astimezone(TIMEZONE)
 
-    processed_txns = []  # {ppl_to_pay, ppl_get_paid, actual_amount, log_content, log_ref}
-    for parsed in parsed_txns:
-        ppl_to_pay, op_text, ppl_get_paid, amount, reason, log_content, update = (
-            parse_payment(message, parsed, msg_time)
+    prepared_txns = [await prepare_payment(message, parsed) for parsed in parsed_txns]
+    update = await apply_payments(
+        ns,
+        [(txn[0], txn[2], txn[3]) for txn in prepared_txns],
+        msg_time,
+        precondition=precondition,
+    )
+    if update is None:
+        await response_msg.edit(
+            content=B("Records changed while processing, nothing was recorded")
         )
+        return
 
+    processed_txns = []  # {ppl_to_pay, ppl_get_paid, actual_amount, log_content, log_ref}
+    for ppl_to_pay, op_text, ppl_get_paid, amount, reason, log_content in prepared_txns:
         # Log to firebase immediately
-        log_ref = firebase_manager.write_log(
+        log_ref = await firebase_manager.write_log_async(
             "payment",
             channel_to_text(message.channel),
             message.author.name,
             log_content,
             msg_time,
+            ns.name,
             payers=ppl_to_pay,
             operation=op_text,
             payees=ppl_get_paid,
@@ -864,14 +1382,10 @@ async def handle_multi_line_payment(message, raw_lines: list[str], log_channel)
                 "actual_amount": amount,
                 "log_content": log_content,
                 "log_ref": log_ref,
-                "update": update,
             }
         )
 
     # Build combined response
-    update_blocks = [
-        f"`{t['log_content']}`\n-# Updated:\n{t['update']}" for t in processed_txns
-    ]
     all_mentioned = set()
     for t in processed_txns:
         for u in t["ppl_to_pay"].split(",") + [t["ppl_get_paid"]]:
@@ -879,7 +1393,11 @@ async def handle_multi_line_payment(message, raw_lines: list[str], log_channel)
                 all_mentioned.add(USER_MAPPING[u])
     mention_text = " ".join(f"<@{uid}>" for uid in all_mentioned)
     mention_text = f"\n-# {mention_text}" if mention_text else ""
-    combined_response = "\n\n".join(update_blocks) + mention_text
+    combined_response = (
+        "\n".join(f"`{t['log_content']}`" for t in processed_txns)
+        + f"\n-# Updated records:\n{update}"
+        + mention_text
+    )
 
     # Single UndoView for the whole batch
     undo_view = UndoView(message.author.id, False, combined_response)
@@ -888,34 +1406,101 @@ async def handle_multi_line_payment(message, raw_lines: list[str], log_channel)
     )
     await undo_view.wait()
 
-    # Bulk undo: reverse every transaction in reverse order
+    # Bulk undo: reverse every transaction as one batch
     if undo_view.undo:
+        await apply_payments(
+            ns,
+            [
+                (txn["ppl_get_paid"], txn["ppl_to_pay"], txn["actual_amount"])
+                for txn in reversed(processed_txns)
+            ],
+            undo_view.cancelled_at.astimezone(TIMEZONE),
+            recorded_at=msg_time,
+        )
         for txn in reversed(processed_txns):
-            payment_handling(
-                txn["ppl_get_paid"],
-                txn["ppl_to_pay"],
-                txn["actual_amount"],
-                undo_view.cancelled_at.astimezone(TIMEZONE),
+            await firebase_manager.update_log_async(
+                txn["log_ref"], ns.name, cancelled=True
             )
-            firebase_manager.update_log(txn["log_ref"], cancelled=True)
             undo_log = f"{undo_view.undo_user}: __UNDO__ **[**{txn['log_content']}**]**"
             await log_channel.send(undo_log)
-            firebase_manager.write_log(
+            await audit_log.submit(
                 "manage",
                 channel_to_text(message.channel),
                 undo_view.undo_user,
                 "undo",
                 undo_view.cancelled_at.astimezone(TIMEZONE),
+                ns.name,
                 cancelledRecord=txn["log_content"],
             )
         await undo_view.message.reply(B("All records have been undone!"))
 
 
+async def settle_payments(ns: LedgerNamespace, bot, message) -> None:
+    """
+    Show the fewest paybacks that settle all payment records, or record them
+    as one batch with `!settle apply`.
+
+    Args:
+        ns: The ledger namespace.
+        bot: The Discord bot instance.
+        message: The command message from the user.
+
+    Returns:
+        None.
+    """
+    msg = message.message.content.lower().split()
+    balances = dict(ns.payment_records.items())
+    try:
+        transfers = plan_settlement(balances.items())
+    except ValueError:
+        await message.reply(B("Error in records! Sum of payments is not zero"))
+        return
+    if not transfers:
+        await message.reply(B("Everyone is settled!"))
+        return
+
+    if len(msg) < 2 or msg[1] != "apply":
+        lines = [
+            f"{B(payer)} pays back {B(receiver)} ${from_units(units)}"
+            for payer, receiver, units in transfers
+        ]
+        lines.append("-# Enter `!settle apply` to record these paybacks")
+        for text in split_text(["### Settlement plan"] + lines):
+            await message.reply(text)
+        return
+
+    parsed_txns = [
+        {
+            "ppl_to_pay": payer,
+            "operation_owe": False,
+            "ppl_get_paid": receiver,
+            "amount": from_units(units),
+            "service_charge": False,
+            "currency": UNIFIED_CURRENCY,
+            "reason": "settle",
+        }
+        for payer, receiver, units in transfers
+    ]
+    # the plan only holds if no payment landed since it was made
+    await process_payment_batch(
+        ns,
+        message,
+        parsed_txns,
+        bot.get_channel(ns.log_channel_id),
+        precondition=lambda: dict(ns.payment_records.items()) == balances,
+    )
+
+
 def terminate_worker():
     """Terminates the firebase worker thread"""
+    stop_listener()
     firebase_queue.put(None)
     firebase_queue.join()
+    for ns in ledgers:
+        ns.close()
 
 
+# the guild ledgers are loaded on first use, the default one is always loaded
+ledgers = LedgerCache(LEDGER_CACHE_SIZE, default_ledger, watch_ledger, close_ledger)
 payment_thread = threading.Thread(target=firebase_worker, daemon=False)
 payment_thread.start()
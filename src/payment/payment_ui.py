@@ -2,10 +2,12 @@ import discord
 
 from constants import (
     MENU_TIMEOUT,
+    ROUND_OFF_DP,
     SUPPORTED_CURRENCY,
     UNDO_TIMEOUT,
     UNIFIED_CURRENCY,
 )
+from expression import ExpressionError, evaluate_amount
 from utils import B, amt_parser, get_mapped_name, is_valid_amount
 
 
@@ -125,7 +127,11 @@ class AmountModal(discord.ui.Modal):
     async def on_submit(self, interaction: discord.Interaction):
         try:
             if is_valid_amount(self.amount_textinput.value):
-                self.amount = str(eval(amt_parser(self.amount_textinput.value)))
+                self.amount = str(
+                    evaluate_amount(
+                        amt_parser(self.amount_textinput.value), ROUND_OFF_DP
+                    )
+                )
             else:
                 await interaction.response.send_message(
                     "Invalid amount!", ephemeral=True
@@ -134,6 +140,10 @@ class AmountModal(discord.ui.Modal):
             await interaction.response.send_message(
                 B("Invalid amount: Don't divide zero la..."), ephemeral=True
             )
+        except ExpressionError as e:
+            await interaction.response.send_message(
+                B(f"Invalid amount: {e}"), ephemeral=True
+            )
         except (ValueError, SyntaxError):
             await interaction.response.send_message(
                 B("What have you entered for the amount .-."), ephemeral=True
@@ -394,3 +404,63 @@ class UndoView(discord.ui.View):
             item.disabled = True
         await self.message.edit(view=self)
         self.stop()
+
+
+class PageButton(discord.ui.Button):
+    def __init__(self, label: str, step: int):
+        super().__init__(
+            label=label,
+            style=discord.ButtonStyle.secondary,
+            disabled=step < 0,  # starts on the first page
+        )
+        self.step = step
+
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+        await self.view.turn_page(self.step)
+
+
+class HistoryView(discord.ui.View):
+    """Pages through logs with one bounded query per page.
+
+    `load_page(cursor)` returns the text of the page starting at `cursor` and
+    the cursor of the next page, or None on the last page. The cursors of the
+    pages seen so far are kept to go back.
+    """
+
+    def __init__(self, owner_id: int, load_page, next_cursor):
+        super().__init__(timeout=MENU_TIMEOUT)
+
+        self.owner_id = owner_id
+        self.load_page = load_page
+        self.cursors = [None, next_cursor]  # the cursor of each page
+        self.page = 0
+
+        self.prev_btn = PageButton("Newer", -1)
+        self.next_btn = PageButton("Older", 1)
+        self.add_item(self.prev_btn)
+        self.add_item(self.next_btn)
+
+    async def turn_page(self, step: int) -> None:
+        self.page += step
+        text, next_cursor = await self.load_page(self.cursors[self.page])
+        del self.cursors[self.page + 1 :]
+        if next_cursor is not None:
+            self.cursors.append(next_cursor)
+        self.prev_btn.disabled = self.page == 0
+        self.next_btn.disabled = next_cursor is None
+        await self.message.edit(content=text, view=self)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message(
+                "You can't interrupt other users!", ephemeral=True
+            )
+            return False
+        return True
+
+    async def on_timeout(self) -> None:
+        for item in self.children:
+            item.disabled = True
+        await self.message.edit(view=self)
+        self.stop()
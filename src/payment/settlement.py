@@ -0,0 +1,47 @@
+import heapq
+from typing import Iterable
+
+
+def plan_settlement(balances: Iterable[tuple[str, int]]) -> list[tuple[str, str, int]]:
+    """
+    Plan the transfers that settle every balance.
+
+    The largest debtor repeatedly pays the largest creditor as much as they
+    can, so every transfer settles at least one user: at most n - 1 transfers
+    for n users with a balance, in O(n log n).
+
+    Args:
+        balances: Pairs of user names and balances in ledger units; positive
+            balances should receive money, negative ones need to pay.
+
+    Returns:
+        list[tuple[str, str, int]]: (payer, receiver, units) transfers.
+
+    Raises:
+        ValueError: The balances do not sum to zero.
+    """
+    creditors = []  # (-units, name), the largest credit first
+    debtors = []  # (units, name), the largest debt first
+    total = 0
+    for name, units in balances:
+        total += units
+        if units > 0:
+            creditors.append((-units, name))
+        elif units < 0:
+            debtors.append((units, name))
+    if total != 0:
+        raise ValueError("Sum of payments is not zero")
+
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        units = min(-credit, -debt)
+        transfers.append((debtor, creditor, units))
+        if -credit > units:
+            heapq.heappush(creditors, (credit + units, creditor))
+        if -debt > units:
+            heapq.heappush(debtors, (debt + units, debtor))
+    return transfers
@@ -0,0 +1,20 @@
+from payment.ledger import from_units, to_units
+
+USER_TASKS = ("create", "delete", "payment")  # tasks on the document of a user
+
+
+def coalesce_tasks(tasks: list[dict]) -> list[dict]:
+    """Merge the tasks of each user: balance deltas add up, otherwise the latest wins"""
+    latest = {}
+    for i, task in enumerate(tasks):
+        # events and snapshots are never coalesced, though events name a user
+        key = task["user"] if task["type"] in USER_TASKS else (task["type"], i)
+        previous = latest.pop(key, None)
+        if previous is not None and task["type"] == "payment":
+            if previous["type"] == "payment":
+                delta = to_units(previous["delta"]) + to_units(task["delta"])
+                task = dict(task, delta=from_units(delta))
+            else:
+                latest[(key, i)] = previous  # a create is written before the delta
+        latest[key] = task
+    return list(latest.values())
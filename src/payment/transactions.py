@@ -0,0 +1,36 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable
+
+
+class UserLocks:
+    """Per-user locks for transactions over several users.
+
+    A transaction holds the locks of all its users while it checks and
+    applies its changes, so concurrent transactions over the same users run
+    one after another. The locks are always acquired in name order, so two
+    transactions over overlapping users can never deadlock.
+    """
+
+    def __init__(self):
+        self.locks: dict[str, asyncio.Lock] = {}
+
+    @asynccontextmanager
+    async def hold(self, users: Iterable[str]) -> AsyncIterator[None]:
+        """Hold the locks of the given users for the duration of the block"""
+        locks = [self.locks.setdefault(name, asyncio.Lock()) for name in sorted(set(users))]
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def discard(self, name: str) -> None:
+        """Forget the lock of a deleted user, unless a transaction waits on it"""
+        lock = self.locks.get(name)
+        if lock is not None and not lock.locked():
+            del self.locks[name]
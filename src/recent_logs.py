@@ -0,0 +1,117 @@
+import threading
+from bisect import insort
+from datetime import datetime
+from operator import itemgetter
+
+from storage import LogRef
+
+by_time = itemgetter(0)
+
+
+class RecentLogs:
+    """A bounded buffer of the latest logs of each type.
+
+    Logs are added as the bot writes them, in timestamp order, and the
+    oldest log of a type is evicted once it has `size` logs. The buffer
+    knows the time up to which it holds every log (`since` for the logs
+    loaded at start-up, `cutoffs` for the evicted ones), so it only answers
+    requests whose whole window is newer than that.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.lock = threading.Lock()
+        self.buffers: dict[str, list[tuple[datetime, LogRef | None, dict]]] = {}
+        self.since: datetime | None = None  # None if every log is held
+        self.cutoffs: dict[str, datetime] = {}  # the latest evicted log of each type
+        self.hits = 0
+        self.misses = 0
+
+    def warm(self, logs: list[dict], limit: int) -> None:
+        """
+        Fill the buffer with the latest logs read at start-up.
+
+        Args:
+            logs: The latest logs of all types, newest first.
+            limit: The number of logs requested; if as many were returned,
+                older logs were left out.
+
+        Returns:
+            None.
+        """
+        with self.lock:
+            if len(logs) >= limit:
+                self.since = logs[-1]["timestamp"]
+            for log in reversed(logs):
+                self._add(log, None)
+
+    def _add(self, log: dict, log_ref: LogRef | None) -> None:
+        buffer = self.buffers.setdefault(log["type"], [])
+        insort(buffer, (log["timestamp"], log_ref, log), key=by_time)
+        if len(buffer) > self.size:
+            timestamp, _, _ = buffer.pop(0)
+            cutoff = self.cutoffs.get(log["type"], timestamp)
+            self.cutoffs[log["type"]] = max(cutoff, timestamp)
+
+    def add(self, log: dict, log_ref: LogRef | None = None) -> None:
+        """Add a log written by the bot"""
+        with self.lock:
+            self._add(log, log_ref)
+
+    def update(self, log_ref: LogRef, **kwargs) -> None:
+        """Update the fields of a buffered log, like `update_log`"""
+        with self.lock:
+            for buffer in self.buffers.values():
+                for _, ref, log in buffer:
+                    if ref is not None and ref == log_ref:
+                        log.update(kwargs)
+                        return
+
+    def get(self, n: int, command_type: str | None) -> list[dict] | None:
+        """
+        Return the latest n logs of a type, if the buffer holds all of them.
+
+        Args:
+            n: Number of latest logs.
+            command_type: The log type to filter by, or None for all types.
+
+        Returns:
+            list[dict] | None: Copies of the logs, newest first, or None if
+            older logs than the buffer holds would be needed.
+        """
+        page = self.get_page(n, command_type)
+        return None if page is None else page[0]
+
+    def get_page(
+        self, n: int, command_type: str | None
+    ) -> tuple[list[dict], list[LogRef | None]] | None:
+        """Return the latest n logs of a type like `get`, with their references"""
+        with self.lock:
+            if command_type:
+                entries = self.buffers.get(command_type, [])[-n:]
+                cutoffs = [self.since, self.cutoffs.get(command_type)]
+            else:
+                entries = sorted(
+                    (entry for buffer in self.buffers.values() for entry in buffer[-n:]),
+                    key=by_time,
+                )[-n:]
+                cutoffs = [self.since, *self.cutoffs.values()]
+
+            cutoffs = [cutoff for cutoff in cutoffs if cutoff is not None]
+            if cutoffs and (len(entries) < n or entries[0][0] <= max(cutoffs)):
+                self.misses += 1
+                return None
+            self.hits += 1
+            entries.reverse()
+            logs = [dict(log) for _, _, log in entries]
+            return logs, [log_ref for _, log_ref, _ in entries]
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "buffered": sum(len(buffer) for buffer in self.buffers.values()),
+            }
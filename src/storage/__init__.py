@@ -0,0 +1,28 @@
+from constants import SQLITE_PATH, STORAGE_BACKEND
+from storage.base import LogCursor, LogRef, RecordType, Storage
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    """
+    Create the storage backend selected by the STORAGE_BACKEND variable.
+
+    Args:
+        backend: Either firestore or sqlite.
+
+    Returns:
+        Storage: The storage backend.
+    """
+    match backend:
+        case "firestore":
+            from storage.firestore_storage import FirestoreStorage
+
+            return FirestoreStorage()
+        case "sqlite":
+            from storage.sqlite_storage import SQLiteStorage
+
+            return SQLiteStorage(SQLITE_PATH)
+        case _:
+            raise ValueError(f"Unknown storage backend: {backend}")
+
+
+__all__ = ["LogCursor", "LogRef", "RecordType", "Storage", "create_storage"]
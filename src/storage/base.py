@@ -0,0 +1,204 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Callable, Literal
+
+RecordType = Literal["expense", "income"]
+LogRef = Any  # a handle of a written log, only meaningful to its storage
+LogCursor = Any  # the position after a page of logs, only meaningful to its storage
+EVENT_FIELDS = ("kind", "timestamp", "payers", "payees", "units", "user")
+
+
+def seq_to_id(seq: int) -> str:
+    """Return a document id sorting in the order of the sequence number"""
+    return f"{seq:012d}"
+
+
+def to_event(task: dict) -> dict:
+    """Return the stored form of an event task of the worker"""
+    event = {"seq": task["event_seq"]}
+    event.update((key, task[key]) for key in EVENT_FIELDS if key in task)
+    return event
+
+
+class Storage(ABC):
+    """The interface of a storage backend of the bot.
+
+    Timestamps passed in are timezone-aware datetimes; timestamps returned in
+    logs and records are datetimes in the bot timezone.
+    """
+
+    @abstractmethod
+    def namespace(self, name: str) -> "Storage":
+        """
+        Return the storage of a separate ledger namespace.
+
+        The namespace has users, events, snapshots, journals and logs of its
+        own, and shares the connection of this storage where the backend can.
+        """
+
+    def close(self) -> None:
+        """Release the resources held by the storage"""
+
+    @abstractmethod
+    def fetch_payment_list(self) -> dict:
+        """Return a mapping of user names to balances"""
+
+    @abstractmethod
+    def update_user_balance(self, name: str, delta: float, timestamp: datetime) -> float:
+        """Add to the balance of a user on the server and return the new balance"""
+
+    @abstractmethod
+    def commit_batch(self, tasks: list[dict]) -> dict[str, float]:
+        """
+        Apply tasks atomically: create, delete and payment tasks of users,
+        event and snapshot tasks of the event-sourced ledger, and journal
+        tasks recording the last sequence number of a journal.
+
+        Payment tasks add their delta to the balance on the server, so
+        concurrent writers never overwrite each other.
+
+        Returns:
+            dict[str, float]: The balances after the payment tasks, as stored.
+        """
+
+    @abstractmethod
+    def get_journal_seq(self, journal_id: str) -> int:
+        """Return the last sequence number committed from a journal, 0 if none"""
+
+    def watch_users(self, on_change: Callable[[str, str, float], None]):
+        """
+        Listen to changes of the users made by anyone.
+
+        Returns:
+            The listener with an `unsubscribe()` method, or None if the backend
+            does not support listening.
+        """
+        return None
+
+    @abstractmethod
+    def claim_event_log(self, journal_id: str, now: datetime, ttl: float) -> str:
+        """
+        Claim or renew the lease on writing events, unless another instance holds it.
+
+        Args:
+            journal_id: The JOURNAL_ID of the claiming instance.
+            now: The current time.
+            ttl: The seconds the lease lasts unless renewed.
+
+        Returns:
+            str: The journal id of the holder of the lease after the call,
+            `journal_id` if the claim succeeded.
+        """
+
+    @abstractmethod
+    def release_event_log(self, journal_id: str) -> None:
+        """Release the lease on writing events, if held by `journal_id`"""
+
+    @abstractmethod
+    def get_events(
+        self, after_seq: int = 0, until: datetime | None = None
+    ) -> list[dict]:
+        """
+        Return the ledger events with a sequence number above `after_seq` in
+        order, only those up to `until` if it is given.
+        """
+
+    @abstractmethod
+    def get_latest_snapshot(self, at: datetime | None = None) -> dict | None:
+        """
+        Return the latest ledger snapshot, or the latest one taken at or before
+        `at`, as a dict of seq, timestamp and balances; None if there is none.
+        """
+
+    @abstractmethod
+    def get_payment_logs(self, n: int) -> list[dict]:
+        """Return the latest n payment logs, newest first"""
+
+    @abstractmethod
+    def get_logs(self, n: int, command_type: str | None = "payment") -> list[dict]:
+        """Return the latest n logs of a type (or of all types), newest first"""
+
+    @abstractmethod
+    def get_logs_page(
+        self, n: int, command_type: str | None, cursor: LogCursor | None
+    ) -> tuple[list[dict], LogCursor | None]:
+        """
+        Return a page of n logs, newest first, in a single bounded query.
+
+        Args:
+            n: The page size.
+            command_type: The log type to filter by, or None for all types.
+            cursor: The cursor returned with the previous page, or None for
+                the latest logs.
+
+        Returns:
+            tuple[list[dict], LogCursor | None]: The logs and the cursor of
+            the next page, or None if there are no older logs.
+        """
+
+    @abstractmethod
+    def log_cursor(self, log: dict, log_ref: LogRef | None) -> LogCursor:
+        """
+        Return the cursor of the page after a log, without a query.
+
+        Args:
+            log: The last log of a page.
+            log_ref: Its reference, if known; without it, older logs with the
+                exact same timestamp may be skipped.
+
+        Returns:
+            LogCursor: The cursor to pass to `get_logs_page`.
+        """
+
+    @abstractmethod
+    def write_bot_log(self, timestamp: datetime) -> None:
+        """Record a start of the bot"""
+
+    @abstractmethod
+    def write_log(
+        self,
+        log_type: str,
+        channel: str,
+        entered_by: str,
+        cmd: str,
+        timestamp: datetime,
+        **kwargs,
+    ) -> LogRef:
+        """Write a log and return a reference to it"""
+
+    @abstractmethod
+    def write_logs(self, logs: list[dict]) -> None:
+        """Write logs given as complete log documents in a single commit"""
+
+    @abstractmethod
+    def update_log(self, log_ref: LogRef, **kwargs) -> None:
+        """Update fields of a written log"""
+
+    @abstractmethod
+    def create_user(self, name: str, timestamp: datetime) -> None:
+        """Create a user with zero balance"""
+
+    @abstractmethod
+    def delete_user(self, name: str) -> None:
+        """Delete a user, raising ValueError if the user does not exist"""
+
+    @abstractmethod
+    def add_bookkeeping_record(
+        self,
+        username: str,
+        record_type: RecordType,
+        category: str,
+        name: str,
+        amount: float,
+        timestamp: datetime,
+    ) -> LogRef:
+        """Add a bookkeeping record and return a reference to it"""
+
+    @abstractmethod
+    def get_bookkeeping_records(
+        self,
+        n: int,
+        record_type: RecordType | None = None,
+        category: str | None = None,
+    ) -> list[dict]:
+        """Return up to n bookkeeping records matching the filters"""
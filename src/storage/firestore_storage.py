@@ -0,0 +1,290 @@
+import json
+from datetime import datetime, timedelta
+from typing import Callable
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1._helpers import decode_value
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from constants import FIREBASE_KEY, FIREBASE_KEY_PATH, TIMEZONE
+from storage.base import RecordType, Storage, seq_to_id, to_event
+
+FIRESTORE_BATCH_LIMIT = 500  # max writes of a batch
+
+
+class FirestoreStorage(Storage):
+    """Storage backed by the Firestore database of the bot"""
+
+    def __init__(
+        self,
+        db: firestore.Client | None = None,
+        root: firestore.DocumentReference | None = None,
+    ):
+        if db is None:
+            with open(FIREBASE_KEY_PATH, "w") as f:
+                json.dump(FIREBASE_KEY, f, indent=2)
+
+            cred = credentials.Certificate(FIREBASE_KEY_PATH)
+            firebase_admin.initialize_app(cred)
+            db = firestore.client()
+        self.db = db
+
+        # the collections of a namespace are subcollections of its document
+        parent = self.db if root is None else root
+        self.users_ref = parent.collection("users")
+        self.logs_ref = parent.collection("logs")
+        self.bot_ref = parent.collection("bot")
+        self.bookkeeping_ref = parent.collection("bookkeeping")
+        self.events_ref = parent.collection("events")
+        self.snapshots_ref = parent.collection("snapshots")
+        self.journals_ref = parent.collection("journals")
+        self.event_lease_ref = parent.collection("leases").document("events")
+
+    def namespace(self, name: str) -> "FirestoreStorage":
+        return FirestoreStorage(self.db, self.db.collection("namespaces").document(name))
+
+    def fetch_payment_list(self) -> dict:
+        users = self.users_ref.stream()
+        return {user.id: user.to_dict().get("balance", 0) for user in users}
+
+    def update_user_balance(self, name: str, delta: float, timestamp: datetime) -> float:
+        return self.commit_batch(
+            [{"type": "payment", "user": name, "delta": delta, "timestamp": timestamp}]
+        )[name]
+
+    def commit_batch(self, tasks: list[dict]) -> dict[str, float]:
+        batch = self.db.batch()
+        for task in tasks:
+            match task["type"]:
+                case "create":
+                    batch.set(
+                        self.users_ref.document(task["user"]),
+                        {
+                            "balance": 0,
+                            "lastUpdated": task["timestamp"].astimezone(TIMEZONE),
+                        },
+                    )
+                case "delete":
+                    batch.delete(self.users_ref.document(task["user"]))
+                case "payment":
+                    batch.set(
+                        self.users_ref.document(task["user"]),
+                        {
+                            "balance": firestore.Increment(task["delta"]),
+                            "lastUpdated": task["timestamp"].astimezone(TIMEZONE),
+                        },
+                        merge=True,
+                    )
+                case "event":
+                    event = to_event(task)
+                    batch.set(self.events_ref.document(seq_to_id(event["seq"])), event)
+                case "snapshot":
+                    batch.set(
+                        self.snapshots_ref.document(seq_to_id(task["event_seq"])),
+                        {
+                            "seq": task["event_seq"],
+                            "timestamp": task["timestamp"].astimezone(TIMEZONE),
+                            "balances": task["balances"],
+                        },
+                    )
+                case "journal":
+                    batch.set(
+                        self.journals_ref.document(task["journal"]),
+                        {"lastSeq": task["seq"]},
+                    )
+        results = batch.commit()
+
+        # the write results are in task order; an increment returns the new value
+        balances = {}
+        for task, result in zip(tasks, results):
+            if task["type"] == "payment":
+                balances[task["user"]] = decode_value(
+                    result.transform_results[0], self.db
+                )
+        return balances
+
+    def get_journal_seq(self, journal_id: str) -> int:
+        journal = self.journals_ref.document(journal_id).get()
+        return journal.to_dict()["lastSeq"] if journal.exists else 0
+
+    def claim_event_log(self, journal_id: str, now: datetime, ttl: float) -> str:
+        @firestore.transactional
+        def claim(transaction: firestore.Transaction) -> str:
+            lease = self.event_lease_ref.get(transaction=transaction)
+            if lease.exists:
+                holder, expires = lease.get("holder"), lease.get("expires")
+                if holder != journal_id and expires >= now:
+                    return holder
+            transaction.set(
+                self.event_lease_ref,
+                {"holder": journal_id, "expires": now + timedelta(seconds=ttl)},
+            )
+            return journal_id
+
+        return claim(self.db.transaction())
+
+    def release_event_log(self, journal_id: str) -> None:
+        @firestore.transactional
+        def release(transaction: firestore.Transaction) -> None:
+            lease = self.event_lease_ref.get(transaction=transaction)
+            if lease.exists and lease.get("holder") == journal_id:
+                transaction.delete(self.event_lease_ref)
+
+        release(self.db.transaction())
+
+    def get_events(
+        self, after_seq: int = 0, until: datetime | None = None
+    ) -> list[dict]:
+        query = self.events_ref.where(filter=FieldFilter("seq", ">", after_seq))
+        if until is not None:
+            query = query.where(
+                filter=FieldFilter("timestamp", "<=", until.astimezone(TIMEZONE))
+            )
+        return [event.to_dict() for event in query.order_by("seq").stream()]
+
+    def get_latest_snapshot(self, at: datetime | None = None) -> dict | None:
+        if at is None:
+            query = self.snapshots_ref.order_by(
+                "seq", direction=firestore.Query.DESCENDING
+            )
+        else:
+            query = self.snapshots_ref.where(
+                filter=FieldFilter("timestamp", "<=", at.astimezone(TIMEZONE))
+            ).order_by("timestamp", direction=firestore.Query.DESCENDING)
+        snapshots = [snapshot.to_dict() for snapshot in query.limit(1).stream()]
+        return snapshots[0] if snapshots else None
+
+    def watch_users(self, on_change: Callable[[str, str, float], None]):
+        def on_snapshot(docs, changes, read_time):
+            for change in changes:
+                balance = (change.document.to_dict() or {}).get("balance", 0)
+                on_change(change.type.name, change.document.id, balance)
+
+        return self.users_ref.on_snapshot(on_snapshot)
+
+    def get_payment_logs(self, n: int) -> list[dict]:
+        latest_payment_logs = (
+            self.logs_ref.where(filter=FieldFilter("type", "==", "payment"))
+            .order_by("timestamp", direction=firestore.Query.DESCENDING)
+            .limit(n)
+            .stream()
+        )
+        return [log.to_dict() for log in latest_payment_logs]
+
+    def get_logs(self, n: int, command_type: str | None = "payment") -> list[dict]:
+        logs = self.logs_ref
+        if command_type:
+            logs = logs.where(filter=FieldFilter("type", "==", command_type))
+        logs = (
+            logs.order_by("timestamp", direction=firestore.Query.DESCENDING)
+            .limit(n)
+            .stream()
+        )
+        return [log.to_dict() for log in logs]
+
+    def get_logs_page(
+        self,
+        n: int,
+        command_type: str | None,
+        cursor: firestore.DocumentSnapshot | None,
+    ) -> tuple[list[dict], firestore.DocumentSnapshot | None]:
+        logs = self.logs_ref
+        if command_type:
+            logs = logs.where(filter=FieldFilter("type", "==", command_type))
+        logs = logs.order_by("timestamp", direction=firestore.Query.DESCENDING)
+        if cursor is not None:
+            logs = logs.start_after(cursor)
+        docs = list(logs.limit(n + 1).stream())  # one more to tell if there is a next page
+        next_cursor = docs[n - 1] if len(docs) > n else None
+        return [doc.to_dict() for doc in docs[:n]], next_cursor
+
+    def log_cursor(
+        self, log: dict, log_ref: firestore.DocumentReference | None
+    ) -> dict:
+        # pages are ordered by timestamp alone, so its value is a cursor
+        return {"timestamp": log["timestamp"]}
+
+    def write_bot_log(self, timestamp: datetime) -> None:
+        self.bot_ref.add(
+            {
+                "startTime": timestamp,
+            }
+        )
+
+    def write_log(
+        self,
+        log_type: str,
+        channel: str,
+        entered_by: str,
+        cmd: str,
+        timestamp: datetime,
+        **kwargs,
+    ) -> firestore.DocumentReference:
+        log_data = {
+            "type": log_type,
+            "timestamp": timestamp.astimezone(TIMEZONE),
+            "channel": channel,
+            "enteredBy": entered_by,
+            "command": cmd,
+        }
+        log_data.update(kwargs)
+        return self.logs_ref.add(log_data)[1]
+
+    def write_logs(self, logs: list[dict]) -> None:
+        for start in range(0, len(logs), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for log_data in logs[start : start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(self.logs_ref.document(), log_data)
+            batch.commit()
+
+    def update_log(self, log_ref: firestore.DocumentReference, **kwargs) -> None:
+        log_ref.update(kwargs)
+
+    def create_user(self, name: str, timestamp: datetime) -> None:
+        self.users_ref.document(name).set(
+            {
+                "balance": 0,
+                "lastUpdated": timestamp.astimezone(TIMEZONE),
+            }
+        )
+
+    def delete_user(self, name: str) -> None:
+        user_ref = self.users_ref.document(name)
+        if user_ref.get().exists:
+            user_ref.delete()
+        else:
+            raise ValueError(f"User {name} does not exist.")
+
+    def add_bookkeeping_record(
+        self,
+        username: str,
+        record_type: RecordType,
+        category: str,
+        name: str,
+        amount: float,
+        timestamp: datetime,
+    ) -> firestore.DocumentReference:
+        record_data = {
+            "timestamp": timestamp.astimezone(TIMEZONE),
+            "username": username,
+            "type": record_type,
+            "category": category,
+            "name": name,
+            "amount": amount,
+        }
+        return self.bookkeeping_ref.add(record_data)[1]
+
+    def get_bookkeeping_records(
+        self,
+        n: int,
+        record_type: RecordType | None = None,
+        category: str | None = None,
+    ) -> list[dict]:
+        query = self.bookkeeping_ref
+        if record_type:
+            query = query.where("type", "==", record_type)
+        if category:
+            query = query.where("category", "==", category)
+        docs = query.limit(n).stream()
+        return [doc.to_dict() for doc in docs]
@@ -0,0 +1,367 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from constants import TIMEZONE
+from storage.base import RecordType, Storage, to_event
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    balance REAL NOT NULL DEFAULT 0,
+    last_updated TEXT
+);
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_type_timestamp ON logs (type, timestamp);
+CREATE INDEX IF NOT EXISTS logs_timestamp ON logs (timestamp);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    seq INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    balances TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_timestamp ON snapshots (timestamp);
+CREATE TABLE IF NOT EXISTS event_lease (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS journals (
+    id TEXT PRIMARY KEY,
+    last_seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bot (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    start_time TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bookkeeping (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    username TEXT NOT NULL,
+    type TEXT NOT NULL,
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    amount REAL NOT NULL
+);
+"""
+
+
+def to_text(timestamp: datetime) -> str:
+    """Return the timestamp as sortable text in the bot timezone"""
+    return timestamp.astimezone(TIMEZONE).isoformat()
+
+
+def from_text(text: str) -> datetime:
+    return datetime.fromisoformat(text).astimezone(TIMEZONE)
+
+
+class SQLiteStorage(Storage):
+    """Storage backed by a local SQLite database in WAL mode.
+
+    Logs are stored as JSON with the same fields as the Firestore documents,
+    and the log reference is the row id.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()  # the worker thread shares the connection
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+
+    def namespace(self, name: str) -> "SQLiteStorage":
+        root, ext = os.path.splitext(self.path)
+        return SQLiteStorage(f"{root}.{name}{ext}")  # a database file of its own
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def fetch_payment_list(self) -> dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT name, balance FROM users").fetchall()
+        return {row["name"]: row["balance"] for row in rows}
+
+    def update_user_balance(self, name: str, delta: float, timestamp: datetime) -> float:
+        return self.commit_batch(
+            [{"type": "payment", "user": name, "delta": delta, "timestamp": timestamp}]
+        )[name]
+
+    def commit_batch(self, tasks: list[dict]) -> dict[str, float]:
+        balances = {}
+        with self.lock, self.conn:
+            for task in tasks:
+                match task["type"]:
+                    case "create":
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO users (name, balance, last_updated) "
+                            "VALUES (?, 0, ?)",
+                            (task["user"], to_text(task["timestamp"])),
+                        )
+                    case "delete":
+                        self.conn.execute(
+                            "DELETE FROM users WHERE name = ?", (task["user"],)
+                        )
+                    case "payment":
+                        row = self.conn.execute(
+                            "INSERT INTO users (name, balance, last_updated) "
+                            "VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET "
+                            "balance = balance + excluded.balance, "
+                            "last_updated = excluded.last_updated RETURNING balance",
+                            (task["user"], task["delta"], to_text(task["timestamp"])),
+                        ).fetchone()
+                        balances[task["user"]] = row["balance"]
+                    case "event":
+                        event = to_event(task)
+                        timestamp = to_text(event.pop("timestamp"))
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO events (seq, timestamp, data) "
+                            "VALUES (?, ?, ?)",
+                            (event["seq"], timestamp, json.dumps(event)),
+                        )
+                    case "snapshot":
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO snapshots (seq, timestamp, balances) "
+                            "VALUES (?, ?, ?)",
+                            (
+                                task["event_seq"],
+                                to_text(task["timestamp"]),
+                                json.dumps(task["balances"]),
+                            ),
+                        )
+                    case "journal":
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO journals (id, last_seq) VALUES (?, ?)",
+                            (task["journal"], task["seq"]),
+                        )
+        return balances
+
+    def get_journal_seq(self, journal_id: str) -> int:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_seq FROM journals WHERE id = ?", (journal_id,)
+            ).fetchone()
+        return row["last_seq"] if row else 0
+
+    def claim_event_log(self, journal_id: str, now: datetime, ttl: float) -> str:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO event_lease (id, holder, expires) VALUES (0, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET "
+                "holder = excluded.holder, expires = excluded.expires "
+                "WHERE holder = excluded.holder OR expires < ?",
+                (journal_id, now.timestamp() + ttl, now.timestamp()),
+            )
+            row = self.conn.execute("SELECT holder FROM event_lease").fetchone()
+        return row["holder"]
+
+    def release_event_log(self, journal_id: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM event_lease WHERE holder = ?", (journal_id,))
+
+    def get_events(
+        self, after_seq: int = 0, until: datetime | None = None
+    ) -> list[dict]:
+        query, params = "SELECT timestamp, data FROM events WHERE seq > ?", [after_seq]
+        if until is not None:
+            query += " AND timestamp <= ?"
+            params.append(to_text(until))
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY seq", params).fetchall()
+        return [
+            dict(json.loads(row["data"]), timestamp=from_text(row["timestamp"]))
+            for row in rows
+        ]
+
+    def get_latest_snapshot(self, at: datetime | None = None) -> dict | None:
+        with self.lock:
+            if at is None:
+                row = self.conn.execute(
+                    "SELECT * FROM snapshots ORDER BY seq DESC LIMIT 1"
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT * FROM snapshots WHERE timestamp <= ? "
+                    "ORDER BY timestamp DESC LIMIT 1",
+                    (to_text(at),),
+                ).fetchone()
+        if row is None:
+            return None
+        return {
+            "seq": row["seq"],
+            "timestamp": from_text(row["timestamp"]),
+            "balances": json.loads(row["balances"]),
+        }
+
+    def _read_logs(self, query: str, params: tuple) -> list[dict]:
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        logs = []
+        for row in rows:
+            log = json.loads(row["data"])
+            log["timestamp"] = from_text(row["timestamp"])
+            logs.append(log)
+        return logs
+
+    def get_payment_logs(self, n: int) -> list[dict]:
+        return self.get_logs(n, "payment")
+
+    def get_logs(self, n: int, command_type: str | None = "payment") -> list[dict]:
+        if command_type:
+            return self._read_logs(
+                "SELECT timestamp, data FROM logs WHERE type = ? "
+                "ORDER BY timestamp DESC LIMIT ?",
+                (command_type, n),
+            )
+        return self._read_logs(
+            "SELECT timestamp, data FROM logs ORDER BY timestamp DESC LIMIT ?", (n,)
+        )
+
+    def get_logs_page(
+        self, n: int, command_type: str | None, cursor: tuple[str, int] | None
+    ) -> tuple[list[dict], tuple[str, int] | None]:
+        conditions, params = [], []
+        if command_type:
+            conditions.append("type = ?")
+            params.append(command_type)
+        if cursor is not None:
+            conditions.append("(timestamp, id) < (?, ?)")
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, timestamp, data FROM logs {where}"
+                "ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (*params, n + 1),  # one more to tell if there is a next page
+            ).fetchall()
+        next_cursor = None
+        if len(rows) > n:
+            next_cursor = (rows[n - 1]["timestamp"], rows[n - 1]["id"])
+        logs = []
+        for row in rows[:n]:
+            log = json.loads(row["data"])
+            log["timestamp"] = from_text(row["timestamp"])
+            logs.append(log)
+        return logs, next_cursor
+
+    def log_cursor(self, log: dict, log_ref: int | None) -> tuple[str, int]:
+        return to_text(log["timestamp"]), log_ref or 0
+
+    def write_bot_log(self, timestamp: datetime) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO bot (start_time) VALUES (?)", (to_text(timestamp),)
+            )
+
+    def write_log(
+        self,
+        log_type: str,
+        channel: str,
+        entered_by: str,
+        cmd: str,
+        timestamp: datetime,
+        **kwargs,
+    ) -> int:
+        log_data = {
+            "type": log_type,
+            "channel": channel,
+            "enteredBy": entered_by,
+            "command": cmd,
+        }
+        log_data.update(kwargs)
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO logs (type, timestamp, data) VALUES (?, ?, ?)",
+                (log_type, to_text(timestamp), json.dumps(log_data)),
+            )
+        return cursor.lastrowid
+
+    def write_logs(self, logs: list[dict]) -> None:
+        rows = []
+        for log in logs:
+            log_data = {key: value for key, value in log.items() if key != "timestamp"}
+            rows.append((log["type"], to_text(log["timestamp"]), json.dumps(log_data)))
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO logs (type, timestamp, data) VALUES (?, ?, ?)", rows
+            )
+
+    def update_log(self, log_ref: int, **kwargs) -> None:
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT data FROM logs WHERE id = ?", (log_ref,)
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Log {log_ref} does not exist.")
+            log_data = json.loads(row["data"])
+            log_data.update(kwargs)
+            self.conn.execute(
+                "UPDATE logs SET data = ? WHERE id = ?",
+                (json.dumps(log_data), log_ref),
+            )
+
+    def create_user(self, name: str, timestamp: datetime) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO users (name, balance, last_updated) "
+                "VALUES (?, 0, ?)",
+                (name, to_text(timestamp)),
+            )
+
+    def delete_user(self, name: str) -> None:
+        with self.lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM users WHERE name = ?", (name,))
+        if cursor.rowcount == 0:
+            raise ValueError(f"User {name} does not exist.")
+
+    def add_bookkeeping_record(
+        self,
+        username: str,
+        record_type: RecordType,
+        category: str,
+        name: str,
+        amount: float,
+        timestamp: datetime,
+    ) -> int:
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO bookkeeping "
+                "(timestamp, username, type, category, name, amount) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (to_text(timestamp), username, record_type, category, name, amount),
+            )
+        return cursor.lastrowid
+
+    def get_bookkeeping_records(
+        self,
+        n: int,
+        record_type: RecordType | None = None,
+        category: str | None = None,
+    ) -> list[dict]:
+        query = "SELECT timestamp, username, type, category, name, amount FROM bookkeeping"
+        filters, params = [], []
+        if record_type:
+            filters.append("type = ?")
+            params.append(record_type)
+        if category:
+            filters.append("category = ?")
+            params.append(category)
+        if filters:
+            query += " WHERE " + " AND ".join(filters)
+        with self.lock:
+            rows = self.conn.execute(query + " LIMIT ?", (*params, n)).fetchall()
+        return [dict(row, timestamp=from_text(row["timestamp"])) for row in rows]
@@ -1,5 +1,15 @@
 import discord
-from constants import EMOJI_MAPPING, PAYMENT_CHANNEL_ID, USER_MAPPING, VALID_CHARS_SET
+from constants import (
+    EMOJI_MAPPING,
+    LEDGER_GUILDS,
+    PAYMENT_CHANNEL_ID,
+    USER_MAPPING,
+    VALID_CHARS_SET,
+)
+
+PAYMENT_CHANNEL_IDS = {PAYMENT_CHANNEL_ID} | {
+    payment_channel for payment_channel, _ in LEDGER_GUILDS.values()
+}
 
 
 def B(text: str) -> str:
@@ -17,10 +27,33 @@ def U(text: str) -> str:
     return f"__{text}__"
 
 
+def split_text(lines: list[str], limit: int = 2000) -> list[str]:
+    """
+    Join lines into as few messages as possible within the length limit.
+
+    Args:
+        lines: The lines to send; each line must fit the limit.
+        limit: The maximum length of a message.
+
+    Returns:
+        list[str]: The messages.
+    """
+    messages = []
+    current = ""
+    for line in lines:
+        if current and len(current) + 1 + len(line) > limit:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
 def channel_to_text(channel) -> str:
     """Return the channel name from the channel ID"""
     try:
-        if getattr(channel, "id", None) == PAYMENT_CHANNEL_ID:
+        if getattr(channel, "id", None) in PAYMENT_CHANNEL_IDS:
             return "payment"
         # DMChannel objects represent private (direct message) channels
         if isinstance(channel, discord.DMChannel):
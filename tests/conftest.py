@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+
+# the channel ids constants.py requires; any value does outside Discord
+os.environ.setdefault("PAYMENT_CHANNEL_ID", "1")
+os.environ.setdefault("LOG_CHANNEL_ID", "2")
+# modules that open the storage on import use a throwaway SQLite database,
+# and the firebase worker a throwaway journal
+DATA = tempfile.mkdtemp(prefix="payment-bot-")
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(DATA, "test.db"))
+os.environ.setdefault("JOURNAL_PATH", os.path.join(DATA, "test.journal"))
+os.environ.setdefault("FIREBASE_RETRY_INTERVAL", "0.1")
+
+sys.path.insert(0, os.path.join(TESTS, "..", "src"))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def firebase_worker():
+    """Stop the firebase worker, which importing payment_logic starts"""
+    yield
+    if "payment.payment_logic" in sys.modules:
+        sys.modules["payment.payment_logic"].terminate_worker()
@@ -0,0 +1,88 @@
+import math
+from datetime import datetime
+
+import firebase_manager
+import payment.event_store
+from payment.event_store import EventStore, apply_event, ledger_from_snapshot
+from payment.ledger import Ledger
+
+NOW = datetime(2024, 1, 1)
+
+
+def test_snapshot_of_a_batch_follows_its_last_event():
+    ledger = Ledger()
+    ledger.add("a")
+    ledger.add("b")
+    store = EventStore(snapshot_interval=2)
+    store.lease_expires = math.inf  # as if load() had claimed the lease
+    store.snapshot_task(ledger, NOW)
+    batch = [(["a"], ["b"], 1000)] * 3
+    ledger.apply(batch)
+    events = [
+        {
+            "kind": "payment",
+            "timestamp": NOW,
+            "payers": payers,
+            "payees": payees,
+            "units": units,
+        }
+        for payers, payees, units in batch
+    ]
+
+    tasks = store.record(events, ledger)
+
+    snapshots = [task for task in tasks if task["type"] == "snapshot"]
+    assert tasks[-1] is snapshots[0] and len(snapshots) == 1
+    replayed = ledger_from_snapshot(snapshots[0])
+    for task in tasks:
+        if task["type"] == "event" and task["event_seq"] > snapshots[0]["event_seq"]:
+            apply_event(replayed, task)
+    assert dict(replayed.items()) == dict(ledger.items()) == {"a": -3000, "b": 3000}
+
+
+def test_no_events_are_recorded_once_the_lease_expired():
+    ledger = Ledger()
+    ledger.add("a")
+    store = EventStore(snapshot_interval=1)
+    store.lease_expires = 0.0  # ran out while renewals failed
+    event = {"kind": "create", "timestamp": NOW, "user": "a"}
+
+    assert store.record([event], ledger) == []
+    store.lease_expires = math.inf  # a late renewal never resumes recording
+    assert store.record([event], ledger) == []
+
+
+def test_load_waits_for_the_lease_of_another_instance(monkeypatch):
+    monkeypatch.setattr(payment.event_store, "EVENT_LEASE_TTL", 0.5)
+    firebase_manager.claim_event_log("previous instance", 0.2)
+    store = EventStore(snapshot_interval=10)
+
+    store.load(Ledger)
+    try:
+        assert store.record([{"kind": "create", "timestamp": NOW, "user": "a"}], Ledger())
+    finally:
+        store.close()
+
+
+def test_rebuild_stops_at_the_given_time():
+    store = EventStore(snapshot_interval=10, namespace="777")
+    store.lease_expires = math.inf
+    ledger = Ledger()
+    ledger.add("a")
+    ledger.add("b")
+    firebase_manager.commit_batch([store.snapshot_task(ledger, NOW)], "777")
+    for day in (2, 3):
+        ledger.apply([(["a"], ["b"], 1000)])
+        event = {
+            "kind": "payment",
+            "timestamp": datetime(2024, 1, day),
+            "payers": ["a"],
+            "payees": ["b"],
+            "units": 1000,
+        }
+        firebase_manager.commit_batch(store.record([event], ledger), "777")
+
+    at = datetime(2024, 1, 2, 12)
+    assert len(firebase_manager.get_events(0, "777", at)) == 1
+    assert dict(store.rebuild(at).items()) == {"a": -1000, "b": 1000}
+    firebase_manager.close_namespace("777")
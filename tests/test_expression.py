@@ -0,0 +1,43 @@
+from fractions import Fraction
+
+import pytest
+
+from expression import ExpressionError, evaluate, evaluate_amount
+
+LARGEST_BELOW_2_1024 = "((2**100)**10*2**23 + ((2**100)**10*2**23 - 1))"
+
+
+def test_division_is_exact():
+    assert evaluate("1/3*3") == 1
+    assert evaluate("0.1+0.2") == Fraction(3, 10)
+    assert evaluate_amount("(120+36)*1.1/3", 3) == 57.2
+
+
+def test_division_by_zero_raises():
+    with pytest.raises(ZeroDivisionError):
+        evaluate("1/(2-2)")
+
+
+def test_power_tower_is_rejected():
+    with pytest.raises(ExpressionError):
+        evaluate("9**9**9")
+
+
+def test_complex_result_is_rejected():
+    with pytest.raises(ExpressionError):
+        evaluate("(-8)**0.5")
+
+
+@pytest.mark.parametrize(
+    "expr", ["(2**0.5*(10**100)**2)**2", f"2**0.5 * {LARGEST_BELOW_2_1024}"]
+)
+def test_float_overflow_is_rejected_with_its_cause(expr):
+    with pytest.raises(ExpressionError) as error:
+        evaluate(expr)
+    assert isinstance(error.value.__cause__, OverflowError)
+
+
+@pytest.mark.parametrize("expr", ['__import__("os")', "'a'*3", "x+1", "1 if 1 else 2"])
+def test_anything_but_arithmetic_is_rejected(expr):
+    with pytest.raises(ExpressionError):
+        evaluate(expr)
@@ -0,0 +1,94 @@
+import os
+from datetime import datetime
+
+from payment.journal import Journal
+
+NOW = datetime(2024, 1, 1)
+
+
+def payment(user: str, delta: float) -> dict:
+    return {"type": "payment", "user": user, "delta": delta, "timestamp": NOW}
+
+
+def crash(journal: Journal) -> Journal:
+    """Drop a journal without syncing it, then open it again like a restart"""
+    journal.file.close()
+    return Journal(journal.path, 60, 1 << 20)
+
+
+def test_unacknowledged_units_are_replayed_after_a_crash(tmp_path):
+    journal = Journal(str(tmp_path / "queue.journal"), 60, 1 << 20)
+    journal.append([payment("a", -1.5), payment("b", 1.5)])
+    journal.append([payment("a", -2.0), payment("c", 2.0)])
+    journal.ack(1, 2)
+
+    journal = crash(journal)
+    committed = []
+    journal.replay(lambda batch: committed.append(batch), batch_size=500)
+
+    assert [[(t["user"], t["delta"]) for t in batch] for batch in committed] == [
+        [("a", -2.0), ("c", 2.0)]
+    ]
+    assert committed[0][0]["timestamp"] == NOW
+    assert os.path.getsize(journal.path) == 0 and not journal.pending()
+
+
+def test_tasks_up_to_the_commit_marker_are_not_replayed(tmp_path):
+    journal = Journal(str(tmp_path / "queue.journal"), 60, 1 << 20)
+    journal.append([payment("a", -1.5), payment("b", 1.5)])
+    journal.append([payment("a", -2.0), payment("c", 2.0)])
+
+    journal = crash(journal)
+
+    assert [task["seq"] for task in journal.pending(committed_seq=2)] == [3, 4]
+
+
+def test_unit_torn_by_a_crash_is_dropped_as_a_whole(tmp_path):
+    journal = Journal(str(tmp_path / "queue.journal"), 60, 1 << 20)
+    journal.append([payment("a", -1.5), payment("b", 1.5)])
+    journal.append([payment("a", -2.0), payment("c", 2.0)])
+    journal.file.close()
+    with open(journal.path, "r+", encoding="utf-8") as f:
+        f.truncate(os.path.getsize(journal.path) - 10)  # half the last line
+
+    journal = Journal(journal.path, 60, 1 << 20)
+
+    assert [task["seq"] for task in journal.pending()] == [1, 2]
+    journal.append([payment("d", 1.0)])  # on a line and past the torn unit
+    assert [task["seq"] for task in crash(journal).pending()] == [1, 2, 5]
+
+
+def test_replay_never_splits_a_unit_and_numbers_on_from_the_marker(tmp_path):
+    journal = Journal(str(tmp_path / "queue.journal"), 60, 1 << 20)
+    journal.append([payment("a", -1.0), payment("b", 1.0)])
+    journal.append([payment("a", -1.0), payment("b", 0.5), payment("c", 0.5)])
+
+    journal = crash(journal)
+    committed = []
+    journal.replay(lambda batch: committed.append(batch), 1, committed_seq=7)
+    assert committed == []
+
+    journal = Journal(journal.path, 60, 1 << 20)
+    journal.append([payment("a", -1.0), payment("b", 1.0)])
+    journal.append([payment("a", -1.0), payment("b", 0.5), payment("c", 0.5)])
+    journal = crash(journal)
+    journal.replay(lambda batch: committed.append(batch), batch_size=1)
+    assert [[task["seq"] for task in batch] for batch in committed] == [
+        [1, 2],
+        [3, 4, 5],
+    ]
+    journal.append([payment("a", 1.0)])
+    assert journal.seq == 6
+
+
+def test_journal_is_truncated_once_everything_is_acknowledged(tmp_path):
+    journal = Journal(str(tmp_path / "queue.journal"), 60, compact_size=1)
+    journal.append([payment("a", -1.5), payment("b", 1.5)])
+    journal.append([payment("a", -2.0), payment("c", 2.0)])
+
+    journal.ack(1, 2)
+    assert os.path.getsize(journal.path) > 0
+    journal.ack(3, 4)
+
+    assert os.path.getsize(journal.path) == 0 and not journal.unacked
+    journal.close()
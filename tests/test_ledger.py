@@ -0,0 +1,36 @@
+import pytest
+
+from expression import ExpressionError, evaluate_amount
+from payment.ledger import Ledger, to_units
+
+
+def test_amount_larger_than_the_maximum_is_rejected():
+    with pytest.raises(ExpressionError):
+        evaluate_amount("9*10**15", 3)
+    with pytest.raises(ExpressionError):
+        evaluate_amount("10**20", 3)
+    assert evaluate_amount("10**9", 3) == 10**9
+
+
+def test_batch_overflowing_a_balance_is_not_applied():
+    ledger = Ledger()
+    ledger.add("a")
+    ledger.add("b")
+    units = to_units(9 * 10**15)
+
+    ledger.apply([(["a"], ["b"], units)])
+    with pytest.raises(OverflowError):
+        ledger.apply([(["a"], ["b"], units)])
+
+    assert dict(ledger.items()) == {"a": -units, "b": units}
+
+
+def test_batch_ending_within_range_is_applied():
+    ledger = Ledger()
+    ledger.add("a")
+    ledger.add("b")
+    units = to_units(9 * 10**15)
+
+    ledger.apply([(["a"], ["b"], units), (["b"], ["a"], units), (["a"], ["b"], 1)])
+
+    assert dict(ledger.items()) == {"a": -1, "b": 1}
@@ -0,0 +1,22 @@
+import asyncio
+
+import firebase_manager
+from log_pipeline import AuditLogPipeline
+
+
+def test_logs_are_written_to_the_namespace_they_were_submitted_for():
+    async def submit_all() -> None:
+        pipeline = AuditLogPipeline(flush_interval=0.05)
+        pipeline.start()
+        await pipeline.submit("manage", "guild", "alice", "undo", None, "111")
+        await pipeline.submit("manage", "default", "bob", "!switch")
+        await pipeline.close()
+
+    asyncio.run(submit_all())
+
+    guild_logs = firebase_manager.get_logs(10, "manage", "111")
+    default_logs = firebase_manager.get_logs(10, "manage")
+    assert [log["command"] for log in guild_logs] == ["undo"]
+    assert "undo" not in [log["command"] for log in default_logs]
+    assert "!switch" in [log["command"] for log in default_logs]
+    firebase_manager.close_namespace("111")
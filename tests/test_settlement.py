@@ -0,0 +1,43 @@
+from collections import Counter
+
+import pytest
+
+from payment.settlement import plan_settlement
+
+
+def settle(balances: dict[str, int]) -> list[tuple[str, str, int]]:
+    transfers = plan_settlement(balances.items())
+    settled = Counter(balances)
+    for payer, receiver, units in transfers:
+        assert units > 0
+        settled[payer] += units
+        settled[receiver] -= units
+    assert not any(settled.values())
+    return transfers
+
+
+def test_balances_are_settled_in_at_most_one_transfer_fewer_than_users():
+    balances = {"a": -7000, "b": -2500, "c": 500, "d": 3000, "e": 6000, "f": 0}
+    transfers = settle(balances)
+    assert len(transfers) <= len([units for units in balances.values() if units]) - 1
+
+
+def test_opposite_balances_settle_in_one_transfer_each():
+    assert settle({"a": -5000, "b": 5000}) == [("a", "b", 5000)]
+    assert len(settle({"a": -3000, "b": -2000, "c": 5000})) == 2
+
+
+def test_nobody_both_pays_and_receives():
+    transfers = settle({"a": -4000, "b": -1000, "c": 2500, "d": 2500})
+    payers = {payer for payer, _, _ in transfers}
+    receivers = {receiver for _, receiver, _ in transfers}
+    assert not payers & receivers
+
+
+def test_settled_ledger_needs_no_transfer():
+    assert settle({"a": 0, "b": 0}) == []
+
+
+def test_balances_not_summing_to_zero_are_rejected():
+    with pytest.raises(ValueError):
+        plan_settlement([("a", -1000), ("b", 999)])
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from payment.tasks import coalesce_tasks
+
+NOW = datetime(2024, 1, 1)
+
+
+def test_user_task_is_kept_next_to_its_event():
+    create = {"type": "create", "user": "alice", "timestamp": NOW}
+    event = {"type": "event", "event_seq": 1, "kind": "create", "user": "alice"}
+    assert coalesce_tasks([create, event]) == [create, event]
+
+
+def test_deltas_of_a_user_add_up_around_events():
+    tasks = [
+        {"type": "payment", "user": "alice", "delta": -1.5, "timestamp": NOW},
+        {"type": "event", "event_seq": 1, "kind": "payment", "payers": ["alice"]},
+        {"type": "payment", "user": "alice", "delta": -2.25, "timestamp": NOW},
+        {"type": "event", "event_seq": 2, "kind": "payment", "payers": ["alice"]},
+    ]
+    updates = coalesce_tasks(tasks)
+    assert [task["type"] for task in updates] == ["event", "payment", "event"]
+    assert updates[1]["delta"] == -3.75
+
+
+def test_create_is_written_before_the_delta():
+    create = {"type": "create", "user": "bob", "timestamp": NOW}
+    payment = {"type": "payment", "user": "bob", "delta": 4.0, "timestamp": NOW}
+    assert coalesce_tasks([create, payment]) == [create, payment]
@@ -0,0 +1,48 @@
+import time
+from datetime import datetime
+
+import firebase_manager
+from payment import payment_logic
+
+NOW = datetime(2024, 1, 1)
+
+
+def wait_written(ns, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while ns.journal.unacked:
+        assert time.monotonic() < deadline, "tasks were never written"
+        time.sleep(0.05)
+
+
+def test_batch_failing_after_its_commit_is_not_applied_twice(monkeypatch):
+    ns = payment_logic.default_ledger
+    payment_logic.queue_tasks(
+        ns,
+        [
+            {"type": "create", "user": "a", "timestamp": NOW},
+            {"type": "create", "user": "b", "timestamp": NOW},
+        ],
+    )
+    wait_written(ns)
+
+    ack = ns.journal.ack
+    failures = []
+
+    def ack_failing_once(first: int, last: int) -> None:
+        if not failures:
+            failures.append((first, last))
+            raise OSError("journal unavailable")
+        ack(first, last)
+
+    monkeypatch.setattr(ns.journal, "ack", ack_failing_once)
+    payment_logic.queue_tasks(
+        ns,
+        [
+            {"type": "payment", "user": "a", "delta": -1.5, "timestamp": NOW},
+            {"type": "payment", "user": "b", "delta": 1.5, "timestamp": NOW},
+        ],
+    )
+    wait_written(ns)
+
+    assert failures
+    assert firebase_manager.fetch_payment_list() == {"a": -1.5, "b": 1.5}